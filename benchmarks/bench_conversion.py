@@ -0,0 +1,92 @@
+"""Benchmark converting a full behavioural PLS result.
+
+Times `PLS_result_conversion` to python (as done on every result returned by
+the matlab engine) and back to matlab types (as done when saving), against
+the conversion code of a baseline revision (by default the first commit),
+read from git, in the same directions and on the same inputs. The matlab
+arrays are those of the fake engine of `fake_matlab.py`, which like the
+engine's are only sequences over flat column-major storage, so matlab is not
+needed.
+
+Usage:
+    python benchmarks/bench_conversion.py --num-boot 1000 --shape 60x2000 --repeat 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import types
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_matlab
+
+fake_matlab.install()
+
+from PLS_wrapper import native, pls
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _git(*args):
+    return subprocess.run(['git', *args], cwd=ROOT, check=True, capture_output=True,
+                          text=True).stdout
+
+def load_baseline(rev=None):
+    """Return `PLS_wrapper/pls.py` of git revision `rev` (None for the first
+    commit) as a module, for its `PLS_result_conversion`.
+    """
+    try:
+        if rev is None:
+            rev = _git('rev-list', '--max-parents=0', 'HEAD').split()[-1]
+        source = _git('show', f'{rev}:src/PLS_wrapper/pls.py')
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise SystemExit(f'cannot read the baseline pls.py from git: {e}')
+    module = types.ModuleType('baseline_pls')
+    exec(compile(source, f'{rev}:src/PLS_wrapper/pls.py', 'exec'), module.__dict__)
+    return module
+
+def _best_time(fn, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--num-boot', type=int, default=1000)
+    parser.add_argument('--num-perm', type=int, default=1000)
+    parser.add_argument('--shape', default='60x2000', help='datamat shape as ROWSxCOLS')
+    parser.add_argument('--num-behav', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', default=None,
+                        help='git revision of the baseline conversion (default: first commit)')
+    args = parser.parse_args()
+    baseline = load_baseline(args.baseline)
+
+    rows, cols = (int(n) for n in args.shape.split('x'))
+    rng = np.random.default_rng(0)
+    raw = native.pls_analysis([rng.standard_normal((rows, cols))], [rows // 2], 2,
+                              rng.standard_normal((rows, args.num_behav)),
+                              num_perm=args.num_perm, num_boot=args.num_boot, seed=1)
+    nbytes = sum(value.nbytes for value in raw.values() if isinstance(value, np.ndarray))
+    nbytes += sum(value.nbytes for struct in ['perm_result','boot_result']
+                  for value in raw[struct].values() if isinstance(value, np.ndarray))
+    # as returned by the engine
+    engine_res = fake_matlab.to_engine(raw)
+    res_py = pls.PLS_result_conversion(engine_res, convert_to='python')
+    print(f'{args.shape} datamat, {args.num_boot} boot, {args.num_perm} perm '
+          f'({nbytes / 2**20:.1f} MB of arrays)')
+    print(f'    {"direction":<10} {"baseline ms":>11} {"schema ms":>10} {"speedup":>8}')
+    for convert_to, value in [('python', engine_res), ('matlab', res_py)]:
+        t_baseline = _best_time(
+            lambda: baseline.PLS_result_conversion(value, convert_to), args.repeat)
+        t_schema = _best_time(lambda: pls.PLS_result_conversion(value, convert_to), args.repeat)
+        print(f'    {convert_to:<10} {t_baseline*1e3:>11.3f} {t_schema*1e3:>10.3f} '
+              f'{t_baseline / t_schema:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
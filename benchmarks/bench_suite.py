@@ -0,0 +1,239 @@
+"""Benchmark suite of the wrapper's hot paths, with a regression check.
+
+Runs without MATLAB: the matlab backend is driven by the fake engine of
+`fake_matlab.py`, and the analysis itself by the native backend. Times
+
+- engine acquisition (first start of a session, warm reuse, pool checkout),
+- array transfer to and from the engine ('buffer' and 'file' methods),
+- `PLS_result_conversion` to python, matlab and numpy types,
+- the matlab backend's wrapper overhead (argument transfer and result
+  conversion around the fake `pls_analysis_py` call),
+- the native fit, permutation test and bootstrap,
+
+at the given sizes, and reports the best of `--repeat` runs of each. Results
+can be saved as JSON (`--output`) and compared against a stored baseline
+(`--baseline`): cases slower than the baseline by more than `--tolerance`
+(and `--min-seconds`) are flagged as regressions and the exit status is 1.
+Baselines are only compared when they were run with the same sizes. Timings
+depend on the machine, so no baseline is shipped: create one first with
+`--update-baseline` on the machine the comparisons will run on.
+
+Usage:
+    python benchmarks/bench_suite.py --output results.json
+    python benchmarks/bench_suite.py --baseline baseline.json --update-baseline
+    python benchmarks/bench_suite.py --baseline baseline.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_matlab
+
+fake_matlab.install()
+
+from PLS_wrapper import engine, native, pls, transfer
+from PLS_wrapper.profiling import Timings
+
+SIZE_ARGS = ['subjects', 'groups', 'conditions', 'voxels', 'behaviours', 'num_perm', 'num_boot']
+
+def _best_time(fn, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def make_data(sizes, seed=0):
+    """Random datamats (one per group) and stacked behaviour data of the
+    given sizes.
+    """
+    rng = np.random.default_rng(seed)
+    rows = sizes['subjects'] * sizes['conditions']
+    datamat_lst = [rng.standard_normal((rows, sizes['voxels'])) for _ in range(sizes['groups'])]
+    behav = rng.standard_normal((rows * sizes['groups'], sizes['behaviours']))
+    return datamat_lst, [sizes['subjects']] * sizes['groups'], sizes['conditions'], behav
+
+def bench_engine(repeat):
+    def cold_start():
+        with engine.MatlabSession() as session:
+            with session.run():
+                pass
+
+    times = {'engine_start': _best_time(cold_start, repeat)}
+    with engine.MatlabSession() as session:
+        with session.run():
+            pass
+
+        def warm():
+            with session.run():
+                pass
+
+        times['engine_acquire_warm'] = _best_time(warm, repeat)
+    with engine.EnginePool(size=2) as pool:
+        with pool.run():
+            pass
+
+        def checkout():
+            with pool.run():
+                pass
+
+        times['engine_acquire_pool'] = _best_time(checkout, repeat)
+    return times
+
+def bench_transfer(datamat, repeat):
+    times = {}
+    eng = fake_matlab.start_matlab()
+    for method in ['buffer', 'file']:
+        times[f'transfer_put_{method}'] = _best_time(
+            lambda: transfer.put(eng, 'x_bench__', datamat, method), repeat)
+        times[f'transfer_get_{method}'] = _best_time(
+            lambda: transfer.get(eng, 'x_bench__', method), repeat)
+    eng.quit()
+    return times
+
+def bench_conversion(raw, repeat):
+    res_py = pls.PLS_result_conversion(raw, convert_to='python')
+    return {
+        'conversion_to_python': _best_time(
+            lambda: pls.PLS_result_conversion(raw, convert_to='python'), repeat),
+        'conversion_to_matlab': _best_time(
+            lambda: pls.PLS_result_conversion(res_py, convert_to='matlab'), repeat),
+        'conversion_to_numpy': _best_time(
+            lambda: pls.PLS_result_conversion(res_py, convert_to='numpy'), repeat),
+    }
+
+def _best_stages(run, stages, repeat):
+    """Best time of each group of stages over `repeat` runs of `run`, which
+    is called with a `Timings` to record into.
+    """
+    best = {name: np.inf for name in stages}
+    for _ in range(repeat):
+        timings = Timings()
+        run(timings)
+        seconds = timings.seconds()
+        for name, stage_names in stages.items():
+            best[name] = min(best[name], sum(seconds.get(stage, 0.0) for stage in stage_names))
+    return best
+
+def bench_matlab_backend(data, repeat):
+    datamat_lst, num_subj_lst, num_cond, behav = data
+    with engine.MatlabSession() as session:
+        def run(timings):
+            pls.pls_analysis(datamat_lst, num_subj_lst, num_cond, behav, seed=1,
+                             session=session, make_script=False, timings=timings)
+
+        return _best_stages(run, {'matlab_transfer': ['transfer'],
+                                  'matlab_conversion': ['conversion']}, repeat)
+
+def bench_native(data, sizes, repeat):
+    datamat_lst, num_subj_lst, num_cond, behav = data
+
+    def run(timings):
+        pls.pls_analysis(datamat_lst, num_subj_lst, num_cond, behav, backend='native',
+                         num_perm=sizes['num_perm'], num_boot=sizes['num_boot'], seed=1,
+                         timings=timings)
+
+    return _best_stages(run, {'native_fit': ['crosscorr', 'svd', 'scores'],
+                              'native_permutation': ['permutation'],
+                              'native_bootstrap': ['bootstrap']}, repeat)
+
+def run_suite(sizes, repeat):
+    """Run every case, returning a dict of case name to best seconds.
+    """
+    data = make_data(sizes)
+    datamat = np.concatenate(data[0])
+    # a full result as the engine returns it
+    raw = fake_matlab.to_engine(native.pls_analysis(*data, num_perm=sizes['num_perm'],
+                                                    num_boot=sizes['num_boot'], seed=1))
+    results = {}
+    results.update(bench_engine(repeat))
+    results.update(bench_transfer(datamat, repeat))
+    results.update(bench_conversion(raw, repeat))
+    results.update(bench_matlab_backend(data, repeat))
+    results.update(bench_native(data, sizes, repeat))
+    return results
+
+def compare(results, baseline, tolerance, min_seconds):
+    """Return rows of (case, baseline seconds, seconds, ratio, regressed)
+    for the cases in both runs.
+    """
+    rows = []
+    for case, seconds in results.items():
+        if case not in baseline:
+            continue
+        base = baseline[case]
+        ratio = seconds / base if base > 0 else np.inf
+        regressed = seconds > base * (1.0 + tolerance) and seconds - base > min_seconds
+        rows.append((case, base, seconds, ratio, regressed))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--subjects', type=int, default=40, help='subjects per group')
+    parser.add_argument('--groups', type=int, default=1)
+    parser.add_argument('--conditions', type=int, default=2)
+    parser.add_argument('--voxels', type=int, default=20000)
+    parser.add_argument('--behaviours', type=int, default=3)
+    parser.add_argument('--num-perm', type=int, default=200)
+    parser.add_argument('--num-boot', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='write the results to --baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown flagged as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.002,
+                        help='absolute slowdown below which nothing is flagged')
+    args = parser.parse_args()
+
+    sizes = {name: getattr(args, name) for name in SIZE_ARGS}
+    results = run_suite(sizes, args.repeat)
+    report = {
+        'sizes': sizes,
+        'repeat': args.repeat,
+        'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                    'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'time': time.time(),
+        'results': results,
+    }
+    print(', '.join(f'{name}={value}' for name, value in sizes.items()))
+    print(f'    {"case":<24} {"ms":>10}')
+    for case, seconds in results.items():
+        print(f'    {case:<24} {seconds*1e3:>10.3f}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is None:
+        return
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'baseline written to {args.baseline}')
+        return
+    if not os.path.exists(args.baseline):
+        raise SystemExit(f'no baseline at {args.baseline}, create it first with --update-baseline')
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['sizes'] != sizes:
+        raise SystemExit(f'baseline was run with sizes {baseline["sizes"]}, not {sizes}')
+    rows = compare(results, baseline['results'], args.tolerance, args.min_seconds)
+    print(f'against {args.baseline}')
+    print(f'    {"case":<24} {"baseline ms":>12} {"ms":>10} {"ratio":>7}')
+    for case, base, seconds, ratio, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f'    {case:<24} {base*1e3:>12.3f} {seconds*1e3:>10.3f} {ratio:>6.2f}x{flag}')
+    regressions = [row[0] for row in rows if row[4]]
+    if regressions:
+        raise SystemExit(f'{len(regressions)} regression(s): {", ".join(regressions)}')
+
+if __name__ == '__main__':
+    main()
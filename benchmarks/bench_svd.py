@@ -0,0 +1,66 @@
+"""Benchmark the exact and randomized decompositions of the native backend.
+
+Times the economy SVD of one cross correlation matrix (the original
+decomposition) and the Gram matrix eigendecomposition of a stack of them (the
+resamples) against randomized subspace iteration, forced on at every size, for
+a range of numbers of behaviour correlations. The ratio of behaviour
+correlations to sketch columns (`num_lv + RANDOMIZED_OVERSAMPLES`) at which
+randomized becomes faster sets `native.RANDOMIZED_MIN_RATIO` and
+`native.RANDOMIZED_MIN_RATIO_GRAM`.
+
+Usage:
+    python benchmarks/bench_svd.py --num-corr 40 80 160 320 640 --voxels 20000 --num-lv 1 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from PLS_wrapper import native
+
+def _best_time(fn, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def randomized_svd(crosscorr, num_lv):
+    q = native._range_finder(crosscorr.T, num_lv + native.RANDOMIZED_OVERSAMPLES)
+    return np.linalg.svd(q.T @ crosscorr.T, full_matrices=False)
+
+def randomized_batch(crosscorr, num_lv):
+    q = native._range_finder(crosscorr, num_lv + native.RANDOMIZED_OVERSAMPLES)
+    projected = q.transpose(0, 2, 1) @ crosscorr
+    return native.gram_svd_v(projected @ projected.transpose(0, 2, 1), num_lv)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--num-corr', type=int, nargs='+', default=[40, 80, 160, 320, 640])
+    parser.add_argument('--voxels', type=int, default=20000)
+    parser.add_argument('--num-lv', type=int, nargs='+', default=[1, 5])
+    parser.add_argument('--batch', type=int, default=8, help='resamples per stack')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f'{args.voxels} voxels, stacks of {args.batch}')
+    print(f'    {"num_corr":>8} {"num_lv":>6} {"ratio":>6} {"svd ms":>9} {"rand ms":>9} '
+          f'{"gram ms":>9} {"rand ms":>9}')
+    for num_corr in args.num_corr:
+        crosscorr = rng.standard_normal((num_corr, args.voxels))
+        stack = rng.standard_normal((args.batch, num_corr, args.voxels))
+        for num_lv in args.num_lv:
+            t_svd = _best_time(lambda: np.linalg.svd(crosscorr.T, full_matrices=False),
+                               args.repeat)
+            t_rand = _best_time(lambda: randomized_svd(crosscorr, num_lv), args.repeat)
+            t_gram = _best_time(lambda: native.gram_svd_v(stack @ stack.transpose(0, 2, 1),
+                                                          num_lv), args.repeat)
+            t_rand_batch = _best_time(lambda: randomized_batch(stack, num_lv), args.repeat)
+            ratio = num_corr / (num_lv + native.RANDOMIZED_OVERSAMPLES)
+            print(f'    {num_corr:>8} {num_lv:>6} {ratio:>6.1f} {t_svd*1e3:>9.1f} '
+                  f'{t_rand*1e3:>9.1f} {t_gram*1e3:>9.1f} {t_rand_batch*1e3:>9.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark array transfer between numpy and the matlab engine.
+
+Reports MB/s to and from the engine for the legacy path used by earlier
+versions (`matlab.double(arr.copy())` and `np.array(...)`), and for the
+'buffer' and 'file' methods of `PLS_wrapper.transfer`. With `--fake` it runs
+against the fake engine of `fake_matlab.py` instead, which only measures the
+python side of sending each method's data (copies, file writes), not the
+engine's marshalling or matlab's `fread`. The 'from matlab' rates are left
+out, as 'buffer' then reads the fake array's storage without a copy.
+
+Usage:
+    python benchmarks/bench_transfer.py --sizes 100x50000 300x200000 --repeat 3
+    python benchmarks/bench_transfer.py --fake --sizes 100x50000
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import numpy as np
+
+from PLS_wrapper import engine, transfer
+
+def _best_time(fn, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_size(eng, shape, repeat):
+    import matlab
+    arr = np.random.default_rng(0).standard_normal(shape)
+    mb = arr.nbytes / 2**20
+
+    def legacy_put():
+        eng.workspace['x_bench__'] = matlab.double(arr.copy())
+
+    def legacy_get():
+        np.array(eng.workspace['x_bench__'])
+
+    rows = []
+    for label, put_fn, get_fn in [
+        ('legacy', legacy_put, legacy_get),
+        ('buffer', lambda: transfer.put(eng, 'x_bench__', arr, 'buffer'),
+                   lambda: transfer.get(eng, 'x_bench__', 'buffer')),
+        ('file', lambda: transfer.put(eng, 'x_bench__', arr, 'file'),
+                 lambda: transfer.get(eng, 'x_bench__', 'file')),
+    ]:
+        t_put = _best_time(put_fn, repeat)
+        t_get = _best_time(get_fn, repeat)
+        rows.append((label, mb / t_put, mb / t_get))
+    eng.eval('clear x_bench__;', nargout=0)
+    return mb, rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', default=['100x50000', '300x200000'],
+                        help='array shapes as ROWSxCOLS')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--fake', action='store_true',
+                        help='run against the fake engine of fake_matlab.py')
+    args = parser.parse_args()
+
+    if args.fake:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import fake_matlab
+        fake_matlab.install()
+    elif importlib.util.find_spec('matlab') is None:
+        raise SystemExit('MATLAB Engine API for Python is required for this benchmark '
+                         '(or use --fake)')
+
+    with engine.MatlabSession() as session:
+        with session.run() as eng:
+            for size in args.sizes:
+                shape = tuple(int(n) for n in size.split('x'))
+                mb, rows = bench_size(eng, shape, args.repeat)
+                print(f'{size} float64 ({mb:.1f} MB)')
+                if args.fake:
+                    print(f'    {"method":<8} {"to matlab MB/s":>16}')
+                else:
+                    print(f'    {"method":<8} {"to matlab MB/s":>16} {"from matlab MB/s":>18}')
+                for label, to_rate, from_rate in rows:
+                    from_column = '' if args.fake else f' {from_rate:>18.1f}'
+                    print(f'    {label:<8} {to_rate:>16.1f}{from_column}')
+
+if __name__ == '__main__':
+    main()
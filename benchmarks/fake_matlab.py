@@ -0,0 +1,308 @@
+"""Stand-in for the MATLAB Engine API for Python, for benchmarks without MATLAB.
+
+`install` registers fake `matlab` and `matlab.engine` modules, so the matlab
+backend of `PLS_wrapper` runs against `FakeEngine`. Fake matlab arrays copy
+their data into a flat column-major `array.array` and are otherwise only
+sequences read element by element, as the engine's arrays are, the workspace
+is a dict, `eval` understands the commands `PLS_wrapper` sends (the `fread`
+and `fwrite` staging of `PLS_wrapper.transfer`, `class`, `size`, `clear` and
+calls of `pls_analysis_py`), and `pls_analysis_py` runs the native backend.
+Timings against the fake engine measure the wrapper's own overhead (argument
+conversion, transfer, result conversion), not matlab.
+"""
+import array
+import re
+import sys
+import threading
+import time
+import types
+from concurrent.futures import CancelledError, Future
+
+import numpy as np
+
+class _Array:
+    """Matlab numeric array like those of the engine: a sequence (of rows, of
+    elements) over a flat column-major `array.array` in `_data`, with the
+    matlab shape in `size`. Numpy only sees it as a nested sequence, so
+    `np.array(value)` reads it element by element, as with the engine.
+    """
+    typecode = 'd'
+    dtype = np.float64
+
+    def __init__(self, initializer=None, size=None, is_complex=False):
+        if initializer is None:
+            initializer = np.zeros(size or (0, 0))
+        arr = np.array(initializer, dtype=self.dtype, ndmin=2)
+        self.size = arr.shape
+        self._data = array.array(self.typecode, arr.astype(self.dtype).tobytes(order='F'))
+
+    def _index(self, prefix):
+        # flat column-major offset and stride of the elements under prefix
+        offset, stride = 0, 1
+        for axis, n in enumerate(self.size):
+            if axis < len(prefix):
+                offset += prefix[axis]*stride
+            stride *= n
+        return offset
+
+    def __len__(self):
+        return self.size[0]
+
+    def __getitem__(self, index):
+        if not isinstance(index, int):
+            raise TypeError('fake matlab arrays only take integer indices')
+        return _Row(self, (range(self.size[0])[index],))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __repr__(self):
+        return f'{type(self).__name__}(size={self.size})'
+
+class _Row:
+    """Sub-array of an `_Array` at a leading index, read element by element.
+    """
+    def __init__(self, parent, prefix):
+        self._parent = parent
+        self._prefix = prefix
+
+    def __len__(self):
+        return self._parent.size[len(self._prefix)]
+
+    def __getitem__(self, index):
+        index = range(len(self))[index]
+        prefix = self._prefix + (index,)
+        if len(prefix) == len(self._parent.size):
+            return self._parent._data[self._parent._index(prefix)]
+        return _Row(self._parent, prefix)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+def _numpy(value):
+    """ndarray of a fake matlab array (a view of its storage), or of
+    anything else `np.asarray` accepts.
+    """
+    if isinstance(value, _Array):
+        return np.frombuffer(value._data, dtype=value.dtype).reshape(value.size, order='F')
+    return np.asarray(value)
+
+def _array_class(name, typecode, dtype):
+    return type(name, (_Array,), {'typecode': typecode, 'dtype': dtype})
+
+double = _array_class('double', 'd', np.float64)
+single = _array_class('single', 'f', np.float32)
+int8 = _array_class('int8', 'b', np.int8)
+int16 = _array_class('int16', 'h', np.int16)
+int32 = _array_class('int32', 'i', np.int32)
+int64 = _array_class('int64', 'q', np.int64)
+uint8 = _array_class('uint8', 'B', np.uint8)
+uint16 = _array_class('uint16', 'H', np.uint16)
+uint32 = _array_class('uint32', 'I', np.uint32)
+uint64 = _array_class('uint64', 'Q', np.uint64)
+logical = _array_class('logical', 'B', np.bool_)
+
+_CLASSES = {cls.__name__: cls for cls in
+            [double, single, int8, int16, int32, int64, uint8, uint16, uint32, uint64, logical]}
+_CLASS_OF_DTYPE = {np.dtype(cls.dtype): name for name, cls in _CLASSES.items()}
+
+def to_engine(value):
+    """Return a value as the engine returns it: ndarrays as fake matlab
+    arrays (nested in dicts and lists), scalars and strings unchanged.
+    """
+    if isinstance(value, dict):
+        return {key: to_engine(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_engine(item) for item in value]
+    if isinstance(value, np.ndarray):
+        if value.shape == (1, 1) and value.dtype == np.float64:
+            return float(value[0, 0])
+        return _CLASSES[_CLASS_OF_DTYPE.get(value.dtype, 'double')](value)
+    return value
+
+def from_engine(value):
+    """Inverse of `to_engine`: fake matlab arrays as ndarrays.
+    """
+    if isinstance(value, dict):
+        return {key: from_engine(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [from_engine(item) for item in value]
+    if isinstance(value, _Array):
+        return _numpy(value).copy()
+    return value
+
+def _scalar(value):
+    return _numpy(value).item()
+
+class _BackgroundCall:
+    """Result of a `background=True` engine call, like the engine's
+    `FutureResult`.
+    """
+    def __init__(self, fn):
+        self._future = Future()
+        self._future.set_running_or_notify_cancel()
+        threading.Thread(target=self._run, args=(fn,), daemon=True).start()
+
+    def _run(self, fn):
+        try:
+            result = fn()
+        except BaseException as e:
+            if not self._future.done():
+                self._future.set_exception(e)
+            return
+        if not self._future.done():
+            self._future.set_result(result)
+
+    def result(self, timeout=None):
+        return self._future.result(timeout)
+
+    def done(self):
+        return self._future.done()
+
+    def cancel(self):
+        # the computation keeps running in its thread, its result is dropped
+        if not self._future.done():
+            self._future.set_exception(CancelledError())
+        return True
+
+_FREAD = re.compile(r"fid__ = fopen\('(?P<path>(?:[^']|'')*)', 'r'\); (?P<name>\w+) = "
+                    r"fread\(fid__, \[(?P<rows>\d+), (?P<cols>\d+)\], '\*(?P<cls>\w+)'\);")
+_FWRITE = re.compile(r"fid__ = fopen\('(?P<path>(?:[^']|'')*)', 'w'\); "
+                     r"fwrite\(fid__, (?P<name>\w+), '(?P<cls>\w+)'\);")
+_CALL = re.compile(r"(?P<out>\w+) = pls_analysis_py\(\{(?P<names>[\w,]*)\}, (?P<subj>\w+), "
+                   r"(?P<cond>\w+), (?P<option>\w+)\);")
+
+def _unquote(text):
+    # contents of a matlab char array literal
+    return text.replace("''", "'")
+
+class FakeEngine:
+    """Object with the parts of the matlab engine interface that
+    `PLS_wrapper` uses.
+    Parameters
+    ----------
+    startup_seconds     :   float, default=0.0. Time `start_matlab` sleeps,
+                            to stand in for the startup of a real engine.
+    """
+    def __init__(self, startup_seconds=0.0):
+        time.sleep(startup_seconds)
+        self.workspace = {}
+        self.path = []
+        self.seed = 0
+        self.closed = False
+
+    def _check(self):
+        if self.closed:
+            raise RuntimeError('engine is closed')
+
+    def quit(self):
+        self.closed = True
+        self.workspace.clear()
+
+    def addpath(self, path, nargout=0):
+        self._check()
+        self.path.insert(0, path)
+
+    def rng(self, seed, nargout=0):
+        self._check()
+        self.seed = int(_scalar(seed))
+
+    def eval(self, command, nargout=0, background=False):
+        self._check()
+        if background:
+            return _BackgroundCall(lambda: self.eval(command, nargout))
+        command = command.strip()
+        match = _FREAD.match(command)
+        if match:
+            cls = _CLASSES[match['cls']]
+            shape = (int(match['rows']), int(match['cols']))
+            arr = np.fromfile(_unquote(match['path']), dtype=cls.dtype).reshape(shape, order='F')
+            self.workspace[match['name']] = cls(arr)
+            return None
+        match = _FWRITE.match(command)
+        if match:
+            arr = _numpy(self.workspace[match['name']])
+            arr.astype(_CLASSES[match['cls']].dtype).T.tofile(_unquote(match['path']))
+            return None
+        match = _CALL.match(command)
+        if match:
+            datamat_lst = [self.workspace[name] for name in match['names'].split(',')]
+            self.workspace[match['out']] = self.pls_analysis_py(
+                datamat_lst, self.workspace[match['subj']], self.workspace[match['cond']],
+                self.workspace[match['option']])
+            return None
+        match = re.fullmatch(r'class\((\w+)\)', command)
+        if match:
+            return type(self.workspace[match[1]]).__name__
+        match = re.fullmatch(r'size\((\w+)\)', command)
+        if match:
+            return double([list(self.workspace[match[1]].size)])
+        if command.startswith('clear '):
+            for name in command[len('clear '):].rstrip(';').split():
+                self.workspace.pop(name, None)
+            return None
+        if command == '0;':
+            return None
+        raise NotImplementedError(f'FakeEngine.eval does not understand {command!r}')
+
+    def pls_analysis_py(self, datamat_lst, num_subj_lst, num_cond, option, nargout=1,
+                        background=False):
+        self._check()
+        call = lambda: self._pls_analysis(datamat_lst, num_subj_lst, num_cond, option)
+        if background:
+            return _BackgroundCall(call)
+        return call()
+
+    def _pls_analysis(self, datamat_lst, num_subj_lst, num_cond, option):
+        from PLS_wrapper import native
+        res = native.pls_analysis(
+            [_numpy(datamat) for datamat in datamat_lst],
+            [int(n) for n in _numpy(num_subj_lst).ravel()],
+            int(_scalar(num_cond)),
+            _numpy(option['stacked_behavdata']),
+            num_perm=int(_scalar(option['num_perm'])),
+            num_split=int(_scalar(option['num_split'])),
+            num_boot=int(_scalar(option['num_boot'])),
+            meancentering_type=int(_scalar(option['meancentering_type'])),
+            cormode=int(_scalar(option['cormode'])),
+            boot_type=option['boot_type'],
+            clim=float(_scalar(option['clim'])),
+            seed=self.seed,
+        )
+        return to_engine(res)
+
+    def load_pls_model_py(self, model_file, nargout=1):
+        self._check()
+        from PLS_wrapper import matio
+        # as load_pls_model_py.m: first variable, without "field_descrip"
+        res = next(iter(matio.loadmat(model_file).values()))
+        res.pop('field_descrip', None)
+        return to_engine(res)
+
+    def save(self, model_file, name, version='-v7', nargout=0):
+        self._check()
+        from PLS_wrapper import matio
+        matio.savemat(model_file, {name: from_engine(self.workspace[name])},
+                      version=version[len('-v'):])
+
+def start_matlab(startup_seconds=0.0):
+    return FakeEngine(startup_seconds)
+
+def install():
+    """Register the fake `matlab` and `matlab.engine` modules, also in the
+    `PLS_wrapper` modules already imported, and return the `matlab` module.
+    """
+    matlab = types.ModuleType('matlab')
+    for name, cls in _CLASSES.items():
+        setattr(matlab, name, cls)
+    engine = types.ModuleType('matlab.engine')
+    engine.start_matlab = start_matlab
+    engine.MatlabEngine = FakeEngine
+    matlab.engine = engine
+    sys.modules['matlab'] = matlab
+    sys.modules['matlab.engine'] = engine
+    for module_name in ['PLS_wrapper.pls', 'PLS_wrapper.transfer']:
+        module = sys.modules.get(module_name)
+        if module is not None:
+            module.matlab = matlab
+    return matlab
@@ -0,0 +1,187 @@
+"""On-disk cache of `pls_analysis` results, keyed by a hash of the inputs.
+
+Entries are compressed *.mat files (written with `matio`, so they can also be
+opened in matlab) named by the sha256 of every input array, every option that
+changes the result, the seed, the backend, the package version and
+`native.ALGORITHM_VERSION`. Reading an entry marks it as recently used; when
+the cache grows past `max_bytes` the least recently used entries are removed.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from . import matio, native, stream
+
+try:
+    from importlib.metadata import version as _package_version
+    VERSION = _package_version('PLS_wrapper')
+except Exception:
+    VERSION = 'unknown'
+
+# bumped when the stored layout or key changes, to ignore old entries
+CACHE_FORMAT = 1
+
+# bytes hashed at a time, so large datamats are not copied at once
+_HASH_CHUNK_BYTES = 2**24
+
+def _hash_array(h, arr):
+    arr = np.asarray(arr)
+    h.update(json.dumps([arr.dtype.str, arr.shape]).encode())
+    if arr.ndim == 0:
+        h.update(arr.tobytes())
+        return
+    row_bytes = max(arr[0].nbytes, 1)
+    rows = max(1, _HASH_CHUNK_BYTES // row_bytes)
+    for start in range(0, arr.shape[0], rows):
+        # only copies chunks of arrays that are not C contiguous
+        h.update(memoryview(np.ascontiguousarray(arr[start:start + rows])).cast('B'))
+
+def result_key(datamat_lst, num_subj_lst, num_cond, stacked_behavdata, options):
+    """Return the cache key of a `pls_analysis` call.
+    Parameters
+    ----------
+    datamat_lst         :   list of 2D ndarrays (or a single 2D ndarray)
+    num_subj_lst        :   list of integers (or a single integer)
+    num_cond            :   int
+    stacked_behavdata   :   2D ndarray (or 1D for a single behaviour)
+    options             :   dict of every other argument that changes the
+                            result (including `seed` and `backend`), with
+                            values that `json` can serialize
+
+    Return
+    ------
+    key                 :   str, hex sha256 digest
+    """
+    if not isinstance(datamat_lst, (list, tuple)):
+        datamat_lst = [datamat_lst]
+    stacked_behavdata = np.asarray(stacked_behavdata)
+    if stacked_behavdata.ndim == 1:
+        stacked_behavdata = stacked_behavdata[:,None]
+    h = hashlib.sha256()
+    h.update(json.dumps({'format': CACHE_FORMAT, 'version': VERSION,
+                         'algorithm': native.ALGORITHM_VERSION,
+                         'num_subj_lst': np.atleast_1d(num_subj_lst).tolist(),
+                         'num_cond': num_cond, 'num_datamats': len(datamat_lst),
+                         'options': options}, sort_keys=True, default=str).encode())
+    for datamat in datamat_lst:
+        if isinstance(datamat, np.ndarray):
+            _hash_array(h, datamat)
+        else:
+            # datamats read in blocks are hashed a block at a time
+            source = stream.DatamatSource(datamat)
+            for block in source.blocks(max(1, _HASH_CHUNK_BYTES // (8*source.num_rows))):
+                _hash_array(h, block)
+    _hash_array(h, stacked_behavdata)
+    return h.hexdigest()
+
+class ResultCache:
+    """Size bounded, least recently used cache of results in a directory.
+    Parameters
+    ----------
+    cache_dir           :   str, directory of the cache entries. Created if
+                            it does not exist. Can be shared between
+                            processes.
+    max_bytes           :   int, default=2**30. Total size of the entries
+                            above which the least recently used ones are
+                            removed. None for no limit.
+
+    Attributes
+    ----------
+    hits                :   int, number of `get` calls that found an entry
+    misses              :   int, number of `get` calls that did not
+    evictions           :   int, number of entries removed to stay under
+                            `max_bytes`
+    """
+    def __init__(self, cache_dir, max_bytes=2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.mat')
+
+    def _entries(self):
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith('.mat'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, file_name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_name))
+        return entries
+
+    def get(self, key):
+        """Return the stored result (as read by `matio.loadmat`) of `key`, or
+        None if it is not in the cache.
+        """
+        path = self._path(key)
+        try:
+            res = matio.loadmat(path)['res']
+        except Exception:
+            # missing, or unreadable and replaced on the next `put`
+            self.misses += 1
+            return None
+        # the modification time records the last use
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return res
+
+    def put(self, key, res):
+        """Store a result (as taken by `matio.savemat`, see
+        `PLS_result_conversion(..., convert_to='numpy')`) under `key`, then
+        evict entries if the cache is over `max_bytes`.
+        """
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        os.close(fd)
+        try:
+            matio.savemat(tmp_path, {'res': res}, version='7')
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._evict(keep=f'{key}.mat')
+
+    def _evict(self, keep=None):
+        if self.max_bytes is None:
+            return
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, file_name in entries:
+            if total <= self.max_bytes:
+                break
+            if file_name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove every entry.
+        """
+        for _, _, file_name in self._entries():
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Return a dict of `hits`, `misses`, `evictions`, and the number of
+        `entries` and their total `bytes`.
+        """
+        entries = self._entries()
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(entries), 'bytes': sum(size for _, size, _ in entries)}
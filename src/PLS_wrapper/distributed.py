@@ -0,0 +1,473 @@
+"""Resampling of the native backend spread over worker processes on many
+machines.
+
+A `DistributedExecutor` is given to `pls_analysis(..., executor=...)` (native
+backend). The permutation, split-half and bootstrap stages are cut into
+chunks of resample indices (`start` to `stop` of the seeded random streams of
+`native`), which workers take from a queue, compute, and send back. Their
+partial results (permutation counts, split-half correlations, bootstrap
+shards) are reduced in order by `native`, so results are identical to a
+single process run. Each worker fetches the stacked data of an analysis once,
+with its first chunk.
+
+The queue is a `TaskBoard`, held by a queue backend that workers connect to.
+`ManagerBackend` serves it over a socket with `multiprocessing.managers`, so
+the same backend is used for local worker processes
+(`DistributedExecutor.start_local_workers`) and for workers on other
+machines, started with
+
+    python -m PLS_wrapper.distributed HOST:PORT --authkey HEX --processes N
+
+Workers send heartbeats while they compute. A worker that sends none for
+`worker_timeout` seconds is taken as dead, and its chunks are handed to other
+workers (up to `max_attempts` times per chunk). Chunks that have had no live
+worker to go to for `worker_timeout` seconds (none connected, or all dead)
+fail, so the analysis raises instead of waiting forever.
+"""
+import argparse
+import collections
+import importlib
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from multiprocessing.managers import BaseManager
+
+class TaskBoard:
+    """Queue of the chunks of every running analysis, with their results and
+    the heartbeats of the workers. Thread safe; lives in the process of the
+    queue backend.
+    Parameters
+    ----------
+    worker_timeout      :   float, default=30.0. Seconds without a heartbeat
+                            after which a worker is taken as dead and its
+                            chunks are queued again, and after which queued
+                            chunks fail if no worker is alive.
+    max_attempts        :   int, default=3. Number of times a chunk is handed
+                            out before its analysis fails.
+    """
+    def __init__(self, worker_timeout=30.0, max_attempts=3):
+        self.worker_timeout = worker_timeout
+        self.max_attempts = max_attempts
+        self._cond = threading.Condition()
+        self._next_id = 0
+        self._jobs = {}
+        self._todo = collections.deque()
+        self._tasks = {}
+        self._attempts = {}
+        self._assigned = {}
+        self._done = {}
+        self._beats = {}
+        self._queued = {}
+        self._idle_since = time.monotonic()
+        self._closed = False
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def _reap(self):
+        # queue the chunks of workers without a recent heartbeat again
+        now = time.monotonic()
+        dead = [worker for worker, beat in self._beats.items()
+                if now - beat > self.worker_timeout]
+        for worker in dead:
+            del self._beats[worker]
+        for task_id, worker in list(self._assigned.items()):
+            if worker not in self._beats:
+                del self._assigned[task_id]
+                job_id = self._tasks[task_id][1]
+                if self._attempts[task_id] >= self.max_attempts:
+                    self._done[job_id][task_id] = (False, f'chunk was handed out '
+                        f'{self.max_attempts} times to workers that died')
+                else:
+                    self._todo.appendleft(task_id)
+                    self._queued[task_id] = now
+        notify = bool(dead)
+        if self._beats:
+            self._idle_since = None
+        elif self._idle_since is None:
+            self._idle_since = now
+        else:
+            # fail chunks that have had no live worker to go to
+            for task_id in [t for t in self._todo
+                            if now - max(self._idle_since, self._queued[t]) > self.worker_timeout]:
+                self._todo.remove(task_id)
+                job_id = self._tasks.pop(task_id)[1]
+                self._attempts.pop(task_id, None)
+                self._queued.pop(task_id, None)
+                self._done[job_id][task_id] = (False, f'no live worker for '
+                    f'{self.worker_timeout} seconds, start workers on the executor')
+                notify = True
+        if notify:
+            self._cond.notify_all()
+
+    # analysis side
+
+    def add_job(self, data):
+        """Store the data of an analysis, returning its job id.
+        """
+        with self._cond:
+            job_id = self._new_id()
+            self._jobs[job_id] = data
+            self._done[job_id] = {}
+            return job_id
+
+    def remove_job(self, job_id):
+        """Drop the data, queued chunks and results of an analysis.
+        """
+        with self._cond:
+            self._jobs.pop(job_id, None)
+            self._done.pop(job_id, None)
+            for task_id in [t for t, task in self._tasks.items() if task[1] == job_id]:
+                del self._tasks[task_id]
+                self._attempts.pop(task_id, None)
+                self._assigned.pop(task_id, None)
+                self._queued.pop(task_id, None)
+            self._todo = collections.deque(t for t in self._todo if t in self._tasks)
+
+    def submit(self, job_id, fn, bounds):
+        """Queue a chunk `fn(data, start, stop)` for each (start, stop) of
+        `bounds`, returning their task ids. `fn` is the 'module:name' of a
+        function the workers import.
+        """
+        with self._cond:
+            task_ids = []
+            for start, stop in bounds:
+                task_id = self._new_id()
+                self._tasks[task_id] = (task_id, job_id, fn, start, stop)
+                self._attempts[task_id] = 0
+                self._queued[task_id] = time.monotonic()
+                self._todo.append(task_id)
+                task_ids.append(task_id)
+            self._cond.notify_all()
+            return task_ids
+
+    def results(self, job_id, timeout=None):
+        """Wait up to `timeout` seconds for finished chunks of an analysis,
+        and return them as a dict of task id to (ok, result or error
+        message), removing them from the board.
+        """
+        with self._cond:
+            self._reap()
+            if not self._done[job_id]:
+                self._cond.wait(timeout)
+                self._reap()
+            done = self._done[job_id]
+            self._done[job_id] = {}
+            return done
+
+    def close(self):
+        """Tell the workers to stop.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    # worker side
+
+    def heartbeat_interval(self):
+        """Seconds between the heartbeats of a worker.
+        """
+        return self.worker_timeout / 4.0
+
+    def heartbeat(self, worker):
+        """Record that `worker` is alive. Return False once the board is
+        closed.
+        """
+        with self._cond:
+            self._beats[worker] = time.monotonic()
+            return not self._closed
+
+    def next_task(self, worker, timeout=1.0):
+        """Hand a chunk to `worker`, waiting up to `timeout` seconds for one.
+        Return a (task id, job id, fn name, start, stop) tuple, None if there is
+        none yet, or 'stop' once the board is closed.
+        """
+        with self._cond:
+            self._beats[worker] = time.monotonic()
+            self._reap()
+            if not self._todo and not self._closed:
+                self._cond.wait(timeout)
+            if self._closed:
+                return 'stop'
+            if not self._todo:
+                return None
+            task_id = self._todo.popleft()
+            self._assigned[task_id] = worker
+            self._attempts[task_id] += 1
+            return self._tasks[task_id]
+
+    def job_data(self, job_id):
+        """Return the data of an analysis.
+        """
+        with self._cond:
+            return self._jobs[job_id]
+
+    def complete(self, worker, task_id, ok, result):
+        """Record the result of a chunk. Results of chunks that were already
+        done by another worker, or of removed analyses, are dropped.
+        """
+        with self._cond:
+            self._beats[worker] = time.monotonic()
+            task = self._tasks.pop(task_id, None)
+            if task is None:
+                return
+            self._attempts.pop(task_id, None)
+            self._assigned.pop(task_id, None)
+            self._queued.pop(task_id, None)
+            if task_id in self._todo:
+                self._todo.remove(task_id)
+            self._done[task[1]][task_id] = (ok, result)
+            self._cond.notify_all()
+
+_board = None
+
+def _get_board(worker_timeout=30.0, max_attempts=3):
+    # one board per backend process, created by the first caller
+    global _board
+    if _board is None:
+        _board = TaskBoard(worker_timeout, max_attempts)
+    return _board
+
+class _BoardServer(BaseManager):
+    pass
+
+_BoardServer.register('board', callable=_get_board)
+
+class _BoardClient(BaseManager):
+    pass
+
+_BoardClient.register('board')
+
+class ManagerBackend:
+    """Queue backend serving a `TaskBoard` from its own process over a
+    socket with `multiprocessing.managers`. Other backends (e.g. on a message
+    broker) provide the same `board`, `address` and `close`, and `connect`.
+    Parameters
+    ----------
+    address             :   tuple, default=('127.0.0.1', 0). (host, port) to
+                            listen on. Use ('0.0.0.0', port) for workers on
+                            other machines; port 0 picks a free port.
+    authkey             :   bytes, default=None. Key workers need to connect.
+                            If None is given, a random key is made.
+    worker_timeout      :   float, default=30.0. As in `TaskBoard`.
+    max_attempts        :   int, default=3. As in `TaskBoard`.
+    """
+    def __init__(self, address=('127.0.0.1', 0), authkey=None, worker_timeout=30.0,
+                 max_attempts=3):
+        self.authkey = authkey if authkey is not None else os.urandom(16)
+        self._manager = _BoardServer(address, self.authkey)
+        self._manager.start()
+        self.address = self._manager.address
+        self.board = self._manager.board(worker_timeout, max_attempts)
+
+    @staticmethod
+    def connect(address, authkey):
+        """Return the board of a running backend, as a worker sees it.
+        """
+        client = _BoardClient(tuple(address), authkey)
+        client.connect()
+        return client.board()
+
+    def close(self):
+        try:
+            self.board.close()
+        finally:
+            self._manager.shutdown()
+
+class DistributedExecutor:
+    """Runs the resampling chunks of native `pls_analysis` calls on workers.
+    Parameters
+    ----------
+    backend             :   default=None. Queue backend, a `ManagerBackend`
+                            started with `address`, `authkey`,
+                            `worker_timeout` and `max_attempts` if None is
+                            given.
+    address             :   tuple, default=('127.0.0.1', 0). As in
+                            `ManagerBackend`.
+    authkey             :   bytes, default=None. As in `ManagerBackend`.
+    local_workers       :   int, default=0. Number of worker processes to
+                            start on this machine (see `start_local_workers`).
+    chunk_size          :   int, default=128. Permutations per chunk (and
+                            outer split-half permutations times `num_split`).
+                            Bootstrap chunks are the shards of
+                            `native.BOOT_SHARD_SIZE` samples.
+    worker_timeout      :   float, default=30.0. As in `TaskBoard`.
+    max_attempts        :   int, default=3. As in `TaskBoard`.
+    poll                :   float, default=1.0. Seconds between checks for
+                            dead workers while waiting for results.
+
+    Attributes
+    ----------
+    address             :   (host, port) workers connect to
+    authkey             :   bytes, key workers connect with
+    """
+    def __init__(self, backend=None, address=('127.0.0.1', 0), authkey=None, local_workers=0,
+                 chunk_size=128, worker_timeout=30.0, max_attempts=3, poll=1.0):
+        if backend is None:
+            backend = ManagerBackend(address, authkey, worker_timeout, max_attempts)
+        self.backend = backend
+        self.address = backend.address
+        self.authkey = backend.authkey
+        self.chunk_size = chunk_size
+        self.poll = poll
+        self.workers = []
+        if local_workers:
+            self.start_local_workers(local_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def start_local_workers(self, n):
+        """Start `n` worker processes on this machine, stopped with the
+        executor. Return the list of started processes.
+        """
+        ctx = multiprocessing.get_context()
+        processes = [ctx.Process(target=run_worker, args=(self.address, self.authkey),
+                                 daemon=True) for _ in range(n)]
+        for process in processes:
+            process.start()
+        self.workers.extend(processes)
+        return processes
+
+    def scatter(self, data):
+        """Store the data of an analysis for the workers to fetch, returning a
+        `Job` to map chunks over it.
+        """
+        return Job(self, self.backend.board.add_job(data))
+
+    def shutdown(self):
+        """Stop the workers and the queue backend.
+        """
+        self.backend.close()
+        for process in self.workers:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+        self.workers = []
+
+class Job:
+    """Data of one analysis on a `DistributedExecutor`.
+    """
+    def __init__(self, executor, job_id):
+        self.executor = executor
+        self.chunk_size = executor.chunk_size
+        self.job_id = job_id
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def map(self, fn, bounds):
+        """Yield `fn(data, start, stop)` for every (start, stop) of `bounds`,
+        in order, as the workers finish them. `fn` has to be importable by the
+        workers (a module level function). Raises `RuntimeError` if a chunk
+        fails, including when it had no live worker for `worker_timeout`.
+        """
+        board = self.executor.backend.board
+        task_ids = board.submit(self.job_id, f'{fn.__module__}:{fn.__qualname__}', bounds)
+        results = {}
+        for task_id, (start, stop) in zip(task_ids, bounds):
+            while task_id not in results:
+                results.update(board.results(self.job_id, self.executor.poll))
+            ok, result = results.pop(task_id)
+            if not ok:
+                raise RuntimeError(f'chunk {start}:{stop} of {fn.__name__} failed:\n{result}')
+            yield result
+
+    def close(self):
+        """Drop the data and results of the analysis from the queue backend.
+        """
+        self.executor.backend.board.remove_job(self.job_id)
+
+def _resolve(name):
+    module, _, qualname = name.partition(':')
+    fn = importlib.import_module(module)
+    for attr in qualname.split('.'):
+        fn = getattr(fn, attr)
+    return fn
+
+def _heartbeats(board, worker, interval, stop):
+    while not stop.wait(interval):
+        try:
+            if not board.heartbeat(worker):
+                return
+        except (EOFError, OSError):
+            return
+
+def run_worker(address, authkey, backend=ManagerBackend, heartbeat=None):
+    """Take chunks from a queue backend and compute them until it closes.
+    Parameters
+    ----------
+    address             :   (host, port) of the backend
+    authkey             :   bytes, key of the backend
+    backend             :   default=ManagerBackend. Backend class whose
+                            `connect(address, authkey)` returns the board.
+    heartbeat           :   float, default=None. Seconds between heartbeats,
+                            None for a quarter of the board's
+                            `worker_timeout`.
+    """
+    board = backend.connect(address, authkey)
+    worker = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    if heartbeat is None:
+        heartbeat = board.heartbeat_interval()
+    stop = threading.Event()
+    threading.Thread(target=_heartbeats, args=(board, worker, heartbeat, stop),
+                     daemon=True).start()
+    job_id = data = None
+    try:
+        while True:
+            task = board.next_task(worker)
+            if task == 'stop':
+                return
+            if task is None:
+                continue
+            task_id, task_job_id, fn_name, start, stop_index = task
+            try:
+                fn = _resolve(fn_name)
+                if task_job_id != job_id:
+                    # one analysis at a time is kept
+                    data = None
+                    data = board.job_data(task_job_id)
+                    job_id = task_job_id
+                ok, result = True, fn(data, start, stop_index)
+            except Exception:
+                ok, result = False, traceback.format_exc()
+            board.complete(worker, task_id, ok, result)
+    except (EOFError, OSError):
+        # the backend is gone
+        return
+    finally:
+        stop.set()
+
+def _run_workers(address, authkey, processes):
+    if processes == 1:
+        run_worker(address, authkey)
+        return
+    ctx = multiprocessing.get_context()
+    workers = [ctx.Process(target=run_worker, args=(address, authkey)) for _ in range(processes)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run PLS_wrapper resampling workers.')
+    parser.add_argument('address', help='HOST:PORT of the DistributedExecutor')
+    parser.add_argument('--authkey', required=True, help='authkey of the executor, as hex')
+    parser.add_argument('--processes', type=int, default=1, help='worker processes to run')
+    args = parser.parse_args()
+    host, _, port = args.address.rpartition(':')
+    _run_workers((host, int(port)), bytes.fromhex(args.authkey), args.processes)
+
+if __name__ == '__main__':
+    main()
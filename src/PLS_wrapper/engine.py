@@ -0,0 +1,325 @@
+import atexit
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+
+def _start_matlab():
+    """Default engine factory, starts a new MATLAB engine process.
+    """
+    import matlab.engine
+    return matlab.engine.start_matlab()
+
+_engine_factory = _start_matlab
+
+def set_engine_factory(factory):
+    """Replace the callable used to start new MATLAB engines.
+    Useful for testing the session and pool logic with a fake engine object.
+    Parameters
+    ----------
+    factory             :   callable taking no arguments and returning an
+                            object with the MATLAB engine interface. If None
+                            is given, restores the default factory
+                            (`matlab.engine.start_matlab`).
+
+    Return
+    ------
+    previous            :   the factory that was in use before this call
+    """
+    global _engine_factory
+    previous = _engine_factory
+    _engine_factory = factory if factory is not None else _start_matlab
+    return previous
+
+def get_engine_factory():
+    """Return the callable currently used to start new MATLAB engines.
+    """
+    return _engine_factory
+
+class MatlabSession:
+    """Lazily started, reusable MATLAB engine.
+    The engine is only started on first use and is kept alive until `close`
+    is called (or the session is used as a context manager and the block
+    exits). Calls through `run` are serialized, so one session can be shared
+    between threads.
+
+    Parameters
+    ----------
+    factory             :   callable, default=None. Starts a new engine. If
+                            None is given, the factory set with
+                            `set_engine_factory` is used at start time.
+    health_check        :   bool, default=True. Whether to check the engine
+                            still responds before each use, restarting it if
+                            not.
+    """
+    def __init__(self, factory=None, health_check=True):
+        self._factory = factory
+        self.health_check = health_check
+        self._eng = None
+        self._lock = threading.RLock()
+        self.last_used = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def started(self):
+        return self._eng is not None
+
+    @property
+    def engine(self):
+        """The underlying engine, starting it if needed.
+        """
+        with self._lock:
+            if self._eng is None:
+                factory = self._factory if self._factory is not None else _engine_factory
+                self._eng = factory()
+            self.last_used = time.monotonic()
+            return self._eng
+
+    def is_alive(self):
+        """Check whether the engine is started and still responds.
+        """
+        with self._lock:
+            if self._eng is None:
+                return False
+            try:
+                self._eng.eval('0;', nargout=0)
+            except Exception:
+                return False
+            return True
+
+    @contextlib.contextmanager
+    def run(self):
+        """Context manager yielding the engine with exclusive access to it.
+        A dead engine is discarded and restarted.
+        """
+        with self._lock:
+            if self.health_check and self._eng is not None and not self.is_alive():
+                self._discard()
+            try:
+                yield self.engine
+            finally:
+                self.last_used = time.monotonic()
+
+    def _discard(self):
+        eng = self._eng
+        self._eng = None
+        try:
+            eng.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        """Shut down the engine if it was started. The session can be reused
+        afterwards, which starts a new engine.
+        """
+        with self._lock:
+            if self._eng is not None:
+                self._discard()
+
+class EnginePool:
+    """Bounded pool of MATLAB engine sessions.
+    Sessions are started lazily, so a pool of size 8 only starts as many
+    engines as are used at the same time. Sessions that fail the health check
+    are restarted, and sessions idle for longer than `idle_timeout` are shut
+    down by a background thread.
+
+    Parameters
+    ----------
+    size                :   int, default=1. Maximum number of engines.
+    factory             :   callable, default=None. Passed to each
+                            `MatlabSession`.
+    idle_timeout        :   float, default=None. Seconds after which an idle
+                            engine is shut down. None keeps engines until
+                            `close` is called.
+    health_check        :   bool, default=True. Passed to each
+                            `MatlabSession`.
+    """
+    def __init__(self, size=1, factory=None, idle_timeout=None, health_check=True):
+        assert size >= 1
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._sessions = [MatlabSession(factory, health_check) for _ in range(size)]
+        self._idle = list(self._sessions)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._reaper = None
+        if idle_timeout is not None:
+            # the reaper only holds a weak reference, so a pool that is never
+            # closed can still be garbage collected, which stops the thread
+            self._reaper = threading.Thread(target=EnginePool._reap,
+                                            args=(weakref.ref(self), idle_timeout), daemon=True)
+            self._reaper.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def acquire(self, timeout=None):
+        """Take a session out of the pool, waiting up to `timeout` seconds.
+        Started sessions are preferred over ones that still need to start.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._idle or self._closed, timeout):
+                raise TimeoutError('No MATLAB engine available in the pool')
+            if self._closed:
+                raise RuntimeError('EnginePool is closed')
+            started = [s for s in self._idle if s.started]
+            session = started[-1] if started else self._idle[-1]
+            self._idle.remove(session)
+        return session
+
+    def release(self, session):
+        """Return a session taken with `acquire` to the pool.
+        """
+        with self._cond:
+            session.last_used = time.monotonic()
+            if self._closed:
+                session.close()
+            else:
+                self._idle.append(session)
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def run(self, timeout=None):
+        """Context manager yielding an engine from the pool.
+        """
+        session = self.acquire(timeout)
+        try:
+            with session.run() as eng:
+                yield eng
+        finally:
+            self.release(session)
+
+    @staticmethod
+    def _reap(pool_ref, idle_timeout):
+        interval = max(min(idle_timeout / 2.0, 5.0), 0.05)
+        while True:
+            time.sleep(interval)
+            pool = pool_ref()
+            if pool is None:
+                return
+            with pool._cond:
+                if pool._closed:
+                    return
+                now = time.monotonic()
+                for session in pool._idle:
+                    if session.started and now - session.last_used > idle_timeout:
+                        session.close()
+            del pool
+
+    def close(self):
+        """Shut down every engine in the pool. Sessions in use are shut down
+        when they are released.
+        """
+        with self._cond:
+            self._closed = True
+            for session in self._idle:
+                session.close()
+            self._cond.notify_all()
+
+_default_session = None
+_default_lock = threading.Lock()
+
+def get_default_session():
+    """Return the shared session used when no session is given to
+    `pls_analysis`, `load_pls_model` or `save_pls_model`.
+    """
+    global _default_session
+    with _default_lock:
+        if _default_session is None:
+            _default_session = MatlabSession()
+        return _default_session
+
+def close_default_session():
+    """Shut down the engine of the shared default session, if started.
+    """
+    with _default_lock:
+        if _default_session is not None:
+            _default_session.close()
+
+atexit.register(close_default_session)
+
+@contextlib.contextmanager
+def engine_context(session=None):
+    """Context manager yielding an engine from whatever the caller passed.
+    Parameters
+    ----------
+    session             :   None for the shared default session, a
+                            `MatlabSession`, an `EnginePool`, or an already
+                            started engine object (used as is and not shut
+                            down).
+    """
+    if session is None:
+        session = get_default_session()
+    if isinstance(session, (MatlabSession, EnginePool)):
+        with session.run() as eng:
+            yield eng
+    else:
+        yield session
+
+# matlab helper functions called through the engine, as in the *.m files of
+# the repository
+HELPER_FUNCTIONS = {
+    'pls_analysis_py':
+        'function result = pls_analysis_py(datamat_lst, num_subj_lst, k, opt)\n'
+        '    result_tmp = pls_analysis(datamat_lst, num_subj_lst, k, opt);\n'
+        '    result = rmfield(result_tmp,"field_descrip");\n'
+        'end',
+    'load_pls_model_py':
+        'function result = load_pls_model_py(model_file)\n'
+        '    result_tmp = load(model_file);\n'
+        '    fields = fieldnames(result_tmp);\n'
+        '    result_tmp2 = result_tmp.(fields{1});\n'
+        '    fields2 = fieldnames(result_tmp2);\n'
+        '    if ismember("field_descrip",fields2) == 1\n'
+        '       result = rmfield(result_tmp2,"field_descrip");\n'
+        '    else\n'
+        '       result = result_tmp2;\n'
+        '    end\n'
+        'end',
+}
+
+# private helper directory of each engine, removed with the engine (or at exit)
+_helper_dirs = weakref.WeakKeyDictionary()
+_helper_lock = threading.Lock()
+
+def install_helpers(eng):
+    """Make the `HELPER_FUNCTIONS` callable on engine `eng`.
+    The first call for an engine writes them to a private temporary
+    directory and adds it to the engine's matlab path, later calls do
+    nothing. Nothing is written to the working directory, so analyses on
+    different engines (or processes) can share it.
+    Parameters
+    ----------
+    eng                 :   started matlab engine
+
+    Return
+    ------
+    path                :   str, the engine's helper directory
+    """
+    with _helper_lock:
+        path = _helper_dirs.get(eng)
+        if path is not None:
+            return path
+        path = tempfile.mkdtemp(prefix='PLS_wrapper_')
+        try:
+            for name, source in HELPER_FUNCTIONS.items():
+                with open(os.path.join(path, f'{name}.m'), 'w') as f:
+                    f.write(source)
+            eng.addpath(path, nargout=0)
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        _helper_dirs[eng] = path
+        weakref.finalize(eng, shutil.rmtree, path, True)
+        return path
@@ -0,0 +1,547 @@
+"""Pure python reader and writer for matlab *.mat files.
+
+Supports the MAT v5 format (what matlab's `save` writes with -v6, and with
+-v7, its default, where every variable is zlib compressed) and, when h5py is
+installed, the HDF5 based v7.3 format.
+
+Values are read the way the matlab engine returns them: scalar structs as
+dicts, cell arrays as lists, char arrays as str, 1x1 numeric arrays as python
+scalars and other numeric arrays as ndarrays with the dtype of their matlab
+class. Writing takes the same kinds of values.
+
+With `lazy=True`, numeric arrays are returned as `LazyArray` placeholders that
+are only decoded when loaded. For uncompressed files (-v6) they are views of a
+copy-on-write memory map of the file, so nothing is read from disk until used.
+"""
+import datetime
+import mmap
+import zlib
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# MAT v5 data types
+miINT8 = 1
+miUINT8 = 2
+miINT16 = 3
+miUINT16 = 4
+miINT32 = 5
+miUINT32 = 6
+miSINGLE = 7
+miDOUBLE = 9
+miINT64 = 12
+miUINT64 = 13
+miMATRIX = 14
+miCOMPRESSED = 15
+miUTF8 = 16
+miUTF16 = 17
+miUTF32 = 18
+
+_MI_DTYPES = {
+    miINT8: 'i1',
+    miUINT8: 'u1',
+    miINT16: 'i2',
+    miUINT16: 'u2',
+    miINT32: 'i4',
+    miUINT32: 'u4',
+    miSINGLE: 'f4',
+    miDOUBLE: 'f8',
+    miINT64: 'i8',
+    miUINT64: 'u8',
+    miUTF8: 'u1',
+    miUTF16: 'u2',
+    miUTF32: 'u4',
+}
+
+# MAT v5 array classes
+mxCELL = 1
+mxSTRUCT = 2
+mxOBJECT = 3
+mxCHAR = 4
+mxSPARSE = 5
+mxDOUBLE = 6
+mxSINGLE = 7
+mxINT8 = 8
+mxUINT8 = 9
+mxINT16 = 10
+mxUINT16 = 11
+mxINT32 = 12
+mxUINT32 = 13
+mxINT64 = 14
+mxUINT64 = 15
+
+_MX_DTYPES = {
+    mxDOUBLE: 'f8',
+    mxSINGLE: 'f4',
+    mxINT8: 'i1',
+    mxUINT8: 'u1',
+    mxINT16: 'i2',
+    mxUINT16: 'u2',
+    mxINT32: 'i4',
+    mxUINT32: 'u4',
+    mxINT64: 'i8',
+    mxUINT64: 'u8',
+}
+
+_CLASS_NAMES = {
+    'f8': 'double',
+    'f4': 'single',
+    'i1': 'int8',
+    'u1': 'uint8',
+    'i2': 'int16',
+    'u2': 'uint16',
+    'i4': 'int32',
+    'u4': 'uint32',
+    'i8': 'int64',
+    'u8': 'uint64',
+}
+
+_FLAG_COMPLEX = 0x08
+_FLAG_LOGICAL = 0x02
+
+def _scalar_or_array(arr):
+    """Return 1x1 arrays as python scalars, like the matlab engine does.
+    """
+    if arr.ndim == 2 and arr.shape == (1, 1):
+        return arr[0, 0].item()
+    return arr
+
+class LazyArray:
+    """Numeric array of a *.mat file, decoded when `load` is first called.
+    """
+    __slots__ = ('_buf', '_offset', '_count', '_stored', '_dtype', '_shape', '_logical')
+
+    def __init__(self, buf, offset, count, stored, dtype, shape, logical=False):
+        self._buf = buf
+        self._offset = offset
+        self._count = count
+        self._stored = stored
+        self._dtype = np.dtype(dtype)
+        self._shape = shape
+        self._logical = logical
+
+    @property
+    def shape(self):
+        return self._shape
+
+    def load(self):
+        arr = np.frombuffer(self._buf, self._stored, self._count, self._offset)
+        arr = arr.reshape(self._shape, order='F')
+        if arr.dtype != self._dtype:
+            arr = arr.astype(self._dtype)
+        if self._logical:
+            arr = arr.astype(bool)
+        if not arr.flags.writeable:
+            arr = arr.copy()
+        return arr
+
+class _H5LazyArray:
+    """v7.3 counterpart of `LazyArray`, reading its dataset when loaded.
+    """
+    __slots__ = ('_dset', '_logical')
+
+    def __init__(self, dset, logical=False):
+        self._dset = dset
+        self._logical = logical
+
+    @property
+    def shape(self):
+        return self._dset.shape[::-1]
+
+    def load(self):
+        arr = self._dset[()]
+        if arr.dtype.names and 'real' in arr.dtype.names:
+            arr = arr['real'] + 1j*arr['imag']
+        arr = np.asarray(arr).T
+        return arr.astype(bool) if self._logical else arr
+
+def resolve(value):
+    """Load `LazyArray` placeholders, also inside lists, leaving other values
+    as they are.
+    """
+    if isinstance(value, (LazyArray, _H5LazyArray)):
+        return value.load()
+    if isinstance(value, list):
+        return [resolve(item) for item in value]
+    return value
+
+def _h5_header():
+    return _header_text('7.3') + b'\x00'*8 + b'\x00\x02' + b'IM'
+
+def _header_text(version):
+    created = datetime.datetime.now().strftime('%a %b %d %H:%M:%S %Y')
+    text = f'MATLAB {version} MAT-file, Platform: PLS_wrapper, Created on: {created}'
+    return text.encode('ascii').ljust(116, b' ')
+
+def _read_header(f):
+    header = f.read(128)
+    if len(header) < 128:
+        raise ValueError('File is too short to be a *.mat file')
+    if header.startswith(b'MATLAB 7.3'):
+        return '7.3', '<'
+    endian = header[126:128]
+    if endian == b'IM':
+        return '5', '<'
+    if endian == b'MI':
+        return '5', '>'
+    raise ValueError('Not a MAT v5 or v7.3 file')
+
+def loadmat(model_file, lazy=False):
+    """Read every variable of a *.mat file.
+    Parameters
+    ----------
+    model_file          :   str path to *.mat file
+    lazy                :   bool, default=False. Return numeric arrays that are
+                            not 1x1 as `LazyArray` placeholders (use `resolve`
+                            or their `load` method). The file stays open (or
+                            memory-mapped) while any placeholder is alive.
+
+    Return
+    ------
+    variables           :   dict of variable names to values, in file order
+    """
+    with open(model_file, 'rb') as f:
+        version, endian = _read_header(f)
+        if version == '5':
+            if lazy:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            else:
+                f.seek(0)
+                buf = f.read()
+    if version == '7.3':
+        return _loadmat73(model_file, lazy)
+    return _Reader(buf, endian, lazy).read_variables(128)
+
+class _Reader:
+    """Decoder for the data elements of a MAT v5 byte buffer.
+    """
+    def __init__(self, buf, endian, lazy=False):
+        self.buf = memoryview(buf)
+        self.endian = endian
+        self.lazy = lazy
+
+    def _dtype(self, code):
+        return np.dtype(code).newbyteorder(self.endian)
+
+    def read_tag(self, pos):
+        """Return (data type, data start, data size, next element position).
+        """
+        tag = np.frombuffer(self.buf, self._dtype('u4'), 2, pos)
+        mi_type, nbytes = int(tag[0]), int(tag[1])
+        if mi_type >> 16:
+            # small data element, packed in the tag
+            return mi_type & 0xFFFF, pos + 4, mi_type >> 16, pos + 8
+        end = pos + 8 + nbytes
+        if mi_type != miCOMPRESSED:
+            end += (-nbytes) % 8
+        return mi_type, pos + 8, nbytes, end
+
+    def read_array(self, pos):
+        mi_type, start, nbytes, end = self.read_tag(pos)
+        return np.frombuffer(self.buf, self._dtype(_MI_DTYPES[mi_type]),
+                             nbytes // np.dtype(_MI_DTYPES[mi_type]).itemsize, start), end
+
+    def read_variables(self, pos):
+        variables = {}
+        while pos < len(self.buf):
+            mi_type, start, nbytes, end = self.read_tag(pos)
+            if mi_type == miCOMPRESSED:
+                inner = _Reader(zlib.decompress(self.buf[start:start + nbytes]), self.endian,
+                                self.lazy)
+                name, value = inner.read_matrix(0)
+            elif mi_type == miMATRIX:
+                name, value = self.read_matrix(pos)
+            else:
+                raise ValueError(f'Unexpected top level data type {mi_type}')
+            variables[name] = value
+            pos = end
+        return variables
+
+    def read_matrix(self, pos):
+        """Decode the miMATRIX element at `pos`, returning (name, value).
+        """
+        mi_type, start, nbytes, end = self.read_tag(pos)
+        if mi_type != miMATRIX:
+            raise ValueError(f'Expected miMATRIX, got data type {mi_type}')
+        if nbytes == 0:
+            return '', np.zeros((0, 0))
+        flags, pos = self.read_array(start)
+        mx_class = int(flags[0]) & 0xFF
+        flag_bits = (int(flags[0]) >> 8) & 0xFF
+        dims, pos = self.read_array(pos)
+        shape = tuple(int(d) for d in dims)
+        name, pos = self.read_array(pos)
+        name = name.tobytes().decode('ascii')
+
+        if mx_class in _MX_DTYPES:
+            if self.lazy and not flag_bits & _FLAG_COMPLEX and shape != (1, 1):
+                mi_type, start, nbytes, pos = self.read_tag(pos)
+                stored = self._dtype(_MI_DTYPES[mi_type])
+                return name, LazyArray(self.buf, start, nbytes // stored.itemsize, stored,
+                                       _MX_DTYPES[mx_class], shape, bool(flag_bits & _FLAG_LOGICAL))
+            real, pos = self.read_array(pos)
+            arr = real.astype(_MX_DTYPES[mx_class]).reshape(shape, order='F')
+            if flag_bits & _FLAG_COMPLEX:
+                imag, pos = self.read_array(pos)
+                arr = arr + 1j*imag.astype(_MX_DTYPES[mx_class]).reshape(shape, order='F')
+            if flag_bits & _FLAG_LOGICAL:
+                arr = arr.astype(bool)
+            return name, _scalar_or_array(arr)
+        if mx_class == mxCHAR:
+            data, pos = self.read_array(pos)
+            chars = data.reshape(shape, order='F')
+            if chars.ndim == 2 and chars.shape[0] <= 1:
+                return name, ''.join(map(chr, chars.ravel()))
+            return name, [''.join(map(chr, row)) for row in chars]
+        if mx_class == mxCELL:
+            cells = []
+            for _ in range(int(np.prod(shape))):
+                _, value = self.read_matrix(pos)
+                pos = self.read_tag(pos)[3]
+                cells.append(value)
+            return name, cells
+        if mx_class == mxSTRUCT:
+            name_len, pos = self.read_array(pos)
+            names, pos = self.read_array(pos)
+            name_len = int(name_len[0])
+            raw = names.tobytes()
+            fields = [raw[i:i + name_len].split(b'\x00', 1)[0].decode('ascii')
+                      for i in range(0, len(raw), name_len)]
+            elements = []
+            for _ in range(int(np.prod(shape))):
+                element = {}
+                for field in fields:
+                    _, element[field] = self.read_matrix(pos)
+                    pos = self.read_tag(pos)[3]
+                elements.append(element)
+            if len(elements) == 1:
+                return name, elements[0]
+            return name, elements
+        raise ValueError(f'Unsupported matlab class {mx_class} for variable "{name}"')
+
+def savemat(model_file, variables, version='7'):
+    """Write variables to a *.mat file.
+    Parameters
+    ----------
+    model_file          :   str path to *.mat file
+    variables           :   dict of variable names to values. dicts (or
+                            objects, using their attributes) are written as
+                            structs, lists as cell arrays, str as char arrays,
+                            bool as logical, int and float as double, and
+                            ndarrays as the matlab class of their dtype.
+    version             :   string, default='7'. '6' for uncompressed MAT v5,
+                            '7' for zlib compressed MAT v5 (matlab's default)
+                            and '7.3' for HDF5 (needs h5py).
+
+    Return
+    ------
+    None
+    """
+    assert version in ['6','7','7.3']
+    if version == '7.3':
+        _savemat73(model_file, variables)
+        return
+    with open(model_file, 'wb') as f:
+        f.write(_header_text('5.0') + b'\x00'*8 + b'\x00\x01' + b'IM')
+        for name, value in variables.items():
+            element = _matrix_element(name, value)
+            if version == '7':
+                data = zlib.compress(element)
+                f.write(_tag(miCOMPRESSED, len(data)) + data)
+            else:
+                f.write(element)
+
+def _tag(mi_type, nbytes):
+    return np.array([mi_type, nbytes], dtype='<u4').tobytes()
+
+def _element(mi_type, data):
+    if 0 < len(data) <= 4:
+        return np.array([mi_type | (len(data) << 16)], dtype='<u4').tobytes() + data.ljust(4, b'\x00')
+    return _tag(mi_type, len(data)) + data + b'\x00'*((-len(data)) % 8)
+
+_NP_TO_MI = {
+    'f8': miDOUBLE,
+    'f4': miSINGLE,
+    'i1': miINT8,
+    'u1': miUINT8,
+    'i2': miINT16,
+    'u2': miUINT16,
+    'i4': miINT32,
+    'u4': miUINT32,
+    'i8': miINT64,
+    'u8': miUINT64,
+}
+_NP_TO_MX = {dtype: mx for mx, dtype in _MX_DTYPES.items()}
+
+def _as_array(value):
+    """Turn a python scalar or ndarray into a 2D (or more) array of a type
+    matlab has a class for.
+    """
+    arr = np.asarray(value)
+    if arr.dtype.kind == 'b':
+        pass
+    elif arr.dtype.kind in 'iu' and not isinstance(value, np.ndarray):
+        # python and numpy integer scalars are written as double, like the engine
+        arr = arr.astype(np.float64)
+    elif arr.dtype.kind == 'f' and arr.dtype.itemsize not in (4, 8):
+        arr = arr.astype(np.float64)
+    elif arr.dtype.kind not in 'iufc':
+        raise TypeError(f'Cannot write arrays of dtype {arr.dtype} to a *.mat file')
+    if arr.ndim == 0:
+        arr = arr.reshape(1, 1)
+    elif arr.ndim == 1:
+        arr = arr[None, :]
+    return arr
+
+def _matrix_element(name, value):
+    """Encode `value` as a miMATRIX element named `name`.
+    """
+    name_el = _element(miINT8, name.encode('ascii'))
+    flags = 0
+    if isinstance(value, (dict,)) or (hasattr(value, '__dict__') and not isinstance(value, np.ndarray)):
+        if not isinstance(value, dict):
+            value = vars(value)
+        fields = list(value)
+        name_len = max([32] + [len(field) + 1 for field in fields])
+        names = b''.join(field.encode('ascii').ljust(name_len, b'\x00') for field in fields)
+        body = (_element(miINT32, np.array([name_len], '<i4').tobytes()) +
+                _element(miINT8, names) +
+                b''.join(_matrix_element('', value[field]) for field in fields))
+        mx_class, shape = mxSTRUCT, (1, 1)
+    elif isinstance(value, (list, tuple)):
+        body = b''.join(_matrix_element('', item) for item in value)
+        mx_class, shape = mxCELL, (1, len(value))
+    elif isinstance(value, str):
+        body = _element(miUINT16, np.array([ord(c) for c in value], '<u2').tobytes())
+        mx_class, shape = mxCHAR, (1, len(value))
+    elif value is None:
+        body = _element(miDOUBLE, b'')
+        mx_class, shape = mxDOUBLE, (0, 0)
+    else:
+        arr = _as_array(value)
+        shape = arr.shape
+        if arr.dtype.kind == 'b':
+            flags |= _FLAG_LOGICAL
+            arr = arr.astype(np.uint8)
+        if arr.dtype.kind == 'c':
+            flags |= _FLAG_COMPLEX
+            real = arr.real
+            dtype = real.dtype.str[1:]
+            body = (_element(_NP_TO_MI[dtype], real.astype('<' + dtype).tobytes(order='F')) +
+                    _element(_NP_TO_MI[dtype], arr.imag.astype('<' + dtype).tobytes(order='F')))
+        else:
+            dtype = arr.dtype.str[1:]
+            body = _element(_NP_TO_MI[dtype], arr.astype('<' + dtype).tobytes(order='F'))
+        mx_class = _NP_TO_MX[dtype]
+    header = (_element(miUINT32, np.array([mx_class | (flags << 8), 0], '<u4').tobytes()) +
+              _element(miINT32, np.array(shape, '<i4').tobytes()) +
+              name_el)
+    data = header + body
+    return _tag(miMATRIX, len(data)) + data
+
+def _require_h5py():
+    if h5py is None:
+        raise ImportError('h5py is required to read and write MAT v7.3 files')
+
+def _loadmat73(model_file, lazy=False):
+    _require_h5py()
+    f = h5py.File(model_file, 'r')
+    variables = {name: _h5_value(f, f[name], lazy) for name in f if not name.startswith('#')}
+    if not lazy:
+        # lazy placeholders keep the file open until they are garbage collected
+        f.close()
+    return variables
+
+def _h5_value(f, obj, lazy=False):
+    matlab_class = obj.attrs.get('MATLAB_class', b'')
+    if isinstance(matlab_class, bytes):
+        matlab_class = matlab_class.decode('ascii')
+    if isinstance(obj, h5py.Group):
+        if 'MATLAB_fields' in obj.attrs:
+            fields = [b''.join(field).decode('ascii') for field in obj.attrs['MATLAB_fields']]
+        else:
+            fields = list(obj)
+        return {name: _h5_value(f, obj[name], lazy) for name in fields}
+    if obj.attrs.get('MATLAB_empty', 0):
+        return np.zeros(tuple(np.asarray(obj[()]).ravel()[::-1]) if obj.shape else (0, 0))
+    if lazy and matlab_class not in ('cell', 'char') and obj.shape != (1, 1):
+        return _H5LazyArray(obj, matlab_class == 'logical')
+    data = obj[()]
+    if matlab_class == 'cell':
+        return [_h5_value(f, f[ref], lazy) for ref in data.T.ravel(order='F')]
+    if matlab_class == 'char':
+        chars = np.asarray(data).T
+        if chars.shape[0] <= 1:
+            return ''.join(map(chr, chars.ravel()))
+        return [''.join(map(chr, row)) for row in chars]
+    if data.dtype.names and 'real' in data.dtype.names:
+        data = data['real'] + 1j*data['imag']
+    arr = np.asarray(data).T
+    if matlab_class == 'logical':
+        arr = arr.astype(bool)
+    return _scalar_or_array(arr)
+
+def _savemat73(model_file, variables):
+    _require_h5py()
+    with h5py.File(model_file, 'w', userblock_size=512) as f:
+        for name, value in variables.items():
+            _h5_write(f, f, name, value)
+    with open(model_file, 'r+b') as f:
+        f.write(_h5_header())
+
+def _h5_write(f, parent, name, value):
+    if isinstance(value, dict) or (hasattr(value, '__dict__') and not isinstance(value, np.ndarray)):
+        if not isinstance(value, dict):
+            value = vars(value)
+        group = parent.create_group(name)
+        group.attrs['MATLAB_class'] = np.bytes_('struct')
+        # matlab lists struct fields, in order, as a vlen array of chars
+        fields = np.empty(len(value), dtype=h5py.vlen_dtype(np.dtype('S1')))
+        for i, field in enumerate(value):
+            fields[i] = np.array(list(field), dtype='S1')
+        group.attrs.create('MATLAB_fields', fields)
+        for field, item in value.items():
+            _h5_write(f, group, field, item)
+        return
+    if isinstance(value, (list, tuple)):
+        refs_group = f.require_group('#refs#')
+        refs = []
+        for item in value:
+            ref_name = f'r{len(refs_group)}'
+            _h5_write(f, refs_group, ref_name, item)
+            refs.append(refs_group[ref_name].ref)
+        dset = parent.create_dataset(name, data=np.array(refs, dtype=h5py.ref_dtype).reshape(len(refs), 1))
+        dset.attrs['MATLAB_class'] = np.bytes_('cell')
+        return
+    if isinstance(value, str):
+        dset = parent.create_dataset(name, data=np.array([ord(c) for c in value], '<u2').reshape(-1, 1))
+        dset.attrs['MATLAB_class'] = np.bytes_('char')
+        dset.attrs['MATLAB_int_decode'] = np.int32(2)
+        return
+    if value is None:
+        value = np.zeros((0, 0))
+    arr = _as_array(value)
+    if arr.size == 0:
+        dset = parent.create_dataset(name, data=np.array(arr.shape[::-1], dtype=np.uint64))
+        dset.attrs['MATLAB_class'] = np.bytes_(_CLASS_NAMES.get(arr.dtype.str[1:], 'double'))
+        dset.attrs['MATLAB_empty'] = np.uint8(1)
+        return
+    if arr.dtype.kind == 'b':
+        dset = parent.create_dataset(name, data=arr.astype(np.uint8).T)
+        dset.attrs['MATLAB_class'] = np.bytes_('logical')
+        dset.attrs['MATLAB_int_decode'] = np.int32(1)
+        return
+    if arr.dtype.kind == 'c':
+        part = arr.real.dtype
+        compound = np.empty(arr.T.shape, dtype=[('real', part), ('imag', part)])
+        compound['real'] = arr.real.T
+        compound['imag'] = arr.imag.T
+        dset = parent.create_dataset(name, data=compound)
+        dset.attrs['MATLAB_class'] = np.bytes_(_CLASS_NAMES[part.str[1:]])
+        return
+    dset = parent.create_dataset(name, data=arr.T)
+    dset.attrs['MATLAB_class'] = np.bytes_(_CLASS_NAMES[arr.dtype.str[1:]])
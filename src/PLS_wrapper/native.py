@@ -0,0 +1,1328 @@
+"""Pure NumPy implementation of behavioural PLS (method 3 of `pls_analysis.m`).
+
+Functions here return the raw result as a dictionary laid out like the struct
+returned by the matlab engine (floats for scalars, float32 for matlab single
+arrays, 1-based resample indices), so `PLS_result_conversion` can be applied
+to it exactly as to a matlab result.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+
+from . import stream
+from .profiling import NULL_TIMINGS
+
+# Bumped with every change here that changes results, so results cached
+# (`cache.result_key`) by earlier code are not reused.
+ALGORITHM_VERSION = 2
+
+# spawn_key streams for the per-sample random number generators
+PERM_STREAM = 0
+BOOT_STREAM = 1
+SPLIT_STREAM = 2
+
+# Bootstrap samples per shard. Fixed so that results do not depend on the
+# number of workers.
+BOOT_SHARD_SIZE = 32
+
+def resample_rng(seed, stream, index):
+    """Random number generator for a single permutation or bootstrap sample.
+    Each sample has its own stream derived from `seed`, so a sample is the
+    same however the samples are batched or distributed.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(stream, index)))
+
+def condition_spans(num_subj_lst, num_cond):
+    """Row slices of the stacked datamat for each group and condition, in the
+    order used by `pls_analysis.m` (groups, then conditions within group, then
+    subjects within condition).
+    """
+    spans = []
+    offset = 0
+    for n in num_subj_lst:
+        for c in range(num_cond):
+            spans.append(slice(offset + c*n, offset + (c+1)*n))
+        offset += n*num_cond
+    return spans
+
+def _normalize(x, cormode=0, axis=0):
+    """Normalize observations along `axis` as `rri_xcor.m` does before taking
+    the cross product.
+    """
+    if cormode in (0, 2):
+        x = x - x.mean(axis=axis, keepdims=True)
+    if cormode == 0:
+        scale = x.std(axis=axis, ddof=1, keepdims=True)
+    elif cormode == 4:
+        scale = np.sqrt((x**2).sum(axis=axis, keepdims=True))
+    elif cormode in (2, 6):
+        return x
+    else:
+        raise ValueError(f'cormode must be one of 0, 2, 4, 6, got {cormode}')
+    scale[scale == 0] = np.inf
+    return x / scale
+
+def _xcor_scale(num_rows, cormode=0):
+    return 1.0 / (num_rows - 1) if cormode in (0, 2) else 1.0
+
+def xcor(design, datamat, cormode=0):
+    """Cross correlation of the columns of `design` and `datamat`, equivalent
+    to `rri_xcor.m`.
+    Parameters
+    ----------
+    design              :   2D ndarray, rows are observations
+    datamat             :   2D ndarray, rows are observations
+    cormode             :   int, default=0. 0 Pearson correlation,
+                            2 covariance, 4 cosine angle, 6 dot product.
+
+    Return
+    ------
+    outmat              :   2D ndarray of shape (design columns, datamat
+                            columns)
+    """
+    scale = _xcor_scale(datamat.shape[0], cormode)
+    return _normalize(design, cormode).T @ _normalize(datamat, cormode) * scale
+
+def corr_maps(behav, datamat, spans, cormode=0):
+    """Stack the behaviour by datamat cross correlations of every group and
+    condition, equivalent to calling `rri_corr_maps.m` for each group.
+    """
+    return np.concatenate([xcor(behav[span], datamat[span], cormode) for span in spans])
+
+SVD_SOLVERS = ('full', 'randomized', 'arpack')
+
+def _check_num_lv(num_lv, shape):
+    max_lv = min(shape[-2:])
+    if num_lv is None:
+        return max_lv
+    if not 1 <= num_lv <= max_lv:
+        raise ValueError(f'num_lv must be between 1 and {max_lv}, got {num_lv}')
+    return int(num_lv)
+
+def _svds(a, num_lv):
+    try:
+        from scipy.sparse.linalg import svds
+    except ImportError:
+        raise ImportError('scipy is required for svd_solver="arpack"')
+    u, s, vt = svds(a, k=num_lv)
+    order = np.argsort(s)[::-1]
+    return u[:, order], s[order], vt[order]
+
+RANDOMIZED_OVERSAMPLES = 10
+RANDOMIZED_ITER = 4
+
+# number of behaviour correlations per sketch column above which randomized
+# subspace iteration is faster than the exact SVD of one matrix, and than the
+# Gram matrix eigendecomposition of a stack (see benchmarks/bench_svd.py)
+RANDOMIZED_MIN_RATIO = 5
+RANDOMIZED_MIN_RATIO_GRAM = 40
+
+def _sketch_pays_off(num_lv, max_lv, gram=False):
+    """Whether randomized subspace iteration, which costs about
+    `2*RANDOMIZED_ITER + 2` products of the data with `num_lv` plus
+    oversampling columns, is cheaper than an exact decomposition: the economy
+    SVD, or with `gram` the eigendecomposition of the behaviour Gram matrix
+    (one blocked product, so the sketch only pays for far more correlations).
+    """
+    ratio = RANDOMIZED_MIN_RATIO_GRAM if gram else RANDOMIZED_MIN_RATIO
+    return ratio*(num_lv + RANDOMIZED_OVERSAMPLES) <= max_lv
+
+def _range_finder(a, size, n_iter=RANDOMIZED_ITER):
+    """Orthonormal basis approximating the range of `a` (stacks allowed),
+    by randomized subspace iteration (Halko, Martinsson and Tropp 2011).
+    """
+    rng = np.random.default_rng(0)
+    q = np.linalg.qr(a @ rng.standard_normal((a.shape[-1], size)))[0]
+    at = np.swapaxes(a, -1, -2)
+    for _ in range(n_iter):
+        # only orthonormalize on the short side, the long side is never stored
+        q = np.linalg.qr(a @ (at @ q))[0]
+    return q
+
+def svd(crosscorr, num_lv=None, svd_solver='full'):
+    """SVD of a stacked cross correlation matrix, economy sized or truncated
+    to the first `num_lv` singular triplets.
+    Parameters
+    ----------
+    crosscorr           :   2D ndarray (behaviour correlations x voxels)
+    num_lv              :   int, default=None. Number of LVs to compute. None
+                            for all of them.
+    svd_solver          :   string, default='full'. 'full' computes the
+                            economy SVD and truncates it. 'randomized' uses
+                            randomized subspace iteration and 'arpack' scipy's
+                            `svds`, which only compute the first `num_lv`.
+                            'randomized' falls back to the exact SVD unless
+                            there are at least `RANDOMIZED_MIN_RATIO*(num_lv +
+                            RANDOMIZED_OVERSAMPLES)` behaviour correlations,
+                            below which it is not faster.
+
+    Return
+    ------
+    u                   :   2D ndarray (voxels x LVs), brain saliences
+    s                   :   1D ndarray, singular values
+    v                   :   2D ndarray (behaviour correlations x LVs)
+    """
+    assert svd_solver in SVD_SOLVERS
+    num_lv = _check_num_lv(num_lv, crosscorr.shape)
+    max_lv = min(crosscorr.shape)
+    if svd_solver == 'arpack' and num_lv < max_lv:
+        u, s, vt = _svds(crosscorr.T, num_lv)
+    elif svd_solver == 'randomized' and _sketch_pays_off(num_lv, max_lv):
+        q = _range_finder(crosscorr.T, num_lv + RANDOMIZED_OVERSAMPLES)
+        ub, s, vt = np.linalg.svd(q.T @ crosscorr.T, full_matrices=False)
+        u = q @ ub
+    else:
+        u, s, vt = np.linalg.svd(crosscorr.T, full_matrices=False)
+    return u[:, :num_lv], s[:num_lv], vt[:num_lv].T
+
+def procrustes(origlv, bootlv):
+    """Rotation aligning `bootlv` to `origlv`, equivalent to
+    `rri_bootprocrust.m`.
+    """
+    v, _, ut = np.linalg.svd(origlv.T @ bootlv, full_matrices=False)
+    return ut.T @ v.T
+
+def behav_scores(behav, v, spans):
+    """Behaviour scores `vsc`, each condition block of behaviour projected on
+    its block of `v`.
+    """
+    nbehav = behav.shape[1]
+    return np.concatenate([behav[span] @ v[i*nbehav:(i+1)*nbehav] for i, span in enumerate(spans)])
+
+def batch_corr_maps(behav_batch, datamat_norm, spans, cormode=0):
+    """`corr_maps` for a batch of resampled behaviour matrices at once.
+    Parameters
+    ----------
+    behav_batch         :   3D ndarray (batch x rows x behaviours)
+    datamat_norm        :   list with the datamat block of each span, already
+                            normalized with `_normalize`
+    spans               :   list of row slices from `condition_spans`
+    cormode             :   int, default=0. Correlation type.
+
+    Return
+    ------
+    crosscorr           :   3D ndarray (batch x behaviour correlations x
+                            voxels)
+    """
+    batch, _, nbehav = behav_batch.shape
+    blocks = []
+    for span, dnorm in zip(spans, datamat_norm):
+        b = _normalize(behav_batch[:, span], cormode, axis=1)
+        n = b.shape[1]
+        b = b.transpose(0, 2, 1).reshape(batch*nbehav, n)
+        blocks.append((b @ dnorm).reshape(batch, nbehav, -1) * _xcor_scale(n, cormode))
+    return np.concatenate(blocks, axis=1)
+
+def batch_svd_v(crosscorr, num_lv, svd_solver='full'):
+    """Singular values and behaviour side singular vectors of a stack of cross
+    correlation matrices. 'full' uses the eigendecomposition of their (small)
+    behaviour by behaviour Gram matrices, 'randomized' projects them on a
+    randomized basis of `num_lv` plus oversampling dimensions first (only with
+    at least `RANDOMIZED_MIN_RATIO_GRAM*(num_lv + RANDOMIZED_OVERSAMPLES)`
+    behaviour correlations, below which the Gram matrices are cheaper), and
+    'arpack' calls scipy's `svds` for each matrix.
+    Return
+    ------
+    s                   :   2D ndarray (batch x LVs), descending
+    v                   :   3D ndarray (batch x behaviour correlations x LVs)
+    """
+    assert svd_solver in SVD_SOLVERS
+    max_lv = min(crosscorr.shape[-2:])
+    if svd_solver == 'arpack' and num_lv < max_lv:
+        out = [_svds(c, num_lv) for c in crosscorr]
+        return np.stack([o[1] for o in out]), np.stack([o[0] for o in out])
+    q = None
+    if svd_solver == 'randomized' and _sketch_pays_off(num_lv, max_lv, gram=True):
+        q = _range_finder(crosscorr, num_lv + RANDOMIZED_OVERSAMPLES)
+        crosscorr = q.transpose(0, 2, 1) @ crosscorr
+    s, vecs = gram_svd_v(crosscorr @ crosscorr.transpose(0, 2, 1), num_lv)
+    if q is not None:
+        vecs = q @ vecs
+    return s, vecs
+
+def gram_svd_v(gram, num_lv):
+    """Singular values and behaviour side singular vectors of a stack of
+    cross correlation matrices, from their Gram matrices (batch x behaviour
+    correlations x behaviour correlations), which can be accumulated one
+    block of voxels at a time.
+    """
+    w, vecs = np.linalg.eigh(gram)
+    w = w[:, ::-1][:, :num_lv]
+    vecs = vecs[:, :, ::-1][:, :, :num_lv]
+    return np.sqrt(np.clip(w, 0, None)), vecs
+
+def batch_procrustes(origlv, bootlv):
+    """`procrustes` for a stack of resampled LVs (batch x rows x LVs).
+    """
+    v, _, ut = np.linalg.svd(origlv.T @ bootlv, full_matrices=False)
+    return ut.transpose(0, 2, 1) @ v.transpose(0, 2, 1)
+
+def _auto_batch_size(num_corr, num_vox, budget=2**28):
+    """Number of resamples whose stacked cross correlations fit in `budget`
+    bytes.
+    """
+    return max(1, budget // (8*num_corr*num_vox))
+
+def perm_order(num_rows, num_perm, seed, start=0):
+    """Permutation index matrix (rows x permutations), 0-based.
+    """
+    permsamp = np.empty((num_rows, num_perm), dtype=np.int64)
+    for p in range(num_perm):
+        permsamp[:, p] = resample_rng(seed, PERM_STREAM, start + p).permutation(num_rows)
+    return permsamp
+
+def _boot_sampler(num_subj_lst, num_cond, boot_type='strat'):
+    """Function drawing the 0-based rows of one bootstrap sample from a
+    random generator, for `boot_order`.
+    """
+    if boot_type not in ('strat', 'nonstrat'):
+        raise ValueError(f"boot_type must be 'strat' or 'nonstrat', got {boot_type}")
+    offsets = np.cumsum([0] + [n*num_cond for n in num_subj_lst])
+    num_subj = np.asarray(num_subj_lst)
+    # group and within group index of every subject slot in stacking order
+    subj_group = np.concatenate([np.full(n, g) for g, n in enumerate(num_subj_lst)])
+    subj_index = np.concatenate([np.arange(n) for n in num_subj_lst])
+    group_start = np.cumsum([0] + list(num_subj_lst))
+
+    def rows(group, index, c):
+        return offsets[group] + c*num_subj[group] + index
+
+    def draw(rng):
+        if boot_type == 'strat':
+            picked = np.concatenate([
+                group_start[g] + rng.integers(0, n, n) for g, n in enumerate(num_subj_lst)
+            ])
+        else:
+            picked = rng.integers(0, len(subj_group), len(subj_group))
+        sample = np.empty(offsets[-1], dtype=np.int64)
+        for c in range(num_cond):
+            sample[rows(subj_group, subj_index, c)] = rows(subj_group[picked], subj_index[picked], c)
+        return sample
+
+    return draw
+
+def boot_order(num_subj_lst, num_cond, num_boot, seed, boot_type='strat', start=0):
+    """Bootstrap index matrix (rows x samples), 0-based, equivalent to
+    `rri_boot_order.m`. Subjects are resampled with replacement and keep all
+    of their conditions. With `boot_type='strat'` subjects are resampled within
+    their group, with 'nonstrat' from all groups.
+    """
+    draw = _boot_sampler(num_subj_lst, num_cond, boot_type)
+    bootsamp = np.empty((sum(num_subj_lst)*num_cond, num_boot), dtype=np.int64)
+    for b in range(num_boot):
+        bootsamp[:, b] = draw(resample_rng(seed, BOOT_STREAM, start + b))
+    return bootsamp
+
+MAX_BOOT_REDRAWS = 100
+
+def degenerate_behav(behav, spans, cormode=0):
+    """Boolean (spans x behaviours) array of the behaviours `_normalize` cannot
+    scale in each group and condition: constant ones for `cormode` 0 and all
+    zero ones for 4. Their correlations would silently be zero.
+    """
+    if cormode == 0:
+        return np.array([np.ptp(behav[span], axis=0) == 0 for span in spans])
+    if cormode == 4:
+        return np.array([~behav[span].any(axis=0) for span in spans])
+    return np.zeros((len(spans), behav.shape[1]), dtype=bool)
+
+def checked_boot_order(behav, num_subj_lst, num_cond, num_boot, seed, boot_type='strat',
+                       cormode=0, start=0):
+    """Bootstrap samples of `boot_order`, where a sample in which a behaviour
+    is degenerate (see `degenerate_behav`) in some group and condition is
+    redrawn from the same random stream, as `pls_analysis.m` redraws low
+    variability behaviour samples.
+
+    Parameters
+    ----------
+    behav               :   stacked behaviour data (rows x behaviours)
+    num_subj_lst, num_cond, num_boot, seed, boot_type, start
+                        :   as in `boot_order`
+    cormode             :   correlation mode, see `_normalize`
+
+    Return
+    ------
+    orders              :   dict with the first drawn `bootsamp` and the
+                            `bootsamp_4beh` used (rows x samples, 0-based),
+                            `badbeh` (groups x behaviours, number of
+                            degenerate draws), `countnewtotal` (number of
+                            redraws) and `num_LowVariability_behav_boots`
+                            (per behaviour, number of samples whose first
+                            draw was degenerate)
+    """
+    draw = _boot_sampler(num_subj_lst, num_cond, boot_type)
+    spans = condition_spans(num_subj_lst, num_cond)
+    num_group, nbehav = len(num_subj_lst), behav.shape[1]
+    bootsamp = np.empty((behav.shape[0], num_boot), dtype=np.int64)
+    bootsamp_4beh = np.empty_like(bootsamp)
+    badbeh = np.zeros((num_group, nbehav))
+    low_variability = np.zeros(nbehav)
+    countnew = 0
+    for b in range(num_boot):
+        rng = resample_rng(seed, BOOT_STREAM, start + b)
+        sample = bootsamp[:, b] = draw(rng)
+        redraws = 0
+        while True:
+            bad = degenerate_behav(behav[sample], spans, cormode)
+            bad = bad.reshape(num_group, num_cond, nbehav).any(axis=1)
+            if not bad.any():
+                break
+            if not redraws:
+                low_variability += bad.any(axis=0)
+            badbeh += bad
+            if redraws == MAX_BOOT_REDRAWS:
+                raise ValueError(f'bootstrap sample {start + b} still has a degenerate '
+                                 f'behaviour in some group after {MAX_BOOT_REDRAWS} redraws')
+            redraws += 1
+            sample = draw(rng)
+        countnew += redraws
+        bootsamp_4beh[:, b] = sample
+    return {
+        'bootsamp': bootsamp,
+        'bootsamp_4beh': bootsamp_4beh,
+        'badbeh': badbeh,
+        'countnewtotal': countnew,
+        'num_LowVariability_behav_boots': low_variability,
+    }
+
+def merge_boot_orders(orders):
+    """Concatenate the `checked_boot_order` results of consecutive samples.
+    """
+    merged = {key: np.concatenate([o[key] for o in orders], axis=-1)
+              for key in ['bootsamp', 'bootsamp_4beh']}
+    for key in ['badbeh', 'countnewtotal', 'num_LowVariability_behav_boots']:
+        merged[key] = sum(o[key] for o in orders)
+    return merged
+
+def _percentile_adjusted(distrib, orig, ll, ul):
+    """Bias corrected percentile confidence bounds, equivalent to the
+    adjusted bounds from `rri_distrib.m`.
+    """
+    norm = NormalDist()
+    # samples that only reorder subjects reproduce orig, up to rounding that
+    # depends on how u was computed (e.g. by `extend_result`), so those count
+    # as ties
+    orig = orig[..., None]
+    prop = ((distrib <= orig) | np.isclose(distrib, orig, rtol=1e-10, atol=0)).mean(axis=-1)
+    orig = orig[..., 0]
+    llcorr_adj = np.empty(orig.shape)
+    ulcorr_adj = np.empty(orig.shape)
+    for idx in np.ndindex(orig.shape):
+        ni = norm.inv_cdf(min(max(prop[idx], 1e-10), 1 - 1e-10))
+        adj_ll = norm.cdf(2*ni + norm.inv_cdf(ll/100.0))*100.0
+        adj_ul = norm.cdf(2*ni + norm.inv_cdf(ul/100.0))*100.0
+        llcorr_adj[idx] = np.percentile(distrib[idx], adj_ll)
+        ulcorr_adj[idx] = np.percentile(distrib[idx], adj_ul)
+    return llcorr_adj, ulcorr_adj, prop
+
+def _perm_test(datamat, behav, spans, cormode, s, v, num_perm, seed, batch_size=None,
+               svd_solver='full', progress=None, start=0):
+    permsamp = perm_order(behav.shape[0], num_perm, seed, start)
+    if batch_size is None:
+        batch_size = _auto_batch_size(v.shape[0], datamat.shape[1])
+    datamat_norm = [_normalize(datamat[span], cormode) for span in spans]
+    sp = np.zeros(s.shape)
+    for p in range(0, num_perm, batch_size):
+        reorder = permsamp[:, p:p + batch_size]
+        crosscorr = batch_corr_maps(behav[reorder.T], datamat_norm, spans, cormode)
+        sp += _perm_counts(*batch_svd_v(crosscorr, len(s), svd_solver), s, v)
+        if progress is not None:
+            progress(min(p + batch_size, num_perm), num_perm)
+    return _perm_result(sp, permsamp, num_perm)
+
+def perm_chunk(data, start, stop):
+    """Number of permutations `start` to `stop` (per LV) whose singular value
+    is at least the original one, for `distributed` workers.
+    """
+    res = _perm_test(data['datamat'], data['behav'], data['spans'], data['cormode'], data['s'],
+                     data['v'], stop - start, data['seed'], data['batch_size'],
+                     data['svd_solver'], start=start)
+    return np.ravel(res['sp'])
+
+def _distributed_perm_test(job, data, num_perm, start=0, progress=None):
+    """`_perm_test` of permutations `start` to `start + num_perm` in chunks
+    over a `distributed.Job`.
+    """
+    bounds = _chunk_bounds(start, start + num_perm, job.chunk_size)
+    sp = np.zeros(len(data['s']))
+    for (_, stop), counts in zip(bounds, job.map(perm_chunk, bounds)):
+        sp += counts
+        if progress is not None:
+            progress(stop - start, num_perm)
+    permsamp = perm_order(data['behav'].shape[0], num_perm, data['seed'], start)
+    return _perm_result(sp, permsamp, num_perm)
+
+def _chunk_bounds(start, stop, size):
+    return [(b, min(b + size, stop)) for b in range(start, stop, size)]
+
+def _perm_counts(sperm, pv, s, v):
+    """Number of permutations, per LV, whose singular value after rotation
+    onto the original LVs is at least the original one.
+    """
+    pv = (pv * sperm[:, None, :]) @ batch_procrustes(v, pv)
+    return (np.sqrt((pv**2).sum(axis=1)) >= s).sum(axis=0)
+
+def _perm_result(sp, permsamp, num_perm):
+    return {
+        'num_perm': float(num_perm),
+        'sp': sp[:, None],
+        'sprob': sp[:, None] / (num_perm + 1),
+        'permsamp': (permsamp + 1).astype(np.float64),
+        'is_perm_splithalf': 0.0,
+    }
+
+class Moments:
+    """Streaming mean and sum of squared deviations (Welford), mergeable with
+    other accumulators (Chan et al.) so partial results can be combined.
+    """
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * (other.count / count)
+        self.m2 += other.m2 + delta**2 * (self.count * other.count / count)
+        self.count = count
+
+    def std(self):
+        return np.sqrt(self.m2 / max(self.count - 1, 1))
+
+def boot_shard(data, start, stop):
+    """Compute bootstrap samples `start` to `stop`.
+    Parameters
+    ----------
+    data                :   dict with the stacked `datamat` and `behav`,
+                            `spans`, `num_subj_lst`, `num_cond`, `cormode`,
+                            `boot_type`, `seed`, `svd_solver` and the original
+                            `u` and `v`
+
+    Return
+    ------
+    shard               :   dict with the `Moments` of the rotated and scaled
+                            brain saliences, the `distrib` slices of the
+                            sampled lvcorrs and the `checked_boot_order`
+                            `orders` of the shard
+    """
+    datamat, behav, spans, cormode = data['datamat'], data['behav'], data['spans'], data['cormode']
+    u, v = data['u'], data['v']
+    orders = checked_boot_order(behav, data['num_subj_lst'], data['num_cond'], stop - start,
+                                data['seed'], data['boot_type'], cormode, start)
+    moments = Moments(u.shape)
+    distrib = np.empty((v.shape[0], u.shape[1], stop - start))
+    for b in range(stop - start):
+        rows = orders['bootsamp_4beh'][:, b]
+        datamat_b = datamat[rows]
+        behav_b = behav[rows]
+        crosscorr = corr_maps(behav_b, datamat_b, spans, cormode)
+        _, pv = batch_svd_v(crosscorr[None], u.shape[1], data['svd_solver'])
+        # u * s of the sample is crosscorr' * v, so the voxel side SVD is not needed
+        moments.update(crosscorr.T @ (pv[0] @ procrustes(v, pv[0])))
+        distrib[:, :, b] = corr_maps(behav_b, datamat_b @ u, spans, cormode)
+    return {'moments': moments, 'distrib': distrib, 'orders': orders}
+
+_worker_data = None
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+def _boot_shard_worker(start, stop):
+    return boot_shard(_worker_data, start, stop)
+
+def _num_workers(n_jobs):
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+    return n_jobs
+
+def run_boot_shards(data, num_boot, n_jobs=None, start=0, progress=None, moments=None,
+                    job=None):
+    """Run bootstrap samples `start` to `start + num_boot` in shards of
+    `BOOT_SHARD_SIZE`, over a process pool if `n_jobs` is not 1 (or the
+    workers of a `distributed.Job` if given), and merge the shards in order,
+    into `moments` (of the samples before `start`) if given. Gives identical
+    results for any `n_jobs`. `progress` is called with the number of samples
+    done and `num_boot` as shards merge.
+    """
+    bounds = _chunk_bounds(start, start + num_boot, BOOT_SHARD_SIZE)
+    workers = min(_num_workers(n_jobs), len(bounds))
+    on_shard = None if progress is None else (lambda done: progress(done, num_boot))
+    if job is not None:
+        return _merge_boot_shards(job.map(boot_shard, bounds), data['u'].shape, on_shard, moments)
+    if workers <= 1:
+        shards = (boot_shard(data, b, e) for b, e in bounds)
+        return _merge_boot_shards(shards, data['u'].shape, on_shard, moments)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(data,)) as pool:
+        shards = pool.map(_boot_shard_worker, *zip(*bounds))
+        return _merge_boot_shards(shards, data['u'].shape, on_shard, moments)
+
+def _merge_boot_shards(shards, shape, progress=None, moments=None):
+    if moments is None:
+        moments = Moments(shape)
+    initial = moments.count
+    distrib = []
+    orders = []
+    for shard in shards:
+        moments.merge(shard['moments'])
+        if progress is not None:
+            progress(moments.count - initial)
+        distrib.append(shard['distrib'])
+        orders.append(shard['orders'])
+    return {
+        'moments': moments,
+        'distrib': np.concatenate(distrib, axis=-1),
+        'orders': merge_boot_orders(orders),
+    }
+
+def _boot_result(merged, data, s, lvcorrs, clim):
+    u = data['u']
+    distrib = merged['distrib']
+    orders = merged['orders']
+    u_se = merged['moments'].std()
+    zero_u_se = u_se <= 0
+    compare_u = np.divide(u * s, u_se, out=np.zeros(u.shape), where=~zero_u_se)
+
+    ll = (100.0 - clim) / 2.0
+    ul = 100.0 - ll
+    llcorr_adj, ulcorr_adj, prop = _percentile_adjusted(distrib, lvcorrs, ll, ul)
+    return {
+        'num_boot': float(merged['moments'].count),
+        'clim': float(clim),
+        'boot_type': data['boot_type'],
+        # the bootstrap saliences are always procrustes rotated
+        'nonrotated_boot': 0.0,
+        'num_LowVariability_behav_boots': orders['num_LowVariability_behav_boots'][None].astype(np.float64),
+        'badbeh': orders['badbeh'].astype(np.float64),
+        'countnewtotal': float(orders['countnewtotal']),
+        'bootsamp': (orders['bootsamp'] + 1).astype(np.float64),
+        'bootsamp_4beh': (orders['bootsamp_4beh'] + 1).astype(np.float64),
+        'orig_corr': lvcorrs.astype(np.float32),
+        'ulcorr': np.percentile(distrib, ul, axis=-1),
+        'llcorr': np.percentile(distrib, ll, axis=-1),
+        'ulcorr_adj': ulcorr_adj,
+        'llcorr_adj': llcorr_adj,
+        'prop': prop,
+        'distrib': distrib,
+        'u_se': u_se.astype(np.float32),
+        'compare_u': compare_u.astype(np.float32),
+        'zero_u_se': zero_u_se.astype(np.float64),
+    }
+
+def split_order(num_subj_lst, num_cond, num_split, seed, outer):
+    """Row indices (splits x rows) of the two halves of every split-half
+    split for outer permutation `outer` (0 for the unpermuted data), 0-based.
+    Subjects are split at random within their group and keep all of their
+    conditions; the first half has `n // 2` subjects of a group of `n`. The
+    rows of each half are stacked by group, then condition, then subject, so
+    `condition_spans` of the half sizes gives their spans.
+    """
+    rng = resample_rng(seed, SPLIT_STREAM, outer)
+    offsets = np.cumsum([0] + [n*num_cond for n in num_subj_lst])
+    halves = ([], [])
+    for split in range(num_split):
+        rows = ([], [])
+        for offset, n in zip(offsets[:-1], num_subj_lst):
+            order = rng.permutation(n)
+            for half, subj in zip(rows, (np.sort(order[:n // 2]), np.sort(order[n // 2:]))):
+                half.extend(offset + c*n + subj for c in range(num_cond))
+        for half, half_rows in zip(halves, rows):
+            half.append(np.concatenate(half_rows))
+    return np.stack(halves[0]), np.stack(halves[1])
+
+def _split_scales(powers, label, sizes, cormode):
+    """Per voxel scale of the normalized datamat in each (half, span) group
+    of a batch of splits, as `_normalize` scales them, from sums over the
+    group rows computed as one matrix product with the group indicators.
+    Parameters
+    ----------
+    powers              :   2D ndarray, `x*x` (rows x voxels) for cormode 4,
+                            `[x, x*x]` (rows x 2 voxels) for cormode 0, where
+                            `x` is the datamat centered on its column means
+    label               :   2D ndarray (splits x rows), group of every row
+    sizes               :   1D ndarray, rows in each group
+    cormode             :   int, 0 or 4
+
+    Return
+    ------
+    scale               :   3D ndarray (splits x groups x voxels), 0 for
+                            constant voxels
+    """
+    indicator = (label[:, None, :] == np.arange(len(sizes))[:, None]).astype(powers.dtype)
+    # one matrix product for the whole batch
+    sums = (indicator.reshape(-1, powers.shape[0]) @ powers).reshape(label.shape[0], len(sizes), -1)
+    if cormode == 0:
+        total, sumsq = np.split(sums, 2, axis=-1)
+        sizes = sizes[:, None]
+        denom = (sumsq - total**2 / sizes) / (sizes - 1)
+        # rounding leaves tiny variances for voxels constant within a group
+        nonzero = denom > 1e-12 * sumsq / sizes
+    else:
+        denom = sums
+        nonzero = denom > 0
+    return np.divide(1.0, np.sqrt(denom, where=nonzero, out=np.ones(denom.shape)),
+                     where=nonzero, out=np.zeros(denom.shape))
+
+def _batch_corr(a, b, axis=1):
+    """Pearson correlation along `axis` of two matching stacks, nan where
+    either is constant.
+    """
+    a = a - a.mean(axis=axis, keepdims=True)
+    b = b - b.mean(axis=axis, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (a*b).sum(axis=axis) / np.sqrt((a**2).sum(axis=axis) * (b**2).sum(axis=axis))
+
+def splithalf_outer(data, outer):
+    """Split-half correlations of one outer permutation (0 for the
+    unpermuted data). The LVs of the whole (permuted) sample are computed
+    once, then the cross correlations of both halves of every split are
+    projected on them: the brain saliences of each half are `crosscorr' * v`
+    and the behaviour saliences `crosscorr * u`. Since the normalized
+    behaviour of each half is centered, both are products of the (scaled)
+    datamat with small weight matrices, so a batch of splits costs a few
+    matrix products over the datamat instead of normalizing every half.
+    Parameters
+    ----------
+    data                :   dict with the stacked `datamat` and `behav`,
+                            `spans`, `num_subj_lst`, `num_cond`, `cormode`,
+                            `seed`, `svd_solver`, `num_lv`, `num_split`,
+                            `batch_size` and the 0-based `permsamp`
+
+    Return
+    ------
+    ucorr               :   2D ndarray (splits x LVs), correlation of the
+                            brain saliences of the two halves
+    vcorr               :   2D ndarray (splits x LVs), same for the behaviour
+                            saliences
+    """
+    datamat, behav, cormode = data['datamat'], data['behav'], data['cormode']
+    if outer:
+        behav = behav[data['permsamp'][:, outer - 1]]
+    u, _, v = svd(corr_maps(behav, datamat, data['spans'], cormode), data['num_lv'],
+                  data['svd_solver'])
+    num_rows, num_lv = datamat.shape[0], u.shape[1]
+    nbehav = behav.shape[1]
+    if cormode in (0, 2):
+        # column means cancel against the centered behaviour; removing them
+        # keeps the sums of squares in `_split_scales` accurate
+        datamat = datamat - datamat.mean(axis=0)
+    if cormode == 0:
+        powers = np.hstack([datamat, datamat*datamat])
+    elif cormode == 4:
+        powers = datamat*datamat
+    half_sizes = [[n // 2 for n in data['num_subj_lst']],
+                  [n - n // 2 for n in data['num_subj_lst']]]
+    groups = [(half, i, span) for half in (0, 1)
+              for i, span in enumerate(condition_spans(half_sizes[half], data['num_cond']))]
+    sizes = np.array([span.stop - span.start for _, _, span in groups])
+    halves = split_order(data['num_subj_lst'], data['num_cond'], data['num_split'],
+                         data['seed'], outer)
+    batch_size = data['batch_size'] or _auto_batch_size(num_rows, datamat.shape[1])
+    ucorr = []
+    vcorr = []
+    for start in range(0, data['num_split'], batch_size):
+        rows = [h[start:start + batch_size] for h in halves]
+        batch = np.arange(rows[0].shape[0])[:, None]
+        label = np.empty(rows[0].shape[:1] + (num_rows,), dtype=np.intp)
+        weights = np.zeros(label.shape + (2*num_lv,))
+        normalized = []
+        for g, (half, i, span) in enumerate(groups):
+            sub = rows[half][:, span]
+            label[batch, sub] = g
+            b = _normalize(behav[sub], cormode, axis=1) * _xcor_scale(sizes[g], cormode)
+            weights[batch, sub, half*num_lv:(half + 1)*num_lv] = b @ v[i*nbehav:(i + 1)*nbehav]
+            normalized.append(b)
+        if cormode in (0, 4):
+            scaled = datamat * _split_scales(powers, label, sizes, cormode)[batch, label]
+        else:
+            scaled = datamat[None]
+        # (batch x LVs of both halves x voxels), contiguous along voxels
+        u_halves = weights.transpose(0, 2, 1) @ scaled
+        projected = np.broadcast_to(scaled @ u, label.shape + (num_lv,))
+        v_halves = np.empty((2, len(batch), v.shape[0], num_lv))
+        for (half, i, span), b in zip(groups, normalized):
+            sub = rows[half][:, span]
+            v_halves[half, :, i*nbehav:(i + 1)*nbehav] = b.transpose(0, 2, 1) @ projected[batch, sub]
+        ucorr.append(_batch_corr(u_halves[:, :num_lv], u_halves[:, num_lv:], axis=2))
+        vcorr.append(_batch_corr(*v_halves))
+    return np.concatenate(ucorr), np.concatenate(vcorr)
+
+def _splithalf_outer_worker(outer):
+    return splithalf_outer(_worker_data, outer)
+
+def splithalf_chunk(data, start, stop):
+    """`splithalf_outer` results of outer permutations `start` to `stop`, for
+    `distributed` workers.
+    """
+    return [splithalf_outer(data, outer) for outer in range(start, stop)]
+
+def run_splithalf(data, outers, n_jobs=None, job=None):
+    """Yield the `splithalf_outer` results of `outers` (a range) in order,
+    computed over a process pool if `n_jobs` is not 1, or over the workers of
+    a `distributed.Job` if given. Each outer permutation draws its splits from
+    its own random stream, so results do not depend on `n_jobs`.
+    """
+    if job is not None:
+        size = max(1, job.chunk_size // data['num_split'])
+        for chunk in job.map(splithalf_chunk, _chunk_bounds(outers.start, outers.stop, size)):
+            yield from chunk
+        return
+    workers = min(_num_workers(n_jobs), len(outers))
+    if workers <= 1:
+        for outer in outers:
+            yield splithalf_outer(data, outer)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(data,)) as pool:
+        yield from pool.map(_splithalf_outer_worker, outers,
+                            chunksize=max(1, len(outers) // (4*workers)))
+
+def _splithalf(data, num_perm, num_split, clim, n_jobs=None, progress=None, job=None):
+    """Split-half reliability test (Kovacevic et al. 2013) over the
+    unpermuted data and `num_perm` outer permutations.
+    """
+    results = run_splithalf(data, range(num_perm + 1), n_jobs, job)
+    return _splithalf_result(results, num_perm, num_split, clim, progress)
+
+def _splithalf_result(results, num_perm, num_split, clim, progress=None):
+    ucorr_distrib = []
+    vcorr_distrib = []
+    for outer, (ucorr, vcorr) in enumerate(results):
+        if outer == 0:
+            orig_ucorr_split, orig_vcorr_split = ucorr, vcorr
+        ucorr_distrib.append(ucorr.mean(axis=0))
+        vcorr_distrib.append(vcorr.mean(axis=0))
+        if progress is not None and outer:
+            progress(outer, num_perm)
+    ucorr_distrib = np.stack(ucorr_distrib)
+    vcorr_distrib = np.stack(vcorr_distrib)
+    orig_ucorr, orig_vcorr = ucorr_distrib[0], vcorr_distrib[0]
+    ll = (100.0 - clim) / 2.0
+    ul = 100.0 - ll
+    return {
+        'num_outer_perm': float(num_perm),
+        'num_split': float(num_split),
+        'orig_ucorr': orig_ucorr[:, None],
+        'orig_vcorr': orig_vcorr[:, None],
+        'ucorr_prob': ((ucorr_distrib[1:] >= orig_ucorr).sum(axis=0) / (num_perm + 1))[:, None],
+        'vcorr_prob': ((vcorr_distrib[1:] >= orig_vcorr).sum(axis=0) / (num_perm + 1))[:, None],
+        'ucorr_ll': np.percentile(orig_ucorr_split, ll, axis=0)[:, None],
+        'ucorr_ul': np.percentile(orig_ucorr_split, ul, axis=0)[:, None],
+        'vcorr_ll': np.percentile(orig_vcorr_split, ll, axis=0)[:, None],
+        'vcorr_ul': np.percentile(orig_vcorr_split, ul, axis=0)[:, None],
+    }
+
+def _streamed_analysis(blocks, behav, num_subj_lst, num_cond, cormode, num_lv, svd_solver,
+                       num_perm, num_boot, boot_type, seed, batch_size, timings):
+    """Behavioural PLS of datamats read a block of columns at a time
+    (`stream.StackedBlocks`), in two passes over the data. The first builds
+    the cross correlations and accumulates the behaviour side Gram matrices
+    of every permutation and bootstrap sample, which give their singular
+    values and vectors. The second, once the LVs are known, accumulates the
+    brain scores and the bootstrap salience moments and scores. Only one
+    block of the datamats is in memory at a time.
+
+    Return
+    ------
+    out                 :   dict with `datamatcorrs_lst`, `u`, `s`, `v`, `usc`,
+                            and the `perm_result` and `merged` bootstrap
+                            shards when requested
+    """
+    num_rows = blocks.num_rows
+    spans = condition_spans(num_subj_lst, num_cond)
+    group_spans = np.cumsum([0] + [n*num_cond for n in num_subj_lst])
+    groups = [(slice(start, stop), condition_spans([n], num_cond))
+              for start, stop, n in zip(group_spans[:-1], group_spans[1:], num_subj_lst)]
+    num_corr = len(spans)*behav.shape[1]
+    if num_perm:
+        permsamp = perm_order(num_rows, num_perm, seed)
+        perm_gram = np.zeros((num_perm, num_corr, num_corr))
+    if num_boot:
+        orders = checked_boot_order(behav, num_subj_lst, num_cond, num_boot, seed, boot_type,
+                                    cormode)
+        bootsamp = orders['bootsamp_4beh']
+        boot_gram = np.zeros((num_boot, num_corr, num_corr))
+
+    corr_blocks = []
+    with timings.stage('stream_pass_1') as info:
+        for start, block in blocks:
+            info['bytes'] += block.nbytes
+            corr_blocks.append([corr_maps(behav[rows], block[rows], group_cond_spans, cormode)
+                                for rows, group_cond_spans in groups])
+            if num_perm:
+                datamat_norm = [_normalize(block[span], cormode) for span in spans]
+                size = batch_size or _auto_batch_size(num_corr, block.shape[1],
+                                                      4*stream.BLOCK_BYTES)
+                for p in range(0, num_perm, size):
+                    reorder = permsamp[:, p:p + size]
+                    crosscorr = batch_corr_maps(behav[reorder.T], datamat_norm, spans, cormode)
+                    perm_gram[p:p + size] += crosscorr @ crosscorr.transpose(0, 2, 1)
+            for b in range(num_boot):
+                rows = bootsamp[:, b]
+                crosscorr = corr_maps(behav[rows], block[rows], spans, cormode)
+                boot_gram[b] += crosscorr @ crosscorr.T
+            timings.progress('stream_pass_1', start + block.shape[1], blocks.num_cols)
+
+    with timings.stage('svd'):
+        datamatcorrs_lst = [np.concatenate([c[g] for c in corr_blocks], axis=1)
+                            for g in range(len(groups))]
+        del corr_blocks
+        u, s, v = svd(np.concatenate(datamatcorrs_lst), num_lv, svd_solver)
+    out = {'datamatcorrs_lst': datamatcorrs_lst, 'u': u, 's': s, 'v': v}
+    if num_perm:
+        with timings.stage('permutation'):
+            sp = _perm_counts(*gram_svd_v(perm_gram, len(s)), s, v)
+            out['perm_result'] = _perm_result(sp, permsamp, num_perm)
+        del perm_gram
+    if num_boot:
+        _, pv = gram_svd_v(boot_gram, len(s))
+        rotation = pv @ batch_procrustes(v, pv)
+        del boot_gram
+        mean = np.zeros(u.shape)
+        m2 = np.zeros(u.shape)
+        boot_usc = np.zeros((num_boot, num_rows, len(s)))
+
+    usc = np.zeros((num_rows, len(s)))
+    with timings.stage('stream_pass_2') as info:
+        for start, block in blocks:
+            info['bytes'] += block.nbytes
+            cols = slice(start, start + block.shape[1])
+            usc += block @ u[cols]
+            if not num_boot:
+                continue
+            # same shards as `run_boot_shards`, merged in the same order
+            moments = Moments((block.shape[1], len(s)))
+            for shard_start in range(0, num_boot, BOOT_SHARD_SIZE):
+                shard = Moments(moments.mean.shape)
+                for b in range(shard_start, min(shard_start + BOOT_SHARD_SIZE, num_boot)):
+                    rows = bootsamp[:, b]
+                    crosscorr = corr_maps(behav[rows], block[rows], spans, cormode)
+                    shard.update(crosscorr.T @ rotation[b])
+                    boot_usc[b] += block[rows] @ u[cols]
+                moments.merge(shard)
+            mean[cols] = moments.mean
+            m2[cols] = moments.m2
+            timings.progress('stream_pass_2', start + block.shape[1], blocks.num_cols)
+    out['usc'] = usc
+    if num_boot:
+        moments = Moments(u.shape)
+        moments.count, moments.mean, moments.m2 = num_boot, mean, m2
+        distrib = np.empty((num_corr, len(s), num_boot))
+        for b in range(num_boot):
+            rows = bootsamp[:, b]
+            distrib[:, :, b] = corr_maps(behav[rows], boot_usc[b], spans, cormode)
+        out['merged'] = {'moments': moments, 'distrib': distrib, 'orders': orders}
+    return out
+
+def _group_corr_maps(datamat, behav, num_subj_lst, num_cond, cormode):
+    """Cross correlations of each group of in-memory stacked data.
+    """
+    group_spans = np.cumsum([0] + [n*num_cond for n in num_subj_lst])
+    return [corr_maps(behav[start:stop], datamat[start:stop],
+                      condition_spans([n], num_cond), cormode)
+            for start, stop, n in zip(group_spans[:-1], group_spans[1:], num_subj_lst)]
+
+def _fit(datamat, behav, num_subj_lst, num_cond, cormode, num_lv, svd_solver,
+         timings=NULL_TIMINGS):
+    """Cross correlations of each group, their SVD and the scores of
+    in-memory stacked data.
+
+    Return
+    ------
+    datamatcorrs_lst    :   list of 2D ndarrays, one per group
+    u, s, v             :   as returned by `svd`
+    usc                 :   2D ndarray (rows x LVs), brain scores
+    vsc                 :   2D ndarray (rows x LVs), behaviour scores
+    lvcorrs             :   2D ndarray, correlations of the behaviour with
+                            the brain scores
+    """
+    with timings.stage('crosscorr', datamat.nbytes):
+        datamatcorrs_lst = _group_corr_maps(datamat, behav, num_subj_lst, num_cond, cormode)
+        crosscorr = np.concatenate(datamatcorrs_lst)
+    with timings.stage('svd', crosscorr.nbytes):
+        u, s, v = svd(crosscorr, num_lv, svd_solver)
+    spans = condition_spans(num_subj_lst, num_cond)
+    with timings.stage('scores'):
+        usc = datamat @ u
+        vsc = behav_scores(behav, v, spans)
+        lvcorrs = corr_maps(behav, usc, spans, cormode)
+    return datamatcorrs_lst, u, s, v, usc, vsc, lvcorrs
+
+def _store_moments(res, moments):
+    # the bootstrap salience moments, merged with those of later samples by
+    # `extend_result`
+    res['resample_state']['boot_mean'] = moments.mean
+    res['resample_state']['boot_m2'] = moments.m2
+
+def engine_like(value):
+    """Return 1x1 arrays (also inside dicts and lists) as python floats, as the
+    matlab engine returns them.
+    """
+    if isinstance(value, dict):
+        return {key: engine_like(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [engine_like(item) for item in value]
+    if isinstance(value, np.ndarray) and value.shape == (1, 1):
+        return float(value[0, 0])
+    return value
+
+def pls_analysis(datamat_lst, num_subj_lst, num_cond, stacked_behavdata,
+    num_perm=0,
+    num_split=0,
+    num_boot=0,
+    meancentering_type=0,
+    cormode=0,
+    boot_type='strat',
+    clim=95.0,
+    seed=0,
+    batch_size=None,
+    n_jobs=None,
+    num_lv=None,
+    svd_solver='full',
+    block_size=None,
+    executor=None,
+    keep_resample_state=False,
+    timings=None
+    ):
+    """Behavioural PLS computed with NumPy.
+    Takes the same inputs as `PLS_wrapper.pls.pls_analysis` and returns the raw
+    (unconverted) result dictionary. `batch_size` is the number of
+    permutations whose cross correlations are computed together (None sizes
+    batches to about 256 MB). `n_jobs` is the number of processes the
+    bootstrap shards are spread over (None for 1, -1 for every core).
+    `num_lv` and `svd_solver` are passed to `svd` for the original
+    decomposition and every resample. Stage times and resampling progress
+    are recorded in `timings` (a `profiling.Timings`) if given.
+
+    Datamats that are not in-memory ndarrays (memory maps, `.npy` paths,
+    HDF5/zarr datasets, chunk generators, see `stream`), and every datamat
+    when `block_size` is given, are read `block_size` columns at a time by
+    `_streamed_analysis`. Resamples then always use the Gram matrix
+    eigendecomposition (`svd_solver` only applies to the original
+    decomposition), `n_jobs` is not used, and results match in-memory
+    datamats up to floating point rounding.
+
+    `num_split` runs the split-half reliability test (`_splithalf`) on the
+    unpermuted data and each of the `num_perm` permutations (outer
+    permutations), filling `perm_splithalf`. The splits of each outer
+    permutation are projected as one stack, and outer permutations are spread
+    over `n_jobs` processes. Not supported for streamed datamats.
+
+    With a `distributed.DistributedExecutor` as `executor`, the stacked data
+    is sent to its workers once and the permutation, split-half and bootstrap
+    stages run in chunks on them instead of over `n_jobs` processes, with
+    identical results. Not supported for streamed datamats.
+
+    With `keep_resample_state` the result carries a `resample_state` (seed,
+    solver, float64 behaviour data, singular values and behaviour saliences,
+    and the bootstrap salience moments, about three times the size of `u`)
+    from which `extend_result` continues the resampling.
+    """
+    if timings is None:
+        timings = NULL_TIMINGS
+    if not isinstance(datamat_lst, (list, tuple)):
+        datamat_lst = [datamat_lst]
+    if np.ndim(num_subj_lst) == 0:
+        num_subj_lst = [num_subj_lst]
+    num_subj_lst = [int(n) for n in num_subj_lst]
+    num_cond = int(num_cond)
+    streamed = block_size is not None or any(stream.is_streamed(d) for d in datamat_lst)
+    if streamed:
+        blocks = stream.StackedBlocks(datamat_lst, block_size)
+        num_rows = blocks.num_rows
+    else:
+        datamat = np.concatenate([np.asarray(d, dtype=np.float64) for d in datamat_lst])
+        num_rows = datamat.shape[0]
+    behav = np.asarray(stacked_behavdata, dtype=np.float64)
+    if behav.ndim == 1:
+        behav = behav[:, None]
+    if num_rows != sum(num_subj_lst)*num_cond:
+        raise ValueError('datamat_lst rows do not match num_subj_lst and num_cond')
+    if behav.shape[0] != num_rows:
+        raise ValueError('stacked_behavdata rows do not match datamat_lst rows')
+
+    spans = condition_spans(num_subj_lst, num_cond)
+    if degenerate_behav(behav, spans, cormode).any():
+        raise ValueError('stacked_behavdata is constant (or zero for cormode 4) within '
+                         'some group and condition')
+    if num_split and streamed:
+        raise ValueError('num_split cannot be used with streamed datamats (memory maps, paths, '
+                         'datasets, generators or block_size), pass in-memory ndarrays')
+    if executor is not None and streamed:
+        raise ValueError('executor cannot be used with streamed datamats (memory maps, paths, '
+                         'datasets, generators or block_size), pass in-memory ndarrays')
+    if num_split and min(num_subj_lst) < 4:
+        raise ValueError('split-half resampling needs at least 4 subjects in every group')
+    if streamed:
+        out = _streamed_analysis(blocks, behav, num_subj_lst, num_cond, cormode, num_lv,
+            svd_solver, num_perm, num_boot, boot_type, seed, batch_size, timings)
+        datamatcorrs_lst, u, s, v, usc = (out[key] for key in
+                                          ['datamatcorrs_lst', 'u', 's', 'v', 'usc'])
+        with timings.stage('scores'):
+            vsc = behav_scores(behav, v, spans)
+            lvcorrs = corr_maps(behav, usc, spans, cormode)
+    else:
+        datamatcorrs_lst, u, s, v, usc, vsc, lvcorrs = _fit(
+            datamat, behav, num_subj_lst, num_cond, cormode, num_lv, svd_solver, timings)
+
+    res = {
+        'method': 3.0,
+        'is_struct': 0.0,
+        'datamatcorrs_lst': [d.astype(np.float32) for d in datamatcorrs_lst],
+        'lvcorrs': lvcorrs.astype(np.float32),
+        'u': u.astype(np.float32),
+        's': s[:, None].astype(np.float32),
+        'v': v.astype(np.float32),
+        'usc': usc.astype(np.float32),
+        'vsc': vsc.astype(np.float32),
+        'stacked_behavdata': behav.astype(np.float32),
+        'num_subj_lst': np.array([num_subj_lst], dtype=np.float64),
+        'num_conditions': float(num_cond),
+        'other_input': {
+            'meancentering_type': float(meancentering_type),
+            'cormode': float(cormode),
+        },
+    }
+    if keep_resample_state:
+        res['resample_state'] = {
+            'seed': float(seed),
+            'svd_solver': svd_solver,
+            'stacked_behavdata': behav,
+            's': s,
+            'v': v,
+        }
+    data = {
+        'behav': behav,
+        'spans': spans,
+        'num_subj_lst': num_subj_lst,
+        'num_cond': num_cond,
+        'cormode': cormode,
+        'boot_type': boot_type,
+        'seed': seed,
+        'svd_solver': svd_solver,
+        'u': u,
+        's': s,
+        'v': v,
+    }
+    if streamed:
+        if num_perm:
+            res['perm_result'] = out['perm_result']
+        if num_boot:
+            res['boot_result'] = _boot_result(out['merged'], data, s, lvcorrs, clim)
+            if keep_resample_state:
+                _store_moments(res, out['merged']['moments'])
+        return engine_like(res)
+
+    data.update(datamat=datamat, batch_size=batch_size)
+    if num_split:
+        # outer permutations reorder the behaviour as the permutation test does
+        data.update(num_lv=len(s), num_split=int(num_split),
+                    permsamp=perm_order(num_rows, num_perm, seed))
+    job = None
+    if executor is not None and (num_perm or num_split or num_boot):
+        job = executor.scatter(data)
+    try:
+        if num_perm:
+            progress = lambda done, total: timings.progress('permutation', done, total)
+            with timings.stage('permutation'):
+                if job is None:
+                    res['perm_result'] = _perm_test(datamat, behav, spans, cormode, s, v, num_perm,
+                        seed, batch_size, svd_solver, progress)
+                else:
+                    res['perm_result'] = _distributed_perm_test(job, data, num_perm,
+                                                                progress=progress)
+        if num_split:
+            with timings.stage('splithalf'):
+                res['perm_splithalf'] = _splithalf(data, num_perm, num_split, clim, n_jobs,
+                    lambda done, total: timings.progress('splithalf', done, total), job)
+            if num_perm:
+                res['perm_result']['is_perm_splithalf'] = 1.0
+        if num_boot:
+            with timings.stage('bootstrap'):
+                merged = run_boot_shards(data, num_boot, n_jobs,
+                    progress=lambda done, total: timings.progress('bootstrap', done, total),
+                    job=job)
+                res['boot_result'] = _boot_result(merged, data, s, lvcorrs, clim)
+            if keep_resample_state:
+                _store_moments(res, merged['moments'])
+    finally:
+        if job is not None:
+            job.close()
+    return engine_like(res)
+
+def _extend_splithalf(split, data, num_perm, extra_perm, n_jobs=None, progress=None, job=None):
+    """`perm_splithalf` with outer permutations `num_perm + 1` to
+    `num_perm + extra_perm` added, counting them against the stored split
+    correlations of the unpermuted data.
+    """
+    total = num_perm + extra_perm
+    split = dict(split)
+    # (1x1 fields of single LV results are floats)
+    orig = {name: np.reshape(split[f'orig_{name}'], (-1, 1)) for name in ['ucorr', 'vcorr']}
+    # probabilities are counts over num_perm + 1
+    counts = {name: np.rint(np.reshape(split[f'{name}_prob'], (-1, 1)) * (num_perm + 1))
+              for name in ['ucorr', 'vcorr']}
+    results = run_splithalf(data, range(num_perm + 1, total + 1), n_jobs, job)
+    for done, (ucorr, vcorr) in enumerate(results, 1):
+        counts['ucorr'] += ucorr.mean(axis=0)[:, None] >= orig['ucorr']
+        counts['vcorr'] += vcorr.mean(axis=0)[:, None] >= orig['vcorr']
+        if progress is not None:
+            progress(done, extra_perm)
+    split['num_outer_perm'] = float(total)
+    split['ucorr_prob'] = counts['ucorr'] / (total + 1)
+    split['vcorr_prob'] = counts['vcorr'] / (total + 1)
+    return split
+
+def _stored_boot_orders(boot):
+    """`checked_boot_order` result of the samples of a stored `boot_result`.
+    """
+    return {
+        'bootsamp': np.asarray(boot['bootsamp']).astype(np.intp) - 1,
+        'bootsamp_4beh': np.asarray(boot['bootsamp_4beh']).astype(np.intp) - 1,
+        'badbeh': np.array(boot['badbeh'], dtype=np.float64),
+        'countnewtotal': float(boot['countnewtotal']),
+        'num_LowVariability_behav_boots': np.ravel(boot['num_LowVariability_behav_boots']),
+    }
+
+def extend_result(res, datamat_lst, extra_perm=0, extra_boot=0, batch_size=None, n_jobs=None,
+                  executor=None, timings=None):
+    """Add permutations and bootstrap samples to a result of `pls_analysis`
+    without running the samples it already has again.
+    Takes the raw (or 'numpy' converted) result of a `pls_analysis` run with
+    `keep_resample_state=True`, and the in-memory datamats it was computed
+    from. The stored singular values and behaviour saliences are reused (the
+    brain saliences are recomputed from them, without an SVD). New
+    permutations (and outer split-half permutations) continue the stored
+    `permsamp`, new bootstrap samples continue the stored `bootsamp`, each
+    drawn from its own random stream as in `pls_analysis`, so the resample
+    indices and permutation counts are those of a single run with
+    `num_perm + extra_perm` and `num_boot + extra_boot`, and the bootstrap
+    distributions match it up to floating point rounding. Split-half only
+    results (`num_perm=0`) get the `perm_result` a single run would have.
+    The bootstrap salience moments are merged into the stored ones.
+    `batch_size`, `n_jobs`, `executor` and `timings` are as in
+    `pls_analysis`.
+    """
+    if timings is None:
+        timings = NULL_TIMINGS
+    state = res.get('resample_state')
+    if state is None:
+        raise ValueError('result has no resample_state, run pls_analysis (native backend) '
+                         'with keep_resample_state=True to extend it')
+    if extra_perm and 'perm_result' not in res and 'perm_splithalf' not in res:
+        raise ValueError('result has no permutation test to extend')
+    if extra_boot and 'boot_result' not in res:
+        raise ValueError('result has no bootstrap to extend')
+    if not isinstance(datamat_lst, (list, tuple)):
+        datamat_lst = [datamat_lst]
+    if any(stream.is_streamed(d) for d in datamat_lst):
+        raise ValueError('extend_result needs in-memory datamats, streamed datamats '
+                         '(memory maps, paths, datasets, generators) are not supported')
+    num_subj_lst = [int(n) for n in np.ravel(res['num_subj_lst'])]
+    num_cond = int(res['num_conditions'])
+    cormode = int(res['other_input']['cormode'])
+    seed = int(state['seed'])
+    svd_solver = str(state['svd_solver'])
+    behav = np.asarray(state['stacked_behavdata'], dtype=np.float64)
+    datamat = np.concatenate([np.asarray(d, dtype=np.float64) for d in datamat_lst])
+    if datamat.shape[0] != behav.shape[0]:
+        raise ValueError('datamat_lst rows do not match the result')
+
+    spans = condition_spans(num_subj_lst, num_cond)
+    s = np.ravel(state['s']).astype(np.float64)
+    v = np.array(state['v'], dtype=np.float64).reshape(-1, len(s))
+    with timings.stage('crosscorr', datamat.nbytes):
+        crosscorr = np.concatenate(_group_corr_maps(datamat, behav, num_subj_lst, num_cond,
+                                                    cormode))
+    # crosscorr' * v = u * s for each singular triplet
+    u = crosscorr.T @ v / s
+    stored_u = np.asarray(res['u'], dtype=np.float64).reshape(u.shape)
+    if not np.allclose(u, stored_u, rtol=1e-3, atol=1e-5*np.abs(stored_u).max()):
+        raise ValueError('datamat_lst does not give the brain saliences of the result')
+    with timings.stage('scores'):
+        lvcorrs = corr_maps(behav, datamat @ u, spans, cormode)
+    res = dict(res, resample_state=dict(state))
+    data = {
+        'datamat': datamat,
+        'behav': behav,
+        'spans': spans,
+        'num_subj_lst': num_subj_lst,
+        'num_cond': num_cond,
+        'cormode': cormode,
+        'seed': seed,
+        'svd_solver': svd_solver,
+        'batch_size': batch_size,
+        'u': u,
+        's': s,
+        'v': v,
+    }
+    if extra_perm:
+        # split-half only results have no perm_result, as num_perm was 0
+        num_perm = int(res['perm_result']['num_perm']) if 'perm_result' in res else 0
+        permsamp = perm_order(datamat.shape[0], extra_perm, seed, num_perm)
+        if num_perm:
+            permsamp = np.concatenate([np.asarray(res['perm_result']['permsamp'])
+                                       .astype(np.intp) - 1, permsamp], axis=1)
+        if 'perm_splithalf' in res:
+            data.update(num_lv=len(s), num_split=int(res['perm_splithalf']['num_split']),
+                        permsamp=permsamp)
+    if extra_boot:
+        data['boot_type'] = str(res['boot_result']['boot_type'])
+
+    job = None
+    if executor is not None and (extra_perm or extra_boot):
+        job = executor.scatter(data)
+    try:
+        if extra_perm:
+            progress = lambda done, total: timings.progress('permutation', done, total)
+            with timings.stage('permutation'):
+                if job is None:
+                    new = _perm_test(datamat, behav, spans, cormode, s, v, extra_perm, seed,
+                                     batch_size, svd_solver, progress, num_perm)
+                else:
+                    new = _distributed_perm_test(job, data, extra_perm, num_perm, progress)
+            sp = np.ravel(new['sp'])
+            if num_perm:
+                sp = sp + np.ravel(res['perm_result']['sp'])
+            res['perm_result'] = _perm_result(sp, permsamp, num_perm + extra_perm)
+            if 'perm_splithalf' in res:
+                res['perm_result']['is_perm_splithalf'] = 1.0
+        if extra_perm and 'perm_splithalf' in res:
+            with timings.stage('splithalf'):
+                res['perm_splithalf'] = _extend_splithalf(res['perm_splithalf'], data, num_perm,
+                    extra_perm, n_jobs,
+                    lambda done, total: timings.progress('splithalf', done, total), job)
+        if extra_boot:
+            boot = res['boot_result']
+            num_boot = int(boot['num_boot'])
+            moments = Moments(u.shape)
+            moments.count = num_boot
+            moments.mean = np.array(state['boot_mean'], dtype=np.float64)
+            moments.m2 = np.array(state['boot_m2'], dtype=np.float64)
+            with timings.stage('bootstrap'):
+                new = run_boot_shards(data, extra_boot, n_jobs, num_boot,
+                    lambda done, total: timings.progress('bootstrap', done, total), moments, job)
+                merged = {
+                    'moments': moments,
+                    'distrib': np.concatenate([np.asarray(boot['distrib']), new['distrib']],
+                                              axis=-1),
+                    'orders': merge_boot_orders([_stored_boot_orders(boot), new['orders']]),
+                }
+                res['boot_result'] = _boot_result(merged, data, s, lvcorrs, float(boot['clim']))
+            _store_moments(res, moments)
+    finally:
+        if job is not None:
+            job.close()
+    return engine_like(res)
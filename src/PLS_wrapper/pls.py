@@ -1,7 +1,31 @@
-import matlab.engine
 import numpy as np
+import asyncio
+import contextlib
+import copy
+import inspect
+import json
+import multiprocessing
 import os
+import queue
 import random
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, ProcessPoolExecutor, wait
+from . import matio, native, stream
+from .cache import ResultCache, result_key
+from .engine import MatlabSession, engine_context, install_helpers
+from .profiling import NULL_TIMINGS, Timings, make_timings, nbytes
+from .transfer import from_matlab, put, to_matlab, to_numpy_class
+
+try:
+    import matlab.engine
+except ImportError:
+    matlab = None
+
+def _require_matlab():
+    if matlab is None:
+        raise ImportError('MATLAB Engine API for Python is required for the matlab backend. '
+                          'Install it or use backend="native".')
 
 class Dict2Object:
     """Takes a dictionary and turns it into a class with an attribute for each key.
@@ -11,301 +35,391 @@ class Dict2Object:
             for key, value in dictionary.items():
                 setattr(self, key, value)
 
-def perm_result_values_conversion(res_dict_value, convert_to):
-    """Decides how to convert inner values from dict valued PLS result `perm_result`
+class LazyResult:
+    """Result object with the same attributes as `Dict2Object`, for results
+    read from a file. Each field is converted (and its arrays decoded or
+    memory-mapped) only when it is first accessed, then cached. Keeps the file
+    open or memory-mapped while alive. Shallow copies stay lazy; deep copies
+    and pickles convert every field first and no longer refer to the file.
     Parameters
     ----------
-    res_dict_value      :   dictionary from `other_input`
-    convert_to          :   string, choose whether converting to 'python' or
-                            'matlab'
+    raw                 :   dict of field names to raw values from
+                            `matio.loadmat(..., lazy=True)`
+    convert             :   callable taking a field name and its raw value and
+                            returning the converted value
+    """
+    __slots__ = ('_raw', '_values', '_convert')
+
+    def __init__(self, raw, convert):
+        object.__setattr__(self, '_raw', raw)
+        object.__setattr__(self, '_values', {})
+        object.__setattr__(self, '_convert', convert)
+
+    def __getattr__(self, key):
+        try:
+            raw = object.__getattribute__(self, '_raw')
+            values = object.__getattribute__(self, '_values')
+        except AttributeError:
+            raise AttributeError(key)
+        if key in values:
+            return values[key]
+        if key not in raw:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{key}'")
+        value = self._convert(key, raw[key])
+        values[key] = value
+        return value
+
+    def __setattr__(self, key, value):
+        self._values[key] = value
+
+    def __delattr__(self, key):
+        if key not in self._raw and key not in self._values:
+            raise AttributeError(key)
+        self._raw.pop(key, None)
+        self._values.pop(key, None)
+
+    def _keys(self):
+        return list(self._raw) + [key for key in self._values if key not in self._raw]
+
+    def __dir__(self):
+        return self._keys()
+
+    @property
+    def __dict__(self):
+        """All fields, converting any not accessed yet (as `vars(res)` on a
+        `Dict2Object` would give).
+        """
+        return {key: getattr(self, key) for key in self._keys()}
+
+    def __copy__(self):
+        new = LazyResult(dict(self._raw), self._convert)
+        new._values.update(self._values)
+        return new
+
+    def __deepcopy__(self, memo):
+        return _converted_lazy_result(copy.deepcopy(self.__dict__, memo))
+
+    def __reduce__(self):
+        # the raw values refer to the open file, so only converted fields
+        # are pickled
+        return _converted_lazy_result, (self.__dict__,)
+
+def _converted_lazy_result(values):
+    """`LazyResult` holding already converted fields only.
+    """
+    res = LazyResult({}, None)
+    res._values.update(values)
+    return res
+
+def _to_matlab_class(value, matlab_class, convert_to):
+    """Convert an array to a matlab array of `matlab_class`, or for 'numpy' to
+    an ndarray with the dtype of that class.
+    """
+    if convert_to == 'numpy':
+        return to_numpy_class(value, matlab_class)
+    return to_matlab(value, matlab_class)
+
+# Schema of behavioural PLS results: (path, matlab class, python type, shape
+# rule) for every field that is converted. Shape rules:
+#   'scalar'    python int/bool/float <-> 1x1 double (python float)
+#   'array'     ndarray of the python dtype <-> matlab array of the class
+#   'index'     like 'array', for 1-based resample indices, which 'compact'
+#               results hold in the smallest integer type
+#   'cell'      ndarray <-> 1x1 cell holding a matlab array of the class
+#   'str'       str <-> char array (python str)
+#   'struct'    Dict2Object <-> struct (dict), fields are the paths below it
+# Fields not in the schema are passed through unchanged.
+RESULT_SCHEMA = [
+    ('method',                                  'double',   int,        'scalar'),
+    ('is_struct',                               'double',   bool,       'scalar'),
+    ('datamatcorrs_lst',                        'single',   np.float32, 'cell'),
+    ('u',                                       'single',   np.float32, 'array'),
+    ('v',                                       'single',   np.float32, 'array'),
+    ('s',                                       'single',   np.float32, 'array'),
+    ('lvcorrs',                                 'single',   np.float32, 'array'),
+    ('usc',                                     'single',   np.float32, 'array'),
+    ('vsc',                                     'single',   np.float32, 'array'),
+    ('stacked_behavdata',                       'single',   np.float32, 'array'),
+    ('num_conditions',                          'double',   int,        'scalar'),
+    ('num_subj_lst',                            'double',   np.int64,   'array'),
+    ('perm_result',                             None,       Dict2Object,'struct'),
+    ('perm_result.num_perm',                    'double',   int,        'scalar'),
+    ('perm_result.is_perm_splithalf',           'double',   bool,       'scalar'),
+    ('perm_result.sp',                          'double',   np.float64, 'array'),
+    ('perm_result.sprob',                       'double',   np.float64, 'array'),
+    ('perm_result.permsamp',                    'double',   np.float64, 'index'),
+    ('perm_splithalf',                          None,       Dict2Object,'struct'),
+    ('perm_splithalf.num_outer_perm',           'double',   int,        'scalar'),
+    ('perm_splithalf.num_split',                'double',   int,        'scalar'),
+    ('perm_splithalf.orig_ucorr',               'double',   np.float64, 'array'),
+    ('perm_splithalf.orig_vcorr',               'double',   np.float64, 'array'),
+    ('perm_splithalf.ucorr_prob',               'double',   np.float64, 'array'),
+    ('perm_splithalf.vcorr_prob',               'double',   np.float64, 'array'),
+    ('perm_splithalf.ucorr_ll',                 'double',   np.float64, 'array'),
+    ('perm_splithalf.ucorr_ul',                 'double',   np.float64, 'array'),
+    ('perm_splithalf.vcorr_ll',                 'double',   np.float64, 'array'),
+    ('perm_splithalf.vcorr_ul',                 'double',   np.float64, 'array'),
+    ('boot_result',                             None,       Dict2Object,'struct'),
+    ('boot_result.num_boot',                    'double',   int,        'scalar'),
+    ('boot_result.countnewtotal',               'double',   int,        'scalar'),
+    ('boot_result.nonrotated_boot',             'double',   bool,       'scalar'),
+    ('boot_result.clim',                        'double',   float,      'scalar'),
+    ('boot_result.boot_type',                   'char',     str,        'str'),
+    ('boot_result.num_LowVariability_behav_boots','double', np.float64, 'array'),
+    ('boot_result.ulcorr',                      'double',   np.float64, 'array'),
+    ('boot_result.llcorr',                      'double',   np.float64, 'array'),
+    ('boot_result.ulcorr_adj',                  'double',   np.float64, 'array'),
+    ('boot_result.llcorr_adj',                  'double',   np.float64, 'array'),
+    ('boot_result.badbeh',                      'double',   np.float64, 'array'),
+    ('boot_result.prop',                        'double',   np.float64, 'array'),
+    ('boot_result.distrib',                     'double',   np.float64, 'array'),
+    ('boot_result.zero_u_se',                   'double',   np.float64, 'array'),
+    ('boot_result.bootsamp',                    'double',   np.int64,   'index'),
+    ('boot_result.bootsamp_4beh',               'double',   np.int64,   'index'),
+    ('boot_result.orig_corr',                   'single',   np.float32, 'array'),
+    ('boot_result.compare_u',                   'single',   np.float32, 'array'),
+    ('boot_result.u_se',                        'single',   np.float32, 'array'),
+    ('other_input',                             None,       Dict2Object,'struct'),
+    ('other_input.meancentering_type',          'double',   int,        'scalar'),
+    ('other_input.cormode',                     'double',   int,        'scalar'),
+    ('resample_state',                          None,       Dict2Object,'struct'),
+    ('resample_state.seed',                     'double',   int,        'scalar'),
+    ('resample_state.svd_solver',               'char',     str,        'str'),
+    ('resample_state.stacked_behavdata',        'double',   np.float64, 'array'),
+    ('resample_state.s',                        'double',   np.float64, 'array'),
+    ('resample_state.v',                        'double',   np.float64, 'array'),
+    ('resample_state.boot_mean',                'double',   np.float64, 'array'),
+    ('resample_state.boot_m2',                  'double',   np.float64, 'array'),
+]
+
+# 'compact' gives python results whose arrays keep the dtype of their matlab
+# class and whose resample indices use the smallest integer type
+CONVERT_TO = ['python','matlab','numpy','compact']
+_PYTHON_LIKE = ['python','compact']
+
+# fields only kept on python results, never converted to matlab types or saved
+_PYTHON_ONLY_FIELDS = ['timings']
+
+def _scalar_rule(matlab_class, python_type, convert_to):
+    if convert_to not in _PYTHON_LIKE:
+        return float
+    if python_type is bool:
+        return lambda value: bool(int(value))
+    return python_type
+
+def _array_rule(matlab_class, python_type, convert_to):
+    if convert_to in _PYTHON_LIKE:
+        return lambda value: from_matlab(value, dtype=python_type)
+    return lambda value: _to_matlab_class(value, matlab_class, convert_to)
+
+def _smallest_int(arr):
+    """Return an array of integral values in the smallest integer type that
+    holds them (unchanged if any value is not integral).
+    """
+    if arr.size == 0 or arr.dtype.kind in 'biu' and arr.dtype.itemsize == 1:
+        return arr
+    low, high = arr.min(), arr.max()
+    if arr.dtype.kind == 'f' and not (np.isfinite([low, high]).all() and
+                                      np.array_equal(arr, np.trunc(arr))):
+        return arr
+    dtype = np.result_type(np.min_scalar_type(int(low)), np.min_scalar_type(int(high)))
+    return arr.astype(dtype, copy=False)
+
+def _index_rule(matlab_class, python_type, convert_to):
+    if convert_to == 'compact':
+        return lambda value: _smallest_int(from_matlab(value))
+    return _array_rule(matlab_class, python_type, convert_to)
+
+def _cell_rule(matlab_class, python_type, convert_to):
+    if convert_to == 'python':
+        return lambda value: from_matlab(value[0], dtype=python_type)
+    if convert_to == 'compact':
+        # from a matlab cell, or the array of a python result
+        return lambda value: from_matlab(value[0] if isinstance(value, list) else value,
+                                         dtype=python_type)
+    return lambda value: [_to_matlab_class(value, matlab_class, convert_to)]
+
+def _str_rule(matlab_class, python_type, convert_to):
+    return str
+
+def _struct_rule(table, convert_to):
+    if convert_to == 'python':
+        return lambda value: Dict2Object(_convert_fields(table, value))
+    if convert_to == 'compact':
+        return lambda value: Dict2Object(_convert_fields(table, getattr(value, '__dict__', value)))
+    # Dict2Object and LazyResult fields through __dict__, dicts as they are
+    return lambda value: _convert_fields(table, getattr(value, '__dict__', value))
+
+_SHAPE_RULES = {
+    'scalar': _scalar_rule,
+    'array': _array_rule,
+    'index': _index_rule,
+    'cell': _cell_rule,
+    'str': _str_rule,
+}
+
+def compile_schema(schema):
+    """Compile a result schema into per-key conversion functions.
+    Parameters
+    ----------
+    schema              :   list of (path, matlab class, python type, shape
+                            rule) tuples, see `RESULT_SCHEMA`
+
     Return
     ------
-    new_dict            :   converted dictionary
+    tables              :   dict with a table for each of `CONVERT_TO`, each
+                            a dict of top level field name to a function
+                            converting that field's value
+    structs             :   dict with, for each of `CONVERT_TO`, a dict of
+                            struct field name to the table of its inner fields
     """
-    assert convert_to in ['python','matlab']
+    children = {}
+    for path, matlab_class, python_type, rule in schema:
+        parent, _, key = path.rpartition('.')
+        children.setdefault(parent, []).append((key, matlab_class, python_type, rule))
+
+    def compile_table(parent, convert_to, structs):
+        table = {}
+        for key, matlab_class, python_type, rule in children.get(parent, []):
+            path = f'{parent}.{key}' if parent else key
+            if rule == 'struct':
+                inner = compile_table(path, convert_to, structs)
+                structs[path] = inner
+                table[key] = _struct_rule(inner, convert_to)
+            else:
+                table[key] = _SHAPE_RULES[rule](matlab_class, python_type, convert_to)
+        return table
+
+    tables = {}
+    structs = {}
+    for convert_to in CONVERT_TO:
+        structs[convert_to] = {}
+        tables[convert_to] = compile_table('', convert_to, structs[convert_to])
+    return tables, structs
 
-    matlab_double_arrays = [
-        'sp',
-        'sprob',
-        'permsamp'
-    ]
+def _convert_fields(table, fields):
+    """Convert a dict of fields in one pass with a compiled table, leaving
+    fields the table does not know unchanged.
+    """
     new_dict = {}
-    for key, value in res_dict_value.items():
-        if key in matlab_double_arrays:
-            if convert_to == 'python':
-                new_value = np.array(value)
-            elif convert_to == 'matlab':
-                new_value = matlab.double(value)
-        elif key == 'num_perm':
-            if convert_to == 'python':
-                new_value = int(value)
-            elif convert_to == 'matlab':
-                new_value = float(value)
-        elif key == 'is_perm_splithalf':
-            if convert_to == 'python':
-                new_value = bool(int(value))
-            elif convert_to == 'matlab':
-                new_value = float(value)
-        else:
-            new_value = value
-        new_dict[key] = new_value
+    for key, value in fields.items():
+        convert = table.get(key)
+        new_dict[key] = value if convert is None else convert(value)
     return new_dict
 
-def perm_splithalf_values_conversion(res_dict_value, convert_to):
-    """Decides how to convert inner values from dict valued PLS result `perm_splithalf`
+_RESULT_TABLES, _STRUCT_TABLES = compile_schema(RESULT_SCHEMA)
+
+def _struct_values_conversion(struct, res_dict_value, convert_to):
+    assert convert_to in CONVERT_TO
+    return _convert_fields(_STRUCT_TABLES[convert_to][struct], res_dict_value)
+
+def perm_result_values_conversion(res_dict_value, convert_to):
+    """Convert inner values from dict valued PLS result `perm_result`
     Parameters
     ----------
-    res_dict_value      :   dictionary from `other_input`
-    convert_to          :   string, choose whether converting to 'python' or
-                            'matlab'
+    res_dict_value      :   dictionary from `perm_result`
+    convert_to          :   string, choose whether converting to 'python',
+                            'matlab', 'numpy' (matlab types as ndarrays and
+                            floats, for writing *.mat files without matlab) or
+                            'compact' (python, with resample indices in the
+                            smallest integer type)
     Return
     ------
     new_dict            :   converted dictionary
     """
-    assert convert_to in ['python','matlab']
-
-    matlab_double_arrays = [
-        'orig_ucorr',
-        'orig_vcorr',
-        'ucorr_prob',
-        'vcorr_prob',
-        'ucorr_ll',
-        'ucorr_ul',
-        'vcorr_ll',
-        'vcorr_ul'
-    ]
-    float_to_int = [
-        'num_outer_perm',
-        'num_split'
-    ]
+    return _struct_values_conversion('perm_result', res_dict_value, convert_to)
 
-    new_dict = {}
-    for key, value in res_dict_value.items():
-        if key in matlab_double_arrays:
-            if convert_to == 'python':
-                new_value = np.array(value)
-            elif convert_to == 'matlab':
-                new_value = matlab.double(value)
-        elif key in float_to_int:
-            if convert_to == 'python':
-                new_value = int(value)
-            elif convert_to == 'matlab':
-                new_value = float(value)
-        else:
-            new_value = value
-        new_dict[key] = new_value
-    return new_dict
+def perm_splithalf_values_conversion(res_dict_value, convert_to):
+    """Convert inner values from dict valued PLS result `perm_splithalf`
+    Parameters
+    ----------
+    res_dict_value      :   dictionary from `perm_splithalf`
+    convert_to          :   string, choose whether converting to 'python',
+                            'matlab', 'numpy' (matlab types as ndarrays and
+                            floats, for writing *.mat files without matlab) or
+                            'compact' (python, with resample indices in the
+                            smallest integer type)
+    Return
+    ------
+    new_dict            :   converted dictionary
+    """
+    return _struct_values_conversion('perm_splithalf', res_dict_value, convert_to)
 
 def boot_result_values_conversion(res_dict_value, convert_to):
-    """Decides how to convert inner values from dict valued PLS result `boot_result`
+    """Convert inner values from dict valued PLS result `boot_result`
     Parameters
     ----------
-    res_dict_value      :   dictionary from `other_input`
-    convert_to          :   string, choose whether converting to 'python' or
-                            'matlab'
+    res_dict_value      :   dictionary from `boot_result`
+    convert_to          :   string, choose whether converting to 'python',
+                            'matlab', 'numpy' (matlab types as ndarrays and
+                            floats, for writing *.mat files without matlab) or
+                            'compact' (python, with resample indices in the
+                            smallest integer type)
     Return
     ------
     new_dict            :   converted dictionary
     """
-    assert convert_to in ['python','matlab']
-
-    float_to_int = [
-        'num_boot',
-        'countnewtotal',
-    ]
-    float_to_bool = [
-        'nonrotated_boot',
-    ]
-    ndarray_to_float = [
-        'clim',
-    ]
-    matlab_double_arrays_to_float_numpy = [
-        'num_LowVariability_behav_boots',
-        'ulcorr',
-        'llcorr',
-        'ulcorr_adj',
-        'llcorr_adj',
-        'badbeh',
-        'prop',
-        'distrib',
-        'zero_u_se',
-    ]
-    matlab_double_arrays_to_int_numpy = [
-        'bootsamp_4beh',
-        'bootsamp',
-    ]
-    matlab_single_arrays = [
-        'orig_corr',
-        'compare_u',
-        'u_se',
-    ]
-    ndarray_to_str = [
-        'boot_type',
-    ]
-
-    new_dict = {}
-    for key, value in res_dict_value.items():
-        if key in float_to_int:
-            if convert_to == 'python':
-                new_value = int(value)
-            elif convert_to == 'matlab':
-                new_value = float(value)
-        elif key in float_to_bool:
-            if convert_to == 'python':
-                new_value = bool(int(value))
-            elif convert_to == 'matlab':
-                new_value = float(value)
-        elif key in ndarray_to_float:
-            new_value = float(value)
-        elif (key in matlab_double_arrays_to_float_numpy) or (key in matlab_single_arrays):
-            if convert_to == 'python':
-                new_value = np.array(value)
-            elif (convert_to == 'matlab') and (key in matlab_double_arrays_to_float_numpy):
-                new_value = matlab.double(value)
-            elif (convert_to == 'matlab') and (key in matlab_single_arrays):
-                if value.shape==():
-                    new_value = matlab.single(float(value))
-                else:
-                    new_value = matlab.single(value)
-        elif key in matlab_double_arrays_to_int_numpy:
-            if convert_to == 'python':
-                new_value = np.array(value,dtype=np.int64)
-            elif convert_to == 'matlab':
-                new_value = np.array(value,dtype=np.float64)
-                new_value = matlab.double(new_value)
-        elif key in ndarray_to_str:
-            new_value = str(value)
-        else:
-            new_value = value
-        new_dict[key] = new_value
-    return new_dict
+    return _struct_values_conversion('boot_result', res_dict_value, convert_to)
 
 def other_input_values_conversion(res_dict_value, convert_to):
-    """Decides how to convert inner values from dict valued PLS result `other_input`
+    """Convert inner values from dict valued PLS result `other_input`
     Parameters
     ----------
     res_dict_value      :   dictionary from `other_input`
-    convert_to          :   string, choose whether converting to 'python' or
-                            'matlab'
+    convert_to          :   string, choose whether converting to 'python',
+                            'matlab', 'numpy' (matlab types as ndarrays and
+                            floats, for writing *.mat files without matlab) or
+                            'compact' (python, with resample indices in the
+                            smallest integer type)
     Return
     ------
     new_dict            :   converted dictionary
     """
-    assert convert_to in ['python','matlab']
-
-    new_dict = {}
-    for key, value in res_dict_value.items():
-        if key == 'meancentering_type':
-            if convert_to == 'python':
-                new_value = bool(value)
-            elif convert_to == 'matlab':
-                new_value = float(value)
-        elif key == 'cormode':
-            if convert_to == 'python':
-                new_value = bool(int(value))
-            elif convert_to == 'matlab':
-                new_value = float(value)
-        else:
-            new_value = value
-        new_dict[key] = new_value
-    return new_dict
+    return _struct_values_conversion('other_input', res_dict_value, convert_to)
 
 def PLS_result_conversion(res, convert_to):
     """Take a result from pls_analysis_py.m and convert it to an object with only python native types
+    (or back), with the conversion of each field given by `RESULT_SCHEMA`.
     Parameters
     ----------
     res                 :   result from behavioural PLS
-    convert_to          :   string, choose whether converting to 'python' or
-                            'matlab'
+    convert_to          :   string, choose whether converting to 'python',
+                            'matlab', 'numpy' (matlab types as ndarrays and
+                            floats, for writing *.mat files without matlab) or
+                            'compact' (python, with resample indices in the
+                            smallest integer type)
     Return
     ------
-    new_dict            :   converted dictionary
+    new_dict            :   converted dictionary (a `Dict2Object` for 'python'
+                            and 'compact')
 
     """
-    assert convert_to in ['python','matlab']
-
-    matlab_single_arrays = [
-        'u',
-        'v',
-        's',
-        'lvcorrs',
-        'usc',
-        'vsc',
-        'stacked_behavdata'
-    ]
-    float_to_int = [
-        'num_conditions'
-    ]
-    res_new = {}
-
-    if convert_to == 'matlab':
-        res = res.__dict__.copy()
-    for key, value in res.items():
-        if key == 'method':
-            if convert_to == 'python':
-                new_value = int(value)
-            if convert_to == 'matlab':
-                new_value = float(value)
-        if key == 'is_struct':
-            if convert_to == 'python':
-                new_value = bool(int(value))
-            elif convert_to == 'matlab':
-                new_value = float(value)
-        elif key == 'datamatcorrs_lst':
-            if convert_to == 'python':
-                new_value = np.array(value[0])
-            elif convert_to == 'matlab':
-                new_value = [matlab.single(value)]
-        elif key in matlab_single_arrays:
-            if convert_to == 'python':
-                new_value = np.array(value)
-            elif convert_to == 'matlab':
-                if value.shape==():
-                    new_value = matlab.single(float(value))
-                else:
-                    new_value = matlab.single(value)
-        elif key in float_to_int:
-            if convert_to == 'python':
-                new_value = int(value)
-            elif convert_to == 'matlab':
-                new_value = float(value)
-        elif key == 'num_subj_lst':
-            if convert_to == 'python':
-                new_value = np.array(value,dtype=np.int64)
-            elif convert_to == 'matlab':
-                new_value = np.array(value,dtype=np.float64)
-                new_value = matlab.double(new_value)
-        elif key in 'perm_result':
-            if convert_to == 'matlab':
-                value = value.__dict__
-            new_value = perm_result_values_conversion(value, convert_to=convert_to)
-            if convert_to == 'python':
-                new_value = Dict2Object(new_value)
-        elif key in 'perm_splithalf':
-            if convert_to == 'matlab':
-                value = value.__dict__
-            new_value = perm_splithalf_values_conversion(value, convert_to=convert_to)
-            if convert_to == 'python':
-                new_value = Dict2Object(new_value)
-        elif key in 'boot_result':
-            if convert_to == 'matlab':
-                value = value.__dict__
-            new_value = boot_result_values_conversion(value, convert_to=convert_to)
-            if convert_to == 'python':
-                new_value = Dict2Object(new_value)
-        elif key in 'other_input':
-            if convert_to == 'matlab':
-                value = value.__dict__
-            new_value = other_input_values_conversion(value, convert_to=convert_to)
-            if convert_to == 'python':
-                new_value = Dict2Object(new_value)
-        else:
-            new_value = value
-        res_new[key] = new_value
+    assert convert_to in CONVERT_TO
     if convert_to == 'python':
-        return Dict2Object(res_new)
-    elif convert_to == 'matlab':
-        return res_new
+        return Dict2Object(_convert_fields(_RESULT_TABLES['python'], res))
+    if convert_to == 'compact':
+        # from a raw result, or another python result
+        return Dict2Object(_convert_fields(_RESULT_TABLES['compact'],
+                                           getattr(res, '__dict__', res)))
+    fields = {key: value for key, value in res.__dict__.items() if key not in _PYTHON_ONLY_FIELDS}
+    return _convert_fields(_RESULT_TABLES[convert_to], fields)
+
+def _lazy_struct_field(table):
+    def convert(key, value):
+        return _convert_fields(table, {key: matio.resolve(value)})[key]
+    return convert
+
+def _lazy_result_field(key, value, convert_to='python'):
+    """Convert one top level field of a lazily loaded result, the way
+    `PLS_result_conversion` would.
+    """
+    structs = _STRUCT_TABLES[convert_to]
+    if key in structs and isinstance(value, dict):
+        return LazyResult(value, _lazy_struct_field(structs[key]))
+    return _convert_fields(_RESULT_TABLES[convert_to], {key: matio.resolve(value)})[key]
+
+def _lazy_compact_field(key, value):
+    return _lazy_result_field(key, value, 'compact')
 
 def pls_analysis(datamat_lst,num_subj_lst,num_cond,stacked_behavdata,
     num_perm=0,
@@ -316,19 +430,30 @@ def pls_analysis(datamat_lst,num_subj_lst,num_cond,stacked_behavdata,
     boot_type='strat',
     clim=95.0,
     make_script=True,
-    seed=None
+    seed=None,
+    session=None,
+    backend='matlab',
+    batch_size=None,
+    n_jobs=None,
+    num_lv=None,
+    svd_solver='full',
+    block_size=None,
+    executor=None,
+    keep_resample_state=False,
+    transfer='buffer',
+    cache=None,
+    timings=None
     ):
     """Python wrapper for matlab implementation of pls_analysis.
     Will use matlab python library to call the original matlab script.
-    Warning that this creates (and removes when finished) a matlab script 
-    called `pls_analysis_py.m` to call `pls_analysis.m` from the matlab PLS 
-    package and removes the `field_descrip` variable (character arrays are 
-    problematic, and this variable is not necessary), so make sure there isn't 
-    a script called `pls_analysis_py.m` in your working directory that you 
-    don't want deleted (not likely but worth mentioning). If you want to 
-    avoid the need for this you can copy the `pls_analysis_py.m` script from 
-    this repository to your PLS directory or a matlab path directory and set 
-    `make_script=False`.
+    The matlab function `pls_analysis_py.m` calls `pls_analysis.m` from the
+    matlab PLS package and removes the `field_descrip` variable (character
+    arrays are problematic, and this variable is not necessary). It is
+    written once per engine into a private temporary directory added to the
+    engine's matlab path (see `engine.install_helpers`), never into the
+    working directory, so concurrent analyses can share it. If you have
+    copied the `pls_analysis_py.m` script from this repository to your PLS
+    directory or a matlab path directory you can set `make_script=False`.
 
     Parameters
     ----------
@@ -336,6 +461,10 @@ def pls_analysis(datamat_lst,num_subj_lst,num_cond,stacked_behavdata,
                             Rows represent independent variable data. 
                             If a single 2D ndarray is given will convert to 
                             list automatically.
+                            Datamats too large for memory can be given as
+                            memory-mapped arrays, `.npy` paths, h5py/zarr
+                            datasets or callables yielding column blocks (see
+                            `PLS_wrapper.stream`).
     num_subj_lst        :   list of integers representing sizes of groups. 
                             If a single integer is given will convert to list 
                             automatically.
@@ -344,6 +473,8 @@ def pls_analysis(datamat_lst,num_subj_lst,num_cond,stacked_behavdata,
                             data
     num_perm            :   int, default=0. Number of permutations.
     num_split           :   int, default=0. Number of split half permutations.
+                            Not supported for streamed datamats (native
+                            backend).
     num_boot            :   int, default=0. Number of bootstrap permutations.
     meancentering_type  :   int, default=0. Type of meancentering.
                             0. Remove group condition means from conditon means
@@ -372,14 +503,106 @@ def pls_analysis(datamat_lst,num_subj_lst,num_cond,stacked_behavdata,
                             nonstratified boot samples.
     clim                :   float, default=95.0. Confidence level between 0.0 
                             and 100.0.
-    make_script         :   bool, default=True. Whether to make and delete the
-                            pls_analysis_py.m file in the working directory.
+    make_script         :   bool, default=True. Whether to install the
+                            pls_analysis_py.m function on the engine (once
+                            per engine, in a private temporary directory).
                             If you have copied this file to the PLS directory
                             or a matlab path folder you can set this to False.
     seed                :   int, default=None. Seed to initialize rng random
                             number generator in matlab. If none given, will
                             be set to a random seed with python's 
                             random.randitnt(1,2**32)
+    session             :   default=None. `MatlabSession`, `EnginePool` or
+                            started matlab engine to run the analysis in. If
+                            None is given, a shared session is started on
+                            first use and reused by later calls.
+    backend             :   string, default='matlab'. 'matlab' calls the
+                            original matlab implementation. 'native' computes
+                            the analysis with numpy (no matlab needed); seeds
+                            the numpy random number generator instead of
+                            matlab's, so resamples differ from the matlab
+                            backend. Bootstrap samples in which a behaviour is
+                            constant within a group and condition are redrawn
+                            and counted in `boot_result` (`countnewtotal`,
+                            `badbeh`, `num_LowVariability_behav_boots`).
+    batch_size          :   int, default=None. Native backend only. Number of
+                            permutations (or split-half splits) computed
+                            together as one stacked array. None picks a batch
+                            of about 256 MB.
+    n_jobs              :   int, default=None. Native backend only. Number of
+                            processes to spread bootstrap samples and
+                            split-half outer permutations over. None for 1, -1
+                            for every core. A given `seed` gives the same
+                            `boot_result` and `perm_splithalf` for any number
+                            of processes.
+    num_lv              :   int, default=None. Native backend only. Number of
+                            latent variables to compute. None computes all of
+                            them. When given, `u`, `v`, `usc`, `vsc`,
+                            `lvcorrs` and every LV dimension of `perm_result`
+                            and `boot_result` (`sp`, `sprob`, `u_se`,
+                            `compare_u`, `orig_corr`, `distrib`, ...) have
+                            `num_lv` columns instead of one per behaviour
+                            correlation, and `s` has `num_lv` rows. Resamples
+                            are rotated onto these LVs only, so resampling
+                            statistics can differ slightly from full mode.
+    svd_solver          :   string, default='full'. Native backend only.
+                            'full' computes the full SVD and truncates it to
+                            `num_lv`. 'randomized' (randomized subspace
+                            iteration) and 'arpack' (needs scipy) only compute
+                            the first `num_lv` singular triplets, for the
+                            original data and every permutation and bootstrap
+                            sample. 'randomized' only applies where it is
+                            faster: to the original data with at least
+                            5*(num_lv+10) behaviour correlations (groups x
+                            conditions x behaviours), and to the resamples
+                            with at least 40*(num_lv+10); otherwise the exact
+                            decomposition is used.
+    block_size          :   int, default=None. Native backend only. Columns
+                            (voxels) of the datamats read at a time. Datamats
+                            that are not in-memory ndarrays are always read in
+                            blocks; None picks blocks of about 16 MB. Only one
+                            block is held in memory at a time. Streamed
+                            datamats cannot be used with `num_split` or
+                            `executor` (ValueError), and their resamples use
+                            the Gram matrix eigendecomposition and no `n_jobs`.
+    executor            :   default=None. Native backend only. A
+                            `DistributedExecutor` from
+                            `PLS_wrapper.distributed` to run the permutation,
+                            split-half and bootstrap stages on, in chunks
+                            spread over its (possibly remote) worker
+                            processes, instead of over `n_jobs` processes.
+                            Results are identical. Not for streamed datamats
+                            or `pls_analysis_async` (ValueError).
+    keep_resample_state :   bool, default=False. Native backend only. Keep
+                            the seed, float64 behaviour data, singular values,
+                            behaviour saliences and bootstrap salience moments
+                            in `res_py.resample_state` (about three times the
+                            size of `u`), which `extend_pls_result` needs.
+    transfer            :   string, default='buffer'. Matlab backend only. How
+                            `datamat_lst` is sent to matlab. 'buffer' passes
+                            contiguous arrays through the engine API without
+                            extra copies. 'file' stages each datamat through a
+                            temporary raw file read with matlab's `fread`,
+                            bypassing the engine API's argument marshalling.
+                            Which is faster depends on the matlab release and
+                            disk; time both with `benchmarks/bench_transfer.py`.
+    cache               :   default=None. `ResultCache` from
+                            `PLS_wrapper.cache`, or the path of its directory,
+                            to look the result up in before running the
+                            analysis and store it in after. Only used when a
+                            `seed` is given, so that cached results are
+                            reproducible. The key covers every input array,
+                            every option that changes the result, `seed`,
+                            `backend` and the package version.
+    timings             :   default=None. True, a callable or a `Timings`
+                            from `PLS_wrapper.profiling` to record the wall
+                            time and bytes moved of each stage (engine start,
+                            transfer, matlab call or svd, permutation and
+                            bootstrap, conversion, cache), and permutation and
+                            bootstrap progress (native backend). A callable is
+                            called with each event as it happens. The
+                            `Timings` is attached to the result as
+                            `res_py.timings` (not saved by `save_pls_model`).
 
     Return
     ------
@@ -394,30 +617,185 @@ def pls_analysis(datamat_lst,num_subj_lst,num_cond,stacked_behavdata,
                             converted to int in python.
                             Floats as python floats.
     """
-    eng = matlab.engine.start_matlab()
-    if seed:
-        eng.rng(seed)
+    args = dict(locals())
+    assert backend in ['matlab','native']
+    assert transfer in ['buffer','file']
+    timings = make_timings(timings)
+    if cache is not None:
+        with timings.stage('cache_lookup'):
+            cache, cache_key, res_py = _cache_lookup(args)
+        if res_py is not None:
+            return _with_timings(res_py, timings)
     else:
-        eng.rng(random.randint(1,2**32))
+        cache_key = None
+    if not seed:
+        seed = random.randint(1,2**32)
+
+    if backend == 'native':
+        res = native.pls_analysis(datamat_lst,num_subj_lst,num_cond,stacked_behavdata,
+            num_perm=num_perm,
+            num_split=num_split,
+            num_boot=num_boot,
+            meancentering_type=meancentering_type,
+            cormode=cormode,
+            boot_type=boot_type,
+            clim=clim,
+            seed=seed,
+            batch_size=batch_size,
+            n_jobs=n_jobs,
+            num_lv=num_lv,
+            svd_solver=svd_solver,
+            block_size=block_size,
+            executor=executor,
+            keep_resample_state=keep_resample_state,
+            timings=timings
+            )
+        with timings.stage('conversion', nbytes(res)):
+            res_py = PLS_result_conversion(res, convert_to='python')
+        if cache_key is not None:
+            with timings.stage('cache_store'):
+                cache.put(cache_key, PLS_result_conversion(res_py, convert_to='numpy'))
+        return _with_timings(res_py, timings)
+
+    _require_matlab()
+    with contextlib.ExitStack() as stack:
+        with timings.stage('engine'):
+            eng = stack.enter_context(engine_context(session))
+        eng.rng(seed)
 
-    # Matlab script for calling pls_analysis.m and removing 'field_descrip'
-    if make_script:
-        temp_script =   'function result = pls_analysis_py(datamat_lst, num_subj_lst, k, opt)\n' \
-                        '    result_tmp = pls_analysis(datamat_lst, num_subj_lst, k, opt);\n' \
-                        '    result = rmfield(result_tmp,"field_descrip");\n' \
-                        'end'
+        # Matlab function for calling pls_analysis.m and removing 'field_descrip'
+        if make_script:
+            install_helpers(eng)
 
-        with open('pls_analysis_py.m','w+') as f:
-            f.write(temp_script)
+        if not isinstance(datamat_lst, (list, tuple)):
+            datamat_lst = [datamat_lst]
 
-    if type(datamat_lst) is np.ndarray:
-        datamat_lst = [datamat_lst.copy()]
+        with timings.stage('transfer', nbytes(datamat_lst) + nbytes(stacked_behavdata)):
+            num_subj_lst, num_cond, option = _matlab_inputs(num_subj_lst,num_cond,stacked_behavdata,
+                num_perm,num_split,num_boot,meancentering_type,cormode,boot_type,clim)
+            if transfer == 'buffer':
+                datamat_lst = [to_matlab(stream.materialize(datamat)) for datamat in datamat_lst]
+            else:
+                # Stage datamats through files and call pls_analysis_py on workspace variables
+                names = [f'datamat_{i}_py__' for i in range(len(datamat_lst))]
+                for name, datamat in zip(names, datamat_lst):
+                    put(eng, name, datamat, method='file')
 
-    num_subj_lst = matlab.double(num_subj_lst)
+        # pls_analysis.m runs the svd, permutations and bootstrap in one call
+        with timings.stage('matlab'):
+            if transfer == 'buffer':
+                res = eng.pls_analysis_py(datamat_lst,num_subj_lst,num_cond,option)
+            else:
+                res = _pls_analysis_py_workspace(eng, names, num_subj_lst, num_cond, option)
+                eng.eval(f"clear {' '.join(names)};", nargout=0)
+        with timings.stage('conversion') as info:
+            res_py = PLS_result_conversion(res, convert_to='python')
+            info['bytes'] = nbytes(res_py)
+
+    if cache_key is not None:
+        with timings.stage('cache_store'):
+            cache.put(cache_key, PLS_result_conversion(res_py, convert_to='numpy'))
+    return _with_timings(res_py, timings)
+
+def _with_timings(res_py, timings):
+    """Attach `timings` to a result as its `timings` attribute, if recording.
+    """
+    if timings is not NULL_TIMINGS:
+        res_py.timings = timings
+    return res_py
+
+def extend_pls_result(res_py, datamat_lst, extra_perm=0, extra_boot=0, batch_size=None,
+    n_jobs=None, executor=None, timings=None):
+    """Add permutations and bootstrap samples to an existing result, e.g.
+    to tighten p-values or confidence intervals, without running the
+    samples it already has again.
+    Only results of the native backend run with `keep_resample_state=True`
+    (which carry a `resample_state` with the seed, solver, behaviour data,
+    singular values, behaviour saliences and bootstrap moments) can be
+    extended, also after `save_pls_model` and `load_pls_model`. The stored
+    decomposition is reused, not recomputed. New samples continue the stored
+    `permsamp` and `bootsamp` with the same random streams, so the result
+    matches a single `pls_analysis` run with `num_perm + extra_perm` and
+    `num_boot + extra_boot`: resample indices and permutation and split-half
+    counts exactly, bootstrap distributions, `u_se` and `compare_u` up to
+    floating point rounding. A split-half only result (`num_perm=0`) gets the
+    `perm_result` of a single run.
+
+    Parameters
+    ----------
+    res_py              :   result of `pls_analysis` (backend='native')
+    datamat_lst         :   list of 2D ndarrays (or a single 2D ndarray), the
+                            datamats the result was computed from, in
+                            memory. Checked against the brain saliences of the
+                            result.
+    extra_perm          :   int, default=0. Number of permutations (and outer
+                            split-half permutations) to add. The result must
+                            have a permutation or split-half test.
+    extra_boot          :   int, default=0. Number of bootstrap samples to
+                            add. The result must have a bootstrap.
+    batch_size          :   int, default=None. As in `pls_analysis`.
+    n_jobs              :   int, default=None. As in `pls_analysis`.
+    executor            :   default=None. As in `pls_analysis`.
+    timings             :   default=None. As in `pls_analysis`.
+
+    Return
+    ------
+    res_py              :   new result with the extended `perm_result`,
+                            `perm_splithalf` and `boot_result`
+    """
+    timings = make_timings(timings)
+    res = PLS_result_conversion(res_py, convert_to='numpy')
+    res = native.extend_result(res, datamat_lst, extra_perm=extra_perm, extra_boot=extra_boot,
+        batch_size=batch_size, n_jobs=n_jobs, executor=executor, timings=timings)
+    with timings.stage('conversion', nbytes(res)):
+        res_py = PLS_result_conversion(res, convert_to='python')
+    return _with_timings(res_py, timings)
+
+def _cache_lookup(args):
+    """Look a `pls_analysis` call up in its `cache` argument.
+    Parameters
+    ----------
+    args                :   dict of every `pls_analysis` argument
+
+    Return
+    ------
+    cache               :   `ResultCache`, or None if not caching
+    cache_key           :   str, or None if not caching
+    res_py              :   cached result, or None if not found
+    """
+    cache = args['cache']
+    if cache is None or not args['seed']:
+        return None, None, None
+    if isinstance(cache, str):
+        cache = ResultCache(cache)
+    options = {key: args[key] for key in ['num_perm','num_split','num_boot','meancentering_type',
+                                          'cormode','boot_type','seed','backend']}
+    options['clim'] = float(args['clim'])
+    if args['backend'] == 'native':
+        options.update({'num_lv': args['num_lv'], 'svd_solver': args['svd_solver'],
+                        'keep_resample_state': args['keep_resample_state']})
+    cache_key = result_key(args['datamat_lst'], args['num_subj_lst'], args['num_cond'],
+                           args['stacked_behavdata'], options)
+    res = cache.get(cache_key)
+    if res is None:
+        return cache, cache_key, None
+    return cache, cache_key, PLS_result_conversion(res, convert_to='python')
+
+def _matlab_inputs(num_subj_lst, num_cond, stacked_behavdata, num_perm, num_split, num_boot,
+    meancentering_type, cormode, boot_type, clim):
+    """Convert the `pls_analysis` arguments other than `datamat_lst` for the
+    matlab engine.
+    Return
+    ------
+    num_subj_lst        :   matlab.double
+    num_cond            :   matlab.double
+    option              :   dict of `pls_analysis.m` options
+    """
+    num_subj_lst = to_matlab(num_subj_lst)
 
     if stacked_behavdata.ndim == 1:
         stacked_behavdata = stacked_behavdata[:,None]
-    stacked_behavdata = matlab.double(stacked_behavdata.copy())
+    stacked_behavdata = to_matlab(stacked_behavdata)
 
     num_cond = matlab.double(num_cond)
 
@@ -431,32 +809,687 @@ def pls_analysis(datamat_lst,num_subj_lst,num_cond,stacked_behavdata,
     option['cormode'] = cormode
     option['boot_type'] = boot_type
     option['clim'] = matlab.double(clim)
+    return num_subj_lst, num_cond, option
+
+def _pls_analysis_py_workspace(eng, names, num_subj_lst, num_cond, option, started=None):
+    """Call pls_analysis_py on datamats already in the engine workspace as
+    the variables `names`, returning the raw result. If `started` is given,
+    the call runs in the background and `started` is called with its future
+    (e.g. to be able to cancel it) before it is waited for.
+    """
+    eng.workspace['num_subj_lst_py__'] = num_subj_lst
+    eng.workspace['num_cond_py__'] = num_cond
+    eng.workspace['option_py__'] = option
+    command = (f"res_py__ = pls_analysis_py({{{','.join(names)}}}, num_subj_lst_py__, "
+               "num_cond_py__, option_py__);")
+    try:
+        if started is None:
+            eng.eval(command, nargout=0)
+        else:
+            call = eng.eval(command, nargout=0, background=True)
+            started(call)
+            call.result()
+        return eng.workspace['res_py__']
+    finally:
+        eng.eval("clear res_py__ num_subj_lst_py__ num_cond_py__ option_py__;", nargout=0)
 
-    res = eng.pls_analysis_py(datamat_lst,num_subj_lst,num_cond,option)
-    res_py = PLS_result_conversion(res, convert_to='python')
+class PLSFuture(Future):
+    """`concurrent.futures.Future` of a `pls_analysis_async` result.
+    Unlike a plain future, `cancel` also stops an analysis that is already
+    running (the matlab call is interrupted, the native worker process is
+    terminated), and the future can be awaited in asyncio code. It stays
+    pending while the analysis runs, so `running` is always False.
+    """
+    def __init__(self):
+        super().__init__()
+        self._stop = None
+        self._stop_lock = threading.Lock()
 
-    if make_script:
-        os.remove('pls_analysis_py.m')
+    def __await__(self):
+        return asyncio.wrap_future(self).__await__()
 
-    return res_py
+    def _set_stop(self, stop):
+        """Set the callable that stops the running analysis, calling it
+        right away if the future was already cancelled.
+        """
+        with self._stop_lock:
+            self._stop = stop
+        if self.done():
+            self._run_stop()
+
+    def _run_stop(self):
+        with self._stop_lock:
+            stop, self._stop = self._stop, None
+        if stop is not None:
+            try:
+                stop()
+            except Exception:
+                pass
+
+    def cancel(self):
+        if not super().cancel():
+            return False
+        self._run_stop()
+        return True
+
+    def _finish(self, ok, value):
+        """Set the result (or exception) unless the future was cancelled or
+        timed out in the meantime.
+        """
+        try:
+            if ok:
+                self.set_result(value)
+            else:
+                self.set_exception(value)
+        except InvalidStateError:
+            pass
+
+    def _expire(self, timeout):
+        if self.done():
+            return
+        self._finish(False, TimeoutError(f'pls_analysis did not finish within {timeout} seconds'))
+        self._run_stop()
+
+def _native_async_worker(conn, kwargs):
+    try:
+        if kwargs['timings']:
+            # events are sent to the parent's Timings as they happen
+            kwargs['timings'] = Timings(callback=lambda event: conn.send(('event', event)))
+        res_py = pls_analysis(**kwargs)
+        vars(res_py).pop('timings', None)
+        conn.send(('result', True, res_py))
+    except BaseException as e:
+        try:
+            conn.send(('result', False, e))
+        except Exception:
+            conn.send(('result', False, RuntimeError(repr(e))))
+    finally:
+        conn.close()
+
+def _run_native_async(future, kwargs):
+    timings = make_timings(kwargs['timings'])
+    # the callback, log file and lock of a Timings stay in this process
+    kwargs = dict(kwargs, timings=timings is not NULL_TIMINGS)
+    ctx = multiprocessing.get_context()
+    recv, send = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_native_async_worker, args=(send, kwargs))
+    try:
+        process.start()
+    except BaseException as e:
+        future._finish(False, e)
+        return
+    send.close()
+    future._set_stop(process.terminate)
+    try:
+        message = recv.recv()
+        while message[0] == 'event':
+            timings.record(message[1])
+            message = recv.recv()
+        _, ok, value = message
+        if ok:
+            value = _with_timings(value, timings)
+    except EOFError:
+        ok, value = False, RuntimeError('native pls_analysis worker process exited '
+                                        f'with code {process.exitcode}')
+    finally:
+        recv.close()
+        process.join()
+    future._finish(ok, value)
+
+def _run_matlab_async(future, args):
+    try:
+        timings = make_timings(args['timings'])
+        cache, cache_key, res_py = _cache_lookup(args)
+        if res_py is not None:
+            future._finish(True, _with_timings(res_py, timings))
+            return
+        datamat_lst = args['datamat_lst']
+        if not isinstance(datamat_lst, (list, tuple)):
+            datamat_lst = [datamat_lst]
+
+        with contextlib.ExitStack() as stack:
+            with timings.stage('engine'):
+                eng = stack.enter_context(engine_context(args['session']))
+            if args['make_script']:
+                install_helpers(eng)
+            # cancelled or timed out while waiting for an engine
+            if future.done():
+                return
+            eng.rng(args['seed'])
+            with timings.stage('transfer', nbytes(datamat_lst) + nbytes(args['stacked_behavdata'])):
+                num_subj_lst, num_cond, option = _matlab_inputs(args['num_subj_lst'],
+                    args['num_cond'],args['stacked_behavdata'],args['num_perm'],
+                    args['num_split'],args['num_boot'],args['meancentering_type'],
+                    args['cormode'],args['boot_type'],args['clim'])
+                if args['transfer'] == 'buffer':
+                    datamat_lst = [to_matlab(stream.materialize(datamat))
+                                   for datamat in datamat_lst]
+                else:
+                    names = [f'datamat_{i}_py__' for i in range(len(datamat_lst))]
+                    for name, datamat in zip(names, datamat_lst):
+                        put(eng, name, datamat, method='file')
+            with timings.stage('matlab'):
+                if args['transfer'] == 'buffer':
+                    call = eng.pls_analysis_py(datamat_lst,num_subj_lst,num_cond,option,
+                                               background=True)
+                    future._set_stop(call.cancel)
+                    res = call.result()
+                else:
+                    try:
+                        res = _pls_analysis_py_workspace(eng, names, num_subj_lst, num_cond,
+                            option, lambda call: future._set_stop(call.cancel))
+                    finally:
+                        eng.eval(f"clear {' '.join(names)};", nargout=0)
+        with timings.stage('conversion'):
+            res_py = PLS_result_conversion(res, convert_to='python')
+        if cache_key is not None:
+            cache.put(cache_key, PLS_result_conversion(res_py, convert_to='numpy'))
+    except BaseException as e:
+        future._finish(False, e)
+        return
+    future._finish(True, _with_timings(res_py, timings))
+
+def pls_analysis_async(datamat_lst,num_subj_lst,num_cond,stacked_behavdata,timeout=None,**kwargs):
+    """Start `pls_analysis` without waiting for it to finish.
+    The matlab backend runs the analysis as a background engine call
+    (`background=True`) while holding its engine, so analyses given an
+    `EnginePool` as `session` run at the same time on different engines
+    (analyses on the same `MatlabSession` run one after the other). The native
+    backend runs each analysis in its own worker process.
+
+    Parameters
+    ----------
+    datamat_lst, num_subj_lst, num_cond, stacked_behavdata
+                        :   as in `pls_analysis`
+    timeout             :   float, default=None. Seconds after which the
+                            analysis is stopped and the future fails with
+                            `TimeoutError`.
+    kwargs              :   any other `pls_analysis` keyword argument. With
+                            the native backend, the events of `timings` are
+                            sent from the worker process as they happen and
+                            recorded (and passed to its callback) in this
+                            process.
+
+    Return
+    ------
+    future              :   `PLSFuture`, a `concurrent.futures.Future` of the
+                            result of `pls_analysis`. `future.result()` waits
+                            for it, `await future` waits without blocking the
+                            event loop, and `future.cancel()` stops the
+                            analysis even if it is already running.
+    """
+    bound = inspect.signature(pls_analysis).bind(datamat_lst,num_subj_lst,num_cond,
+                                                 stacked_behavdata,**kwargs)
+    bound.apply_defaults()
+    args = dict(bound.arguments)
+    assert args['backend'] in ['matlab','native']
+    assert args['transfer'] in ['buffer','file']
+    if args['executor'] is not None:
+        raise ValueError('pls_analysis_async does not take an executor, its native worker '
+                         'process runs the analysis (use n_jobs)')
+    # as in pls_analysis, only seeded analyses are cached
+    if not args['seed']:
+        args['seed'] = random.randint(1,2**32)
+        args['cache'] = None
+
+    future = PLSFuture()
+    if args['backend'] == 'native':
+        target = _run_native_async
+    else:
+        _require_matlab()
+        target = _run_matlab_async
+    if timeout is not None:
+        timer = threading.Timer(timeout, future._expire, args=(timeout,))
+        timer.daemon = True
+        timer.start()
+        future.add_done_callback(lambda _: timer.cancel())
+    threading.Thread(target=target, args=(future, args), daemon=True).start()
+    return future
+
+# pls_analysis arguments that are set for the whole batch, not per job
+_BATCH_ARGS = ['datamat_lst','make_script','session','backend','transfer']
+
+_batch_datamats = None
+
+def _batch_jobs(jobs):
+    """Give each job spec a unique string `job_id` (its index by default).
+    """
+    specs = []
+    for i, job in enumerate(jobs):
+        job = dict(job)
+        job['job_id'] = str(job.get('job_id', i))
+        assert not set(job) & set(_BATCH_ARGS), f'{_BATCH_ARGS} are set for the whole batch'
+        assert os.sep not in job['job_id']
+        specs.append(job)
+    job_ids = [job['job_id'] for job in specs]
+    assert len(set(job_ids)) == len(job_ids), 'job_id values must be unique'
+    return specs
+
+def _job_datamat(job, datamats):
+    """Return the datamat list of a job spec, looking names up in `datamats`.
+    """
+    datamat = job['datamat']
+    if isinstance(datamat, str):
+        datamat = datamats[datamat]
+    if not isinstance(datamat, (list, tuple)):
+        datamat = [datamat]
+    return datamat
+
+def _job_kwargs(job):
+    kwargs = dict(job)
+    for key in ['job_id','datamat','num_subj_lst','num_cond','stacked_behavdata']:
+        kwargs.pop(key, None)
+    return kwargs
 
-def load_pls_model(model_file, make_script=True):
+# job arguments the matlab backend runs with, and native backend only
+# arguments it ignores as `pls_analysis` does
+_MATLAB_BATCH_KWARGS = ['num_perm','num_split','num_boot','meancentering_type','cormode',
+                        'boot_type','clim','seed','batch_size','n_jobs','num_lv','svd_solver',
+                        'keep_resample_state']
+
+# job arguments that do not change the result, left out of the manifest key
+_RUNTIME_KWARGS = ['batch_size','n_jobs','block_size','executor','cache','timings']
+
+def _job_key(job, datamats, backend):
+    """Return the `cache.result_key` of a job spec, recorded in the manifest
+    to recognise the same job when resuming.
+    """
+    options = {key: value for key, value in _job_kwargs(job).items()
+               if key not in _RUNTIME_KWARGS}
+    options['backend'] = backend
+    return result_key(_job_datamat(job, datamats), job['num_subj_lst'], job['num_cond'],
+                      job['stacked_behavdata'], options)
+
+def _init_batch_worker(datamats):
+    global _batch_datamats
+    _batch_datamats = datamats
+
+def _native_batch_job(job):
+    res = pls_analysis(_job_datamat(job, _batch_datamats),job['num_subj_lst'],job['num_cond'],
+        job['stacked_behavdata'],backend='native',**_job_kwargs(job))
+    return job['job_id'], res
+
+def _matlab_batch_job(eng, job, datamats, uploaded):
+    """Run one job spec on engine `eng`. Named datamats are uploaded to the
+    engine workspace the first time the engine uses them and kept there for
+    later jobs, `uploaded` maps each name to its workspace variable names.
+    """
+    kwargs = _job_kwargs(job)
+    seed = kwargs.pop('seed', None)
+    if not seed:
+        seed = random.randint(1,2**32)
+    eng.rng(seed)
+
+    datamat = job['datamat']
+    if isinstance(datamat, str):
+        if datamat not in uploaded:
+            names = [f'datamat_b{len(uploaded)}_{i}_py__' for i in range(len(_job_datamat(job, datamats)))]
+            for name, array in zip(names, _job_datamat(job, datamats)):
+                put(eng, name, array, method=uploaded.transfer)
+            uploaded[datamat] = names
+        names = uploaded[datamat]
+        temp_names = []
+    else:
+        names = temp_names = [f'datamat_{i}_py__' for i in range(len(_job_datamat(job, datamats)))]
+        for name, array in zip(names, _job_datamat(job, datamats)):
+            put(eng, name, array, method=uploaded.transfer)
+
+    num_subj_lst, num_cond, option = _matlab_inputs(job['num_subj_lst'],job['num_cond'],
+        np.asarray(job['stacked_behavdata']),kwargs.get('num_perm',0),kwargs.get('num_split',0),
+        kwargs.get('num_boot',0),kwargs.get('meancentering_type',0),kwargs.get('cormode',0),
+        kwargs.get('boot_type','strat'),kwargs.get('clim',95.0))
+    res = _pls_analysis_py_workspace(eng, names, num_subj_lst, num_cond, option)
+    if temp_names:
+        eng.eval(f"clear {' '.join(temp_names)};", nargout=0)
+    return job['job_id'], PLS_result_conversion(res, convert_to='python')
+
+class _Uploaded(dict):
+    """Workspace variable names of the datamats uploaded to one engine.
+    """
+    def __init__(self, transfer):
+        super().__init__()
+        self.transfer = transfer
+
+def _run_native_batch(jobs, datamats, n_workers):
+    if n_workers == 1:
+        _init_batch_worker(datamats)
+        try:
+            for job in jobs:
+                yield _native_batch_job(job)
+        finally:
+            _init_batch_worker(None)
+        return
+    # datamats are sent to each worker process once, not with every job
+    with ProcessPoolExecutor(n_workers, initializer=_init_batch_worker,
+                             initargs=(datamats,)) as executor:
+        pending = set()
+        jobs = iter(jobs)
+        try:
+            # keep at most two jobs per worker queued so results stream back
+            for job in jobs:
+                pending.add(executor.submit(_native_batch_job, job))
+                if len(pending) >= 2*n_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def _run_matlab_batch(jobs, datamats, sessions, transfer, make_script):
+    todo = queue.Queue()
+    for job in jobs:
+        todo.put(job)
+    done = queue.Queue()
+    stop = threading.Event()
+
+    def worker(session):
+        uploaded = _Uploaded(transfer)
+        try:
+            with engine_context(session) as eng:
+                if make_script:
+                    install_helpers(eng)
+                try:
+                    while not stop.is_set():
+                        try:
+                            job = todo.get_nowait()
+                        except queue.Empty:
+                            break
+                        done.put((True, _matlab_batch_job(eng, job, datamats, uploaded)))
+                finally:
+                    names = [name for value in uploaded.values() for name in value]
+                    if names:
+                        eng.eval(f"clear {' '.join(names)};", nargout=0)
+        except BaseException as e:
+            done.put((False, e))
+        finally:
+            done.put(None)
+
+    threads = [threading.Thread(target=worker, args=(session,), daemon=True) for session in sessions]
+    for thread in threads:
+        thread.start()
+    try:
+        running = len(threads)
+        while running:
+            item = done.get()
+            if item is None:
+                running -= 1
+                continue
+            ok, value = item
+            if not ok:
+                raise value
+            yield value
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+def _read_manifest(manifest):
+    """Return {job_id: (result file, job key)} of the jobs recorded in a
+    manifest file.
+    """
+    completed = {}
+    if manifest is None or not os.path.exists(manifest):
+        return completed
+    root = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # partly written last line of an interrupted run
+                continue
+            model_file = os.path.join(root, entry['file'])
+            if os.path.exists(model_file):
+                completed[entry['job_id']] = (model_file, entry.get('key'))
+    return completed
+
+def _record_manifest(manifest, job_id, key, res):
+    root = os.path.dirname(os.path.abspath(manifest))
+    # results go in a directory named after the manifest, so sweeps sharing
+    # a directory (and job ids) do not overwrite each other's results
+    results_dir = os.path.splitext(os.path.basename(manifest))[0]
+    os.makedirs(os.path.join(root, results_dir), exist_ok=True)
+    file_name = f'{results_dir}/{job_id}.mat'
+    save_pls_model(os.path.join(root, file_name), res)
+    with open(manifest, 'a') as f:
+        f.write(json.dumps({'job_id': job_id, 'file': file_name, 'key': key}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def pls_analysis_batch(jobs, datamats=None, backend='matlab', n_workers=1, callback=None,
+    manifest=None, sessions=None, make_script=True, transfer='buffer'):
+    """Run many `pls_analysis` jobs over the same warm engines or worker
+    processes, e.g. a sweep over `meancentering_type`, `cormode` and
+    behaviour subsets. Shared datamats are sent to each engine or worker only
+    once, and results are returned as soon as each job finishes.
+
+    Parameters
+    ----------
+    jobs                :   list of dicts, one per analysis, with keys
+                            'datamat', 'num_subj_lst', 'num_cond' and
+                            'stacked_behavdata', and optionally 'job_id' (str,
+                            default is the index of the job) and any other
+                            `pls_analysis` keyword argument (`num_perm`,
+                            `num_boot`, `meancentering_type`, `cormode`,
+                            `seed`, ...). The matlab backend only accepts
+                            the arguments it uses and the native backend only
+                            arguments `batch_size`, `n_jobs`, `num_lv`,
+                            `svd_solver` and `keep_resample_state` (ignored,
+                            as in `pls_analysis`).
+                            'datamat' is either the name of an
+                            entry of `datamats` or a datamat list (or single
+                            2D ndarray) used by that job only.
+    datamats            :   dict, default=None. Datamat lists (or single 2D
+                            ndarrays) shared between jobs, by name.
+    backend             :   string, default='matlab'. 'matlab' or 'native',
+                            as in `pls_analysis`.
+    n_workers           :   int, default=1. Number of matlab engines, or of
+                            processes for the native backend, running jobs at
+                            the same time.
+    callback            :   callable, default=None. Called as
+                            `callback(job_id, res_py)` for every result, in
+                            the order they finish.
+    manifest            :   str, default=None. Path of a manifest file
+                            recording finished jobs, with the
+                            `cache.result_key` of their spec. Each result is
+                            saved as `<job_id>.mat` in a directory next to it
+                            named after the manifest (`sweep/<job_id>.mat`
+                            for `sweep.jsonl`, directories are created as
+                            needed). If the manifest already
+                            exists, jobs recorded in it with the same key are
+                            not run again, their saved results are loaded
+                            (lazily) and returned first; jobs whose spec or
+                            data changed are run again.
+    sessions            :   list, default=None. Matlab backend only.
+                            `MatlabSession`s, `EnginePool`s or started engines
+                            to run the jobs on, one job at a time each. If
+                            None is given, `n_workers` new sessions are
+                            started and shut down when the batch finishes.
+    make_script         :   bool, default=True. Matlab backend only, as in
+                            `pls_analysis`.
+    transfer            :   string, default='buffer'. Matlab backend only. How
+                            datamats are sent to the engines, as in
+                            `pls_analysis`.
+
+    Return
+    ------
+    results             :   generator of (job_id, res_py) tuples, in the order
+                            jobs finish. Jobs only run while the generator is
+                            consumed; stopping early cancels the jobs not yet
+                            started.
+    """
+    assert backend in ['matlab','native']
+    assert transfer in ['buffer','file']
+    assert n_workers >= 1
+    if datamats is None:
+        datamats = {}
+    jobs = _batch_jobs(jobs)
+    if backend == 'matlab':
+        for job in jobs:
+            unsupported = set(_job_kwargs(job)) - set(_MATLAB_BATCH_KWARGS)
+            if unsupported:
+                raise ValueError(f"job {job['job_id']} sets {sorted(unsupported)}, which are "
+                                 "not supported by the matlab backend")
+    completed = _read_manifest(manifest)
+    return _batch_results(jobs, datamats, backend, n_workers, callback, manifest, completed,
+        sessions, make_script, transfer)
+
+def _batch_results(jobs, datamats, backend, n_workers, callback, manifest, completed,
+    sessions, make_script, transfer):
+    keys = {}
+    if manifest is not None:
+        keys = {job['job_id']: _job_key(job, datamats, backend) for job in jobs}
+    todo = []
+    for job in jobs:
+        model_file, key = completed.get(job['job_id'], (None, None))
+        if key is None or key != keys[job['job_id']]:
+            todo.append(job)
+            continue
+        res = load_pls_model(model_file, lazy=True)
+        if callback is not None:
+            callback(job['job_id'], res)
+        yield job['job_id'], res
+    jobs = todo
+    if not jobs:
+        return
+
+    if backend == 'native':
+        results = _run_native_batch(jobs, datamats, n_workers)
+        own_sessions = []
+    else:
+        _require_matlab()
+        own_sessions = [] if sessions is not None else [MatlabSession() for _ in range(n_workers)]
+        if sessions is None:
+            sessions = own_sessions
+        results = _run_matlab_batch(jobs, datamats, sessions, transfer, make_script)
+    try:
+        for job_id, res in results:
+            if manifest is not None:
+                _record_manifest(manifest, job_id, keys[job_id], res)
+            if callback is not None:
+                callback(job_id, res)
+            yield job_id, res
+    finally:
+        results.close()
+        for session in own_sessions:
+            session.close()
+
+# layout version of results saved as *.npz
+NPZ_FORMAT = 1
+
+# zlib level of *.npz files, favouring speed: most of a result is float noise
+# that higher levels barely shrink further
+_NPZ_COMPRESSLEVEL = 1
+
+_SCHEMA_RULES = {path: rule for path, _, _, rule in RESULT_SCHEMA}
+
+def _flatten_result(res, prefix=''):
+    """Flatten a result (nested `Dict2Object`, `LazyResult` or dicts) into a
+    dict of dotted field path to ndarray.
+    """
+    arrays = {}
+    for key, value in getattr(res, '__dict__', res).items():
+        if not prefix and key in _PYTHON_ONLY_FIELDS:
+            continue
+        path = prefix + key
+        if isinstance(value, (Dict2Object, LazyResult, dict)):
+            arrays.update(_flatten_result(value, path + '.'))
+            continue
+        arr = np.asarray(value)
+        if arr.dtype.hasobject:
+            raise TypeError(f'cannot save field {path} of type {type(value).__name__}')
+        arrays[path] = arr
+    return arrays
+
+def _save_npz(model_file, res):
+    """Write a 'compact' result as a compressed *.npz file, one array per
+    field, readable with `np.load`.
+    """
+    arrays = _flatten_result(res)
+    arrays['__format__'] = np.array(NPZ_FORMAT)
+    with zipfile.ZipFile(model_file, 'w', zipfile.ZIP_DEFLATED,
+                         compresslevel=_NPZ_COMPRESSLEVEL) as zf:
+        for path, arr in arrays.items():
+            with zf.open(path + '.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, arr, allow_pickle=False)
+
+def _load_npz(model_file):
+    """Read a *.npz result written by `_save_npz` into nested dicts of raw
+    fields, as `PLS_result_conversion` takes them.
+    """
+    res = {}
+    with np.load(model_file, allow_pickle=False) as npz:
+        if int(npz.get('__format__', -1)) != NPZ_FORMAT:
+            raise ValueError(f'{model_file} is not a PLS result saved by save_pls_model')
+        for path in npz.files:
+            if path == '__format__':
+                continue
+            arr = npz[path]
+            value = arr.item() if arr.ndim == 0 else arr
+            if _SCHEMA_RULES.get(path) == 'cell':
+                value = [value]
+            *parents, key = path.split('.')
+            node = res
+            for parent in parents:
+                node = node.setdefault(parent, {})
+            node[key] = value
+    return res
+
+def load_pls_model(model_file, make_script=True, session=None, backend='native', lazy=False,
+    compact=False, timings=None):
     """Load saved behavioural PLS model in matlab format (*.mat).
-    Warning that this creates (and removes when finished) a matlab script 
-    called `load_pls_model_py.m` to load the saved matlab PLS model, so make 
-    sure there isn't a script called `load_pls_model_py.m` in your working 
-    directory that you don't want deleted (not likely but worth mentioning). 
-    If you want to avoid the need for this you can copy the 
-    `load_pls_model_py.m` script from this repository to your PLS directory or a 
-    matlab path directory and set `make_script=False`.
+    By default the file is read directly in python (MAT v5/v7 files, and v7.3
+    files if h5py is installed), without starting matlab. Files ending in
+    `.npz` are read as saved by `save_pls_model` in that format. With
+    `backend='matlab'`, the model is loaded by the matlab function
+    `load_pls_model_py.m`, installed once per engine like `pls_analysis_py.m`
+    (see `pls_analysis`). If you have copied the `load_pls_model_py.m` script
+    from this repository to your PLS directory or a matlab path directory you
+    can set `make_script=False`.
 
     Parameters
     ----------
     model_file          :   str path to *.mat matlab model file
-    make_script         :   bool, default=True. Whether to make and delete the
-                            load_pls_model_py.m file in the working directory.
+    make_script         :   bool, default=True. Whether to install the
+                            load_pls_model_py.m function on the engine.
                             If you have copied this file to the PLS directory
                             or a matlab path folder you can set this to False.
+    session             :   default=None. `MatlabSession`, `EnginePool` or
+                            started matlab engine to load the model with. If
+                            None is given, the shared session is used.
+    backend             :   string, default='native'. 'native' reads the file
+                            with `PLS_wrapper.matio`. 'matlab' loads it with
+                            the matlab engine.
+    lazy                :   bool, default=False. Native backend only. Return a
+                            `LazyResult` that converts each field when it is
+                            first accessed. Arrays of uncompressed files
+                            (saved with version='6') are memory-mapped, so
+                            large fields such as `boot_result.distrib` are
+                            never read from disk unless used. Compressed v7
+                            files store the result as one compressed
+                            variable, so loading one lazily still
+                            decompresses the whole result up front; only the
+                            conversion is deferred. v7.3 (HDF5) arrays are
+                            read when used.
+    compact             :   bool, default=False. Return the result as
+                            `PLS_result_conversion(..., convert_to='compact')`
+                            does: arrays keep the dtype of their matlab class
+                            (float32 for single) and the resample indices
+                            (`bootsamp`, `bootsamp_4beh`, `permsamp`) use the
+                            smallest integer type holding them.
+    timings             :   default=None. True, a callable or a `Timings`
+                            from `PLS_wrapper.profiling` to record the wall
+                            time and bytes of each stage (file read or matlab
+                            load, conversion). Attached to the result as
+                            `res_py.timings`.
 
     Return
     ------
@@ -471,47 +1504,105 @@ def load_pls_model(model_file, make_script=True):
                             converted to int in python.
                             Floats as python floats.
     """
-    eng = matlab.engine.start_matlab()
-
-    # Matlab script for loading the file, accessing the struct inside, then returning
-    # (or first removing the "field_dscrip" field if it exists)
-    if make_script:
-        temp_script =   'function result = load_pls_model_py(model_file)\n' \
-                        '    result_tmp = load(model_file);\n' \
-                        '    fields = fieldnames(result_tmp);\n' \
-                        '    result_tmp2 = result_tmp.(fields{1});\n' \
-                        '    fields2 = fieldnames(result_tmp2);\n' \
-                        '    if ismember("field_descrip",fields2) == 1\n' \
-                        '       result = rmfield(result_tmp2,"field_descrip");\n' \
-                        '    else\n' \
-                        '       result = result_tmp2;\n' \
-                        '    end\n' \
-                        'end'
+    assert backend in ['matlab','native']
+    is_npz = str(model_file).endswith('.npz')
+    assert backend == 'native' or not (lazy or is_npz)
+    assert not (lazy and is_npz)
+    convert_to = 'compact' if compact else 'python'
+    timings = make_timings(timings)
+    if backend == 'native':
+        with timings.stage('read', os.path.getsize(model_file)):
+            if is_npz:
+                res = _load_npz(model_file)
+            else:
+                # Same as load_pls_model_py.m: first variable, without "field_descrip"
+                res = next(iter(matio.loadmat(model_file, lazy=lazy).values()))
+                res.pop('field_descrip', None)
+        if lazy:
+            convert = _lazy_compact_field if compact else _lazy_result_field
+            return _with_timings(LazyResult(res, convert), timings)
+        with timings.stage('conversion', nbytes(res)):
+            res_py = PLS_result_conversion(res, convert_to=convert_to)
+        return _with_timings(res_py, timings)
 
-    with open('load_pls_model_py.m','w+') as f:
-        f.write(temp_script)
+    _require_matlab()
+    with contextlib.ExitStack() as stack:
+        with timings.stage('engine'):
+            eng = stack.enter_context(engine_context(session))
+        # Matlab function for loading the file, accessing the struct inside, then returning
+        # (or first removing the "field_dscrip" field if it exists)
+        if make_script:
+            install_helpers(eng)
 
-    res = eng.load_pls_model_py(model_file)
-    res_py = PLS_result_conversion(res, convert_to='python')
+        with timings.stage('matlab', os.path.getsize(model_file)):
+            res = eng.load_pls_model_py(model_file)
+        with timings.stage('conversion') as info:
+            res_py = PLS_result_conversion(res, convert_to=convert_to)
+            info['bytes'] = nbytes(res_py)
 
-    if make_script:
-        os.remove('load_pls_model_py.m')
+    return _with_timings(res_py, timings)
 
-    return res_py
-
-def save_pls_model(model_file, res_py):
+def save_pls_model(model_file, res_py, session=None, backend='native', version='7', timings=None):
     """Save behavioural PLS model in matlab format (*.mat).
+    By default the file is written directly in python, without starting
+    matlab. If `model_file` ends in `.npz` the model is instead saved in a
+    compressed numpy format (one array per field, readable with `np.load`),
+    in which arrays keep the dtype of their matlab class and resample indices
+    are stored in the smallest integer type. It is about the size of a v7
+    *.mat file and loads back with `load_pls_model` to the same values.
     Parameters
     ----------
-    model_file          :   str path to *.mat matlab model file
+    model_file          :   str path to *.mat matlab model file, or *.npz
     res_py              :   model result from `pls_analysis` function
+    session             :   default=None. `MatlabSession`, `EnginePool` or
+                            started matlab engine to save the model with. If
+                            None is given, the shared session is used.
+    backend             :   string, default='native'. 'native' writes the file
+                            with `PLS_wrapper.matio`. 'matlab' saves it with
+                            the matlab engine.
+    version             :   string, default='7'. *.mat format, as in matlab's
+                            `save`: '6' (uncompressed), '7' (compressed) or
+                            '7.3' (HDF5, needs h5py for the native backend).
+                            Not used for *.npz files.
+    timings             :   default=None. A callable or a `Timings` from
+                            `PLS_wrapper.profiling` to record the wall time
+                            and bytes of each stage (conversion, file write or
+                            transfer and matlab save). The `timings` attribute
+                            of `res_py` is not saved.
 
     Return
     ------
     None
     """
-    eng = matlab.engine.start_matlab()
+    assert backend in ['matlab','native']
+    assert version in ['6','7','7.3']
+    timings = make_timings(timings)
+    if str(model_file).endswith('.npz'):
+        assert backend == 'native'
+        with timings.stage('conversion') as info:
+            res = PLS_result_conversion(res_py, convert_to='compact')
+            info['bytes'] = nbytes(res)
+        with timings.stage('write') as info:
+            _save_npz(model_file, res)
+            info['bytes'] = os.path.getsize(model_file)
+        return
+    if backend == 'native':
+        with timings.stage('conversion') as info:
+            res = PLS_result_conversion(res_py, convert_to='numpy')
+            info['bytes'] = nbytes(res)
+        with timings.stage('write') as info:
+            matio.savemat(model_file, {'res': res}, version=version)
+            info['bytes'] = os.path.getsize(model_file)
+        return
 
-    res = PLS_result_conversion(res_py, convert_to='matlab')
-    eng.workspace['res'] = res
-    eng.save(model_file,'res',nargout=0)
+    _require_matlab()
+    with timings.stage('conversion'):
+        res = PLS_result_conversion(res_py, convert_to='matlab')
+    with contextlib.ExitStack() as stack:
+        with timings.stage('engine'):
+            eng = stack.enter_context(engine_context(session))
+        with timings.stage('transfer'):
+            eng.workspace['res'] = res
+        with timings.stage('matlab') as info:
+            eng.save(model_file,'res',f'-v{version}',nargout=0)
+            info['bytes'] = os.path.getsize(model_file)
@@ -0,0 +1,171 @@
+"""Per stage timing, bytes moved and resampling progress of PLS calls.
+
+`pls_analysis`, `load_pls_model` and `save_pls_model` take a `timings`
+argument. A `Timings` records an event for each stage they go through
+(engine start, transfer, svd, permutation, bootstrap, conversion, file
+reads and writes, ...) with its wall time and the bytes it moved, and
+progress events while permutations and bootstrap samples run. Every event is
+passed to the optional callback and appended as a JSON line to the optional
+log, for export to a metrics system.
+"""
+import contextlib
+import json
+import threading
+import time
+
+class Timings:
+    """Collects timing and progress events.
+    Parameters
+    ----------
+    callback            :   callable, default=None. Called with each event
+                            dict as it happens.
+    log                 :   str or file object, default=None. Each event is
+                            appended to it as a line of JSON.
+    labels              :   dict, default=None. Added to every event, e.g. to
+                            tag events with a job or run id.
+
+    Attributes
+    ----------
+    events              :   list of event dicts. Stage events have keys
+                            'event' ('stage'), 'stage', 'seconds', 'bytes' and
+                            'time' (unix time at the end of the stage).
+                            Progress events have 'event' ('progress'),
+                            'stage', 'done', 'total' and 'time'.
+    """
+    def __init__(self, callback=None, log=None, labels=None):
+        self.callback = callback
+        self.log = log
+        self.labels = dict(labels) if labels else {}
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # sent back from worker processes without the lock, callback or an
+        # open log file
+        state = {'events': self.events, 'labels': self.labels}
+        state['log'] = self.log if isinstance(self.log, str) else None
+        return state
+
+    def __setstate__(self, state):
+        self.__init__(log=state['log'], labels=state['labels'])
+        self.events = state['events']
+
+    def __repr__(self):
+        stages = ', '.join(f'{stage}={seconds:.3f}s' for stage, seconds in self.seconds().items())
+        return f'Timings({stages})'
+
+    def _emit(self, event):
+        event.update(self.labels)
+        with self._lock:
+            self.events.append(event)
+            if self.log is not None:
+                line = json.dumps(event, default=str) + '\n'
+                if isinstance(self.log, str):
+                    with open(self.log, 'a') as f:
+                        f.write(line)
+                else:
+                    self.log.write(line)
+        if self.callback is not None:
+            self.callback(event)
+
+    def record(self, event):
+        """Record an event made elsewhere, e.g. by the `Timings` of a worker
+        process, as if it happened here.
+        """
+        self._emit(dict(event))
+
+    @contextlib.contextmanager
+    def stage(self, name, nbytes=0):
+        """Context manager timing stage `name`. The yielded dict can be
+        updated with more keys, e.g. 'bytes' once they are known.
+        """
+        info = {'bytes': int(nbytes)}
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            seconds = time.perf_counter() - start
+            event = {'event': 'stage', 'stage': name, 'seconds': seconds}
+            event.update(info)
+            event['time'] = time.time()
+            self._emit(event)
+
+    def progress(self, name, done, total):
+        """Record that `done` of `total` iterations of stage `name` are done.
+        `total` is None while it is not known (e.g. columns of datamat chunk
+        generators on the first pass).
+        """
+        self._emit({'event': 'progress', 'stage': name, 'done': int(done),
+                    'total': None if total is None else int(total), 'time': time.time()})
+
+    def seconds(self):
+        """Return a dict of stage name to total wall time in seconds.
+        """
+        totals = {}
+        for event in self.events:
+            if event['event'] == 'stage':
+                totals[event['stage']] = totals.get(event['stage'], 0.0) + event['seconds']
+        return totals
+
+    def bytes(self):
+        """Return a dict of stage name to total bytes moved, for stages that
+        moved any.
+        """
+        totals = {}
+        for event in self.events:
+            if event['event'] == 'stage' and event['bytes']:
+                totals[event['stage']] = totals.get(event['stage'], 0) + event['bytes']
+        return totals
+
+    def to_dict(self):
+        """Return the totals and every event, as plain python types.
+        """
+        return {'seconds': self.seconds(), 'bytes': self.bytes(), 'events': list(self.events)}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), default=str)
+
+class _NullTimings:
+    """Stands in for `Timings` when nothing is recorded.
+    """
+    @contextlib.contextmanager
+    def stage(self, name, nbytes=0):
+        yield {'bytes': 0}
+
+    def progress(self, name, done, total):
+        pass
+
+NULL_TIMINGS = _NullTimings()
+
+def make_timings(timings):
+    """Return the `Timings` to record into for a `timings` argument, or
+    `NULL_TIMINGS` if it is None or False.
+    Parameters
+    ----------
+    timings             :   None/False (off), True (new `Timings`), a
+                            callable (new `Timings` with it as callback) or a
+                            `Timings` to record into
+    """
+    if timings is None or timings is False:
+        return NULL_TIMINGS
+    if timings is True:
+        return Timings()
+    if isinstance(timings, Timings):
+        return timings
+    if callable(timings):
+        return Timings(callback=timings)
+    raise TypeError('timings must be None, a bool, a callable or a Timings')
+
+def nbytes(value):
+    """Total bytes of the arrays in a value (nested in dicts, lists and
+    objects with `__dict__`).
+    """
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(item) for item in value)
+    if hasattr(value, '__dict__') and not isinstance(value, type):
+        return sum(nbytes(item) for item in vars(value).values())
+    return 0
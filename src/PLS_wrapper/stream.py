@@ -0,0 +1,143 @@
+"""Datamats read a block of columns (voxels) at a time.
+
+Besides in-memory ndarrays, `pls_analysis` accepts for each group of
+`datamat_lst`:
+
+- a memory-mapped array (`np.load(path, mmap_mode='r')`, `np.memmap`) or
+  the path of a `.npy` file, which is memory-mapped,
+- an HDF5 (h5py) or zarr dataset, or any 2D object with `shape` and
+  numpy style `[:, start:stop]` slicing,
+- a callable returning an iterator of column blocks (2D ndarrays with the
+  rows of the group and any number of columns). It is called once for each
+  pass over the data, and has to yield the same blocks every time.
+
+The native backend only keeps one block of columns of the datamats in
+memory at a time, so peak memory grows with the block size instead of the
+number of voxels.
+"""
+import itertools
+import os
+
+import numpy as np
+
+# bytes of the stacked datamat read at a time when no block size is given
+BLOCK_BYTES = 2**24
+
+def is_streamed(datamat):
+    """Whether a datamat is read in blocks rather than used as an in-memory
+    ndarray.
+    """
+    if isinstance(datamat, np.memmap):
+        return True
+    return not isinstance(datamat, np.ndarray)
+
+def _open(datamat):
+    if isinstance(datamat, (str, os.PathLike)):
+        return np.load(datamat, mmap_mode='r')
+    return datamat
+
+class DatamatSource:
+    """Column blocks of one group's datamat.
+    Parameters
+    ----------
+    datamat             :   any datamat accepted by `pls_analysis`, see the
+                            module docstring
+    """
+    def __init__(self, datamat):
+        self.datamat = _open(datamat)
+        self.sliceable = not callable(self.datamat)
+        if self.sliceable:
+            shape = tuple(self.datamat.shape)
+            if len(shape) != 2:
+                raise ValueError(f'datamats must be 2D, got shape {shape}')
+            self.shape = shape
+        else:
+            self.shape = None
+
+    @property
+    def num_rows(self):
+        if self.shape is None:
+            first = next(iter(self.datamat()))
+            self.shape = (first.shape[0], None)
+        return self.shape[0]
+
+    def blocks(self, block_size):
+        """Iterate over float64 blocks of at most `block_size` columns, all
+        `block_size` wide but the last.
+        """
+        if self.sliceable:
+            for start in range(0, self.shape[1], block_size):
+                stop = min(start + block_size, self.shape[1])
+                yield np.asarray(self.datamat[:, start:stop], dtype=np.float64)
+            return
+        # re-chunk whatever the generator yields to `block_size` columns
+        pending = []
+        width = 0
+        for chunk in self.datamat():
+            chunk = np.asarray(chunk, dtype=np.float64)
+            if chunk.ndim != 2:
+                raise ValueError(f'datamat chunks must be 2D, got shape {chunk.shape}')
+            pending.append(chunk)
+            width += chunk.shape[1]
+            while width >= block_size:
+                joined = np.concatenate(pending, axis=1) if len(pending) > 1 else pending[0]
+                yield joined[:, :block_size]
+                rest = joined[:, block_size:]
+                pending = [rest] if rest.shape[1] else []
+                width = rest.shape[1]
+        if width:
+            yield np.concatenate(pending, axis=1) if len(pending) > 1 else pending[0]
+
+    def read(self):
+        """Return the whole datamat as one ndarray.
+        """
+        if self.sliceable:
+            return np.asarray(self.datamat[:, :])
+        return np.concatenate(list(self.datamat()), axis=1)
+
+class StackedBlocks:
+    """Column blocks of the datamats of every group, stacked by rows as
+    `pls_analysis.m` stacks `datamat_lst`.
+    Parameters
+    ----------
+    datamat_lst         :   list of datamats (any kind accepted by
+                            `DatamatSource`)
+    block_size          :   int, default=None. Columns per block. None picks
+                            blocks of about `BLOCK_BYTES` bytes.
+    """
+    def __init__(self, datamat_lst, block_size=None):
+        self.sources = [DatamatSource(datamat) for datamat in datamat_lst]
+        self.num_rows = sum(source.num_rows for source in self.sources)
+        if block_size is None:
+            block_size = max(1, BLOCK_BYTES // (8*self.num_rows))
+        self.block_size = int(block_size)
+        self.num_cols = None
+        widths = {source.shape[1] for source in self.sources if source.sliceable}
+        if len(widths) > 1:
+            raise ValueError(f'datamats have different numbers of columns: {sorted(widths)}')
+        if widths:
+            self.num_cols = widths.pop()
+
+    def __iter__(self):
+        """Iterate over (start column, stacked block) pairs.
+        """
+        start = 0
+        iters = [source.blocks(self.block_size) for source in self.sources]
+        for parts in itertools.zip_longest(*iters):
+            widths = {None if part is None else part.shape[1] for part in parts}
+            if len(widths) != 1 or None in widths:
+                raise ValueError('datamats have different numbers of columns')
+            yield start, np.concatenate(parts) if len(parts) > 1 else parts[0]
+            start += widths.pop()
+        if self.num_cols is None:
+            self.num_cols = start
+        elif start != self.num_cols:
+            raise ValueError('datamat chunk generators yielded a different number of '
+                             'columns on a later pass')
+
+def materialize(datamat):
+    """Return a datamat of any kind accepted by `pls_analysis` as an ndarray.
+    """
+    if isinstance(datamat, np.ndarray):
+        return datamat
+    return DatamatSource(datamat).read()
@@ -0,0 +1,198 @@
+"""Bulk array transfer between numpy and the matlab engine.
+
+`to_matlab` and `from_matlab` convert single arrays, avoiding the element by
+element paths of the engine API and any copy numpy does not need. `put` and
+`get` move an array into or out of the engine workspace, either as an engine
+argument ('buffer') or staged through a raw column-major file that matlab
+reads with `fread` and numpy memory-maps ('file'), which bypasses the engine's
+argument marshalling. Neither is faster everywhere, `benchmarks/bench_transfer.py`
+times both against an installed engine.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from . import stream
+
+try:
+    import matlab
+except ImportError:
+    matlab = None
+
+_MATLAB_CLASSES = {
+    'double': np.float64,
+    'single': np.float32,
+    'int8': np.int8,
+    'int16': np.int16,
+    'int32': np.int32,
+    'int64': np.int64,
+    'uint8': np.uint8,
+    'uint16': np.uint16,
+    'uint32': np.uint32,
+    'uint64': np.uint64,
+    'logical': np.bool_,
+}
+
+# bytes written per chunk when staging through a file
+_FILE_CHUNK_BYTES = 2**26
+
+def to_matlab(value, matlab_class='double'):
+    """Convert an array to a matlab array in one bulk copy.
+    Parameters
+    ----------
+    value               :   ndarray, list or scalar
+    matlab_class        :   string, default='double'. 'double' or 'single'.
+
+    Return
+    ------
+    new_value           :   matlab.double or matlab.single
+    """
+    cls = getattr(matlab, matlab_class)
+    arr = np.asarray(value, dtype=_MATLAB_CLASSES[matlab_class])
+    if arr.ndim == 0:
+        return cls(float(arr))
+    # the engine reads contiguous buffers directly, only copy when needed
+    if not (arr.flags.c_contiguous or arr.flags.f_contiguous):
+        arr = np.ascontiguousarray(arr)
+    return cls(arr)
+
+def to_numpy_class(value, matlab_class='double'):
+    """Convert an array to an ndarray with the dtype of a matlab class, the
+    way `to_matlab` would store it (0-d arrays become floats).
+    """
+    arr = np.asarray(value, dtype=_MATLAB_CLASSES[matlab_class])
+    if arr.ndim == 0:
+        return float(arr)
+    return arr
+
+def from_matlab(value, dtype=None):
+    """Convert a matlab array to an ndarray, without copying when the engine
+    exposes its storage.
+    Parameters
+    ----------
+    value               :   matlab array (or anything `np.asarray` accepts)
+    dtype               :   numpy dtype, default=None. If given, the result
+                            is cast to it (a copy only if the type differs).
+
+    Return
+    ------
+    arr                 :   ndarray with the shape of the matlab array
+    """
+    arr = None
+    data = getattr(value, '_data', None)
+    size = getattr(value, 'size', None)
+    if data is not None and isinstance(size, tuple):
+        # older engines keep a flat column-major array.array
+        try:
+            arr = np.frombuffer(data, dtype=data.typecode).reshape(size, order='F')
+        except (AttributeError, TypeError, ValueError):
+            arr = None
+    if arr is None:
+        try:
+            arr = np.asarray(memoryview(value))
+        except TypeError:
+            arr = np.asarray(value)
+    if not arr.flags.writeable:
+        arr = arr.copy()
+    if dtype is not None:
+        arr = arr.astype(dtype, copy=False)
+    return arr
+
+def _matlab_str(text):
+    """Quote `text` as a matlab char array literal.
+    """
+    return "'" + text.replace("'", "''") + "'"
+
+def _write_column_major(arr, path):
+    """Write `arr` in column-major order in chunks of columns, so the whole
+    array is never copied at once.
+    """
+    arr = np.atleast_2d(arr)
+    cols = max(1, _FILE_CHUNK_BYTES // max(arr.shape[0]*arr.itemsize, 1))
+    with open(path, 'wb') as f:
+        for start in range(0, arr.shape[1], cols):
+            arr[:, start:start + cols].T.tofile(f)
+
+def _write_blocks(source, path, dtype):
+    """Write a `stream.DatamatSource` in column-major order one block of
+    columns at a time, so it is never read into memory whole.
+    """
+    cols = max(1, _FILE_CHUNK_BYTES // (8*source.num_rows))
+    num_cols = 0
+    with open(path, 'wb') as f:
+        for block in source.blocks(cols):
+            block.astype(dtype, copy=False).T.tofile(f)
+            num_cols += block.shape[1]
+    return source.num_rows, num_cols
+
+def put(eng, name, value, method='buffer', matlab_class='double', tmp_dir=None):
+    """Set workspace variable `name` of engine `eng` to an array.
+    Parameters
+    ----------
+    eng                 :   started matlab engine
+    name                :   str, workspace variable name
+    value               :   2D ndarray, or any datamat accepted by
+                            `pls_analysis` (see `PLS_wrapper.stream`)
+    method              :   string, default='buffer'. 'buffer' passes the
+                            array through the engine API with `to_matlab`.
+                            'file' writes it to a temporary raw file read with
+                            matlab's `fread`, one block of columns at a time
+                            for datamats that are not in-memory ndarrays.
+    matlab_class        :   string, default='double'. 'double' or 'single'.
+    tmp_dir             :   str, default=None. Directory for the staging file.
+    """
+    assert method in ['buffer','file']
+    if method == 'buffer':
+        eng.workspace[name] = to_matlab(stream.materialize(value), matlab_class)
+        return
+    fd, path = tempfile.mkstemp(suffix='.bin', dir=tmp_dir)
+    os.close(fd)
+    try:
+        if stream.is_streamed(value):
+            shape = _write_blocks(stream.DatamatSource(value), path, _MATLAB_CLASSES[matlab_class])
+        else:
+            arr = np.asarray(value, dtype=_MATLAB_CLASSES[matlab_class])
+            arr = np.atleast_2d(arr)
+            _write_column_major(arr, path)
+            shape = arr.shape
+        eng.eval(f"fid__ = fopen({_matlab_str(path)}, 'r'); "
+                 f"{name} = fread(fid__, [{shape[0]}, {shape[1]}], '*{matlab_class}'); "
+                 f"fclose(fid__); clear fid__;", nargout=0)
+    finally:
+        os.remove(path)
+
+def get(eng, name, method='buffer', tmp_dir=None):
+    """Get workspace variable `name` of engine `eng` as an ndarray.
+    Parameters
+    ----------
+    eng                 :   started matlab engine
+    name                :   str, workspace variable name of a 2D numeric array
+    method              :   string, default='buffer'. 'buffer' goes through
+                            the engine API with `from_matlab`. 'file' has
+                            matlab `fwrite` the array to a temporary file that
+                            is memory-mapped, then copied once into memory.
+    tmp_dir             :   str, default=None. Directory for the staging file.
+
+    Return
+    ------
+    arr                 :   ndarray
+    """
+    assert method in ['buffer','file']
+    if method == 'buffer':
+        return from_matlab(eng.workspace[name])
+    matlab_class = eng.eval(f"class({name})")
+    shape = tuple(int(n) for n in np.asarray(eng.eval(f"size({name})")).ravel())
+    fd, path = tempfile.mkstemp(suffix='.bin', dir=tmp_dir)
+    os.close(fd)
+    try:
+        eng.eval(f"fid__ = fopen({_matlab_str(path)}, 'w'); "
+                 f"fwrite(fid__, {name}, '{matlab_class}'); "
+                 f"fclose(fid__); clear fid__;", nargout=0)
+        mapped = np.memmap(path, dtype=_MATLAB_CLASSES[matlab_class], mode='r',
+                           shape=shape, order='F')
+        arr = np.array(mapped)
+        del mapped
+    finally:
+        os.remove(path)
+    return arr
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'benchmarks')
+
+@pytest.fixture
+def fake_matlab():
+    """Install the fake matlab engine of `benchmarks/fake_matlab.py` for the
+    matlab backend, yielding the module, and remove it afterwards.
+    """
+    sys.path.insert(0, BENCHMARKS)
+    try:
+        import fake_matlab
+    finally:
+        sys.path.remove(BENCHMARKS)
+    from PLS_wrapper import engine, pls, transfer
+    saved = {module: module.matlab for module in [pls, transfer]}
+    fake_matlab.install()
+    try:
+        yield fake_matlab
+    finally:
+        engine.close_default_session()
+        engine._default_session = None
+        sys.modules.pop('matlab', None)
+        sys.modules.pop('matlab.engine', None)
+        for module, matlab in saved.items():
+            module.matlab = matlab
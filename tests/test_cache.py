@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+
+from PLS_wrapper import cache, native, pls
+
+NUM_SUBJ_LST = [5, 5]
+NUM_COND = 2
+
+def _data():
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((20, 30)), rng.standard_normal((20, 2))
+
+def _key(datamat, behav, **options):
+    options = dict({'seed': 1, 'backend': 'native'}, **options)
+    return cache.result_key([datamat], NUM_SUBJ_LST, NUM_COND, behav, options)
+
+def test_key_is_stable():
+    datamat, behav = _data()
+    key = _key(datamat, behav)
+    assert _key(datamat.copy(), behav.copy()) == key
+    # hashed by value, not memory layout
+    assert _key(np.asfortranarray(datamat), behav) == key
+    assert _key(datamat, behav, **{'backend': 'native', 'seed': 1}) == key
+
+def test_key_changes_with_inputs(monkeypatch):
+    datamat, behav = _data()
+    key = _key(datamat, behav)
+    changed = datamat.copy()
+    changed[3, 4] += 1e-9
+    keys = {
+        _key(changed, behav),
+        _key(datamat, behav[:, ::-1]),
+        _key(datamat.astype(np.float32), behav),
+        _key(datamat, behav, seed=2),
+        _key(datamat, behav, cormode=2),
+        _key(datamat, behav, backend='matlab'),
+    }
+    assert key not in keys and len(keys) == 6
+    monkeypatch.setattr(native, 'ALGORITHM_VERSION', native.ALGORITHM_VERSION + 1)
+    assert _key(datamat, behav) != key
+
+def test_pls_analysis_hits_and_misses(tmp_path):
+    datamat, behav = _data()
+    results = cache.ResultCache(str(tmp_path))
+    kwargs = dict(num_perm=5, num_boot=5, seed=3, backend='native', cache=results)
+    first = pls.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, **kwargs)
+    assert (results.hits, results.misses) == (0, 1)
+    second = pls.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, **kwargs)
+    assert (results.hits, results.misses) == (1, 1)
+    np.testing.assert_array_equal(second.u, first.u)
+    np.testing.assert_array_equal(second.boot_result.bootsamp, first.boot_result.bootsamp)
+    assert second.perm_result.sprob.tolist() == first.perm_result.sprob.tolist()
+    # changed data or options miss
+    pls.pls_analysis([datamat + 1e-6], NUM_SUBJ_LST, NUM_COND, behav, **kwargs)
+    pls.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, **dict(kwargs, num_perm=6))
+    pls.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, **dict(kwargs, svd_solver='arpack'))
+    assert (results.hits, results.misses) == (1, 4)
+    # unseeded analyses are not cached
+    pls.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, **dict(kwargs, seed=None))
+    assert results.stats()['entries'] == 4
+
+def test_evicts_least_recently_used(tmp_path):
+    results = cache.ResultCache(str(tmp_path), max_bytes=None)
+    value = {'u': np.random.default_rng(0).standard_normal((50, 50))}
+    results.put('a', value)
+    size = results.stats()['bytes']
+    results.max_bytes = int(2.5*size)
+    results.put('b', value)
+    os.utime(tmp_path / 'a.mat', (1000, 1000))
+    os.utime(tmp_path / 'b.mat', (2000, 2000))
+    # reading marks a as the most recently used
+    assert results.get('a') is not None
+    results.put('c', value)
+    assert sorted(os.listdir(tmp_path)) == ['a.mat', 'c.mat']
+    assert results.evictions == 1
+    assert results.get('b') is None
+    np.testing.assert_array_equal(results.get('c')['u'], value['u'])
+    assert results.stats() == {'hits': 2, 'misses': 1, 'evictions': 1, 'entries': 2,
+                               'bytes': 2*size}
+    results.clear()
+    assert results.stats()['entries'] == 0
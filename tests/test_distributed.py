@@ -0,0 +1,99 @@
+import os
+import signal
+import time
+
+import numpy as np
+import pytest
+
+from PLS_wrapper import distributed, native
+
+NUM_SUBJ_LST = [6, 5]
+NUM_COND = 2
+
+def _data():
+    rng = np.random.default_rng(0)
+    num_rows = sum(NUM_SUBJ_LST)*NUM_COND
+    return rng.standard_normal((num_rows, 30)), rng.standard_normal((num_rows, 2))
+
+def _assert_same(a, b):
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for key in a:
+            _assert_same(a[key], b[key])
+    elif isinstance(a, list):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            _assert_same(x, y)
+    else:
+        np.testing.assert_array_equal(a, b)
+
+_perm_chunk = native.perm_chunk
+
+def _dying_perm_chunk(data, start, stop):
+    # the first worker to take the first chunk dies without a trace
+    if start == 0:
+        try:
+            os.close(os.open(os.environ['PLS_TEST_MARKER'], os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            pass
+        else:
+            os.kill(os.getpid(), signal.SIGKILL)
+    return _perm_chunk(data, start, stop)
+
+def _always_dying_chunk(data, start, stop):
+    os.kill(os.getpid(), signal.SIGKILL)
+
+def test_executor_matches_single_process():
+    datamat, behav = _data()
+    kwargs = dict(num_perm=30, num_split=4, num_boot=native.BOOT_SHARD_SIZE + 5, seed=2)
+    expected = native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, n_jobs=1, **kwargs)
+    with distributed.DistributedExecutor(local_workers=2, chunk_size=7, worker_timeout=5.0,
+                                         poll=0.1) as executor:
+        res = native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, executor=executor,
+                                  **kwargs)
+    _assert_same(res, expected)
+
+def test_chunks_of_killed_worker_are_reassigned(tmp_path, monkeypatch):
+    datamat, behav = _data()
+    monkeypatch.setenv('PLS_TEST_MARKER', str(tmp_path / 'killed'))
+    monkeypatch.setattr(native, 'perm_chunk', _dying_perm_chunk)
+    expected = native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, num_perm=30, seed=2)
+    with distributed.DistributedExecutor(local_workers=2, chunk_size=10, worker_timeout=1.0,
+                                         poll=0.1) as executor:
+        res = native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, num_perm=30, seed=2,
+                                  executor=executor)
+        assert sum(worker.is_alive() for worker in executor.workers) == 1
+    assert (tmp_path / 'killed').exists()
+    _assert_same(res, expected)
+
+def test_chunk_fails_after_max_attempts():
+    with distributed.DistributedExecutor(local_workers=2, worker_timeout=1.0, max_attempts=2,
+                                         poll=0.1) as executor:
+        with executor.scatter({}) as job:
+            with pytest.raises(RuntimeError, match='handed out 2 times'):
+                list(job.map(_always_dying_chunk, [(0, 1)]))
+
+def test_no_live_worker_raises():
+    datamat, behav = _data()
+    with distributed.DistributedExecutor(worker_timeout=0.5, poll=0.1) as executor:
+        start = time.monotonic()
+        with pytest.raises(RuntimeError, match='no live worker'):
+            native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, num_perm=10,
+                                executor=executor)
+        assert time.monotonic() - start < 10
+
+def test_task_board_requeues_chunks_of_silent_workers():
+    board = distributed.TaskBoard(worker_timeout=0.1)
+    job_id = board.add_job({'x': 1})
+    task_id, = board.submit(job_id, 'module:fn', [(0, 5)])
+    assert board.next_task('a', timeout=0)[0] == task_id
+    assert board.next_task('b', timeout=0) is None
+    time.sleep(0.15)
+    board.heartbeat('b')
+    assert board.next_task('b', timeout=0)[0] == task_id
+    # a late result of the dead worker is kept, the second one dropped
+    board.complete('a', task_id, True, 'a')
+    board.complete('b', task_id, True, 'b')
+    assert board.results(job_id, timeout=0) == {task_id: (True, 'a')}
+    board.close()
+    assert board.next_task('b', timeout=0) == 'stop'
@@ -0,0 +1,201 @@
+import gc
+import os
+import threading
+import time
+import weakref
+
+import pytest
+
+from PLS_wrapper import engine
+
+class FakeEngine:
+    """Stands in for a matlab engine, failing every call once `dead` is set.
+    """
+    def __init__(self):
+        self.dead = False
+        self.quit_calls = 0
+        self.paths = []
+
+    def _check(self):
+        if self.dead:
+            raise RuntimeError('MATLAB engine terminated')
+
+    def eval(self, expression, nargout=0):
+        self._check()
+
+    def addpath(self, path, nargout=0):
+        self._check()
+        self.paths.append(path)
+
+    def quit(self):
+        self.quit_calls += 1
+        self.dead = True
+
+@pytest.fixture
+def started():
+    """Install a fake engine factory, yielding the list of engines it started.
+    """
+    engines = []
+    def factory():
+        engines.append(FakeEngine())
+        return engines[-1]
+    previous = engine.set_engine_factory(factory)
+    try:
+        yield engines
+    finally:
+        engine.close_default_session()
+        engine._default_session = None
+        engine.set_engine_factory(previous)
+
+def test_set_engine_factory_restores_default():
+    previous = engine.set_engine_factory(FakeEngine)
+    assert engine.get_engine_factory() is FakeEngine
+    assert engine.set_engine_factory(None) is FakeEngine
+    assert engine.get_engine_factory() is engine._start_matlab
+    engine.set_engine_factory(previous)
+
+def test_session_starts_lazily_and_is_reused(started):
+    session = engine.MatlabSession()
+    assert not session.started and not started
+    with session.run() as first:
+        pass
+    with session.run() as second:
+        pass
+    assert first is second
+    assert len(started) == 1
+    assert session.is_alive()
+
+def test_session_restarts_after_failed_health_check(started):
+    session = engine.MatlabSession()
+    with session.run() as first:
+        pass
+    first.dead = True
+    assert not session.is_alive()
+    with session.run() as second:
+        pass
+    assert second is not first
+    assert len(started) == 2
+    assert first.quit_calls == 1
+
+def test_session_without_health_check_keeps_engine(started):
+    session = engine.MatlabSession(health_check=False)
+    with session.run() as first:
+        pass
+    first.dead = True
+    with session.run() as second:
+        pass
+    assert second is first
+
+def test_session_close_and_reuse(started):
+    with engine.MatlabSession() as session:
+        session.engine
+    assert not session.started
+    assert started[0].quit_calls == 1
+    session.engine
+    assert len(started) == 2
+    session.close()
+
+def test_session_factory_overrides_global(started):
+    own = FakeEngine()
+    session = engine.MatlabSession(factory=lambda: own)
+    assert session.engine is own
+    assert not started
+
+def test_pool_prefers_started_sessions(started):
+    with engine.EnginePool(size=3) as pool:
+        with pool.run() as first:
+            pass
+        with pool.run() as second:
+            pass
+        assert first is second
+        a = pool.acquire()
+        b = pool.acquire()
+        assert a.engine is first and b.engine is not first
+        pool.release(a)
+        pool.release(b)
+    assert len(started) == 2
+    assert all(eng.quit_calls == 1 for eng in started)
+
+def test_pool_acquire_times_out(started):
+    with engine.EnginePool(size=1) as pool:
+        session = pool.acquire()
+        with pytest.raises(TimeoutError):
+            pool.acquire(timeout=0.05)
+        released = threading.Timer(0.05, pool.release, [session])
+        released.start()
+        assert pool.acquire(timeout=5) is session
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+
+def test_pool_reaps_idle_engines(started):
+    with engine.EnginePool(size=2, idle_timeout=0.1) as pool:
+        with pool.run():
+            pass
+        deadline = time.monotonic() + 5
+        while started[0].quit_calls == 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert started[0].quit_calls == 1
+        # a reaped session starts a new engine when used again
+        with pool.run() as eng:
+            assert eng is started[1]
+
+def test_pool_does_not_reap_sessions_in_use(started):
+    with engine.EnginePool(size=1, idle_timeout=0.05) as pool:
+        with pool.run() as eng:
+            time.sleep(0.3)
+            assert eng.quit_calls == 0
+
+def test_unclosed_pool_is_collected(started):
+    pool = engine.EnginePool(size=1, idle_timeout=0.05)
+    with pool.run():
+        pass
+    ref, reaper = weakref.ref(pool), pool._reaper
+    del pool
+    gc.collect()
+    assert ref() is None
+    # the reaper stops once the pool is gone
+    reaper.join(timeout=5)
+    assert not reaper.is_alive()
+
+def test_pool_closes_sessions_released_after_close(started):
+    pool = engine.EnginePool(size=1)
+    session = pool.acquire()
+    session.engine
+    pool.close()
+    assert started[0].quit_calls == 0
+    pool.release(session)
+    assert started[0].quit_calls == 1
+
+def test_engine_context_uses_default_session(started):
+    with engine.engine_context() as first:
+        pass
+    with engine.engine_context(None) as second:
+        pass
+    assert first is second
+    assert engine.get_default_session().started
+    engine.close_default_session()
+    assert first.quit_calls == 1
+
+def test_engine_context_leaves_raw_engines_running(started):
+    eng = FakeEngine()
+    with engine.engine_context(eng) as yielded:
+        assert yielded is eng
+    assert eng.quit_calls == 0
+    assert not started
+
+def test_engine_context_returns_pool_sessions(started):
+    with engine.EnginePool(size=1) as pool:
+        with pytest.raises(ValueError):
+            with engine.engine_context(pool):
+                raise ValueError
+        # released despite the error
+        assert pool.acquire(timeout=0.05).started
+
+def test_install_helpers_once_per_engine(started):
+    eng = FakeEngine()
+    path = engine.install_helpers(eng)
+    assert engine.install_helpers(eng) == path
+    assert eng.paths == [path]
+    assert sorted(os.listdir(path)) == sorted(f'{name}.m' for name in engine.HELPER_FUNCTIONS)
+    del eng
+    assert not os.path.exists(path)
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from PLS_wrapper import matio
+
+VERSIONS = ['6', '7', pytest.param('7.3', marks=pytest.mark.skipif(
+    matio.h5py is None, reason='needs h5py'))]
+
+def _variables():
+    rng = np.random.default_rng(0)
+    return {
+        'single': rng.standard_normal((4, 3)).astype(np.float32),
+        'double': rng.standard_normal((2, 3, 2)),
+        'int32': np.arange(6, dtype=np.int32).reshape(2, 3),
+        'uint8': np.arange(5, dtype=np.uint8)[None, :],
+        'logical': np.array([[True, False, True]]),
+        'complex': (rng.standard_normal((2, 2)) + 1j*rng.standard_normal((2, 2))),
+        'scalar': 2.5,
+        'text': 'pls',
+        'cells': [np.ones((2, 2)), 'a', 3.0],
+        'struct': {
+            'method': 3.0,
+            'v': rng.standard_normal((3, 2)).astype(np.float32),
+            'nested': {'name': 'boot', 'samples': np.arange(4.0)[:, None]},
+        },
+    }
+
+def _assert_same(a, b):
+    if isinstance(a, dict):
+        assert sorted(a) == sorted(b)
+        for key in a:
+            _assert_same(a[key], b[key])
+    elif isinstance(a, list):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            _assert_same(x, y)
+    elif isinstance(a, np.ndarray):
+        assert isinstance(b, np.ndarray)
+        assert a.dtype == b.dtype
+        np.testing.assert_array_equal(a, b)
+    else:
+        assert a == b
+
+@pytest.mark.parametrize('version', VERSIONS)
+def test_round_trip(tmp_path, version):
+    variables = _variables()
+    path = str(tmp_path / 'model.mat')
+    matio.savemat(path, variables, version)
+    _assert_same(matio.loadmat(path), variables)
+
+@pytest.mark.skipif(matio.h5py is None, reason='needs h5py')
+def test_v73_structs_list_fields(tmp_path):
+    variables = _variables()
+    path = str(tmp_path / 'model.mat')
+    matio.savemat(path, variables, '7.3')
+    with matio.h5py.File(path, 'r') as f:
+        for name, expected in [('struct', ['method', 'v', 'nested']),
+                               ('struct/nested', ['name', 'samples'])]:
+            fields = f[name].attrs['MATLAB_fields']
+            assert fields.dtype == object
+            assert all(field.dtype == np.dtype('S1') for field in fields)
+            assert [b''.join(field).decode() for field in fields] == expected
+    # struct fields are read back in order
+    assert list(matio.loadmat(path)['struct']) == ['method', 'v', 'nested']
+
+@pytest.mark.parametrize('version', VERSIONS)
+def test_lazy_load(tmp_path, version):
+    variables = _variables()
+    path = str(tmp_path / 'model.mat')
+    matio.savemat(path, variables, version)
+    loaded = matio.loadmat(path, lazy=True)
+    assert hasattr(loaded['single'], 'load')
+    assert loaded['single'].shape == (4, 3)
+    assert loaded['scalar'] == 2.5
+    _assert_same(matio.resolve(loaded['single']), variables['single'])
+    _assert_same(matio.resolve(loaded['cells']), variables['cells'])
+    _assert_same(loaded['struct']['nested']['samples'].load(),
+                 variables['struct']['nested']['samples'])
+
+def test_python_scalars_are_written_as_double(tmp_path):
+    path = str(tmp_path / 'model.mat')
+    matio.savemat(path, {'n': 3, 'flag': True})
+    loaded = matio.loadmat(path)
+    assert loaded['n'] == 3.0 and isinstance(loaded['n'], float)
+    assert loaded['flag'] is True
+
+def test_rejects_files_that_are_not_mat(tmp_path):
+    path = tmp_path / 'model.mat'
+    path.write_bytes(b'not a mat file')
+    with pytest.raises(ValueError):
+        matio.loadmat(str(path))
+
+@pytest.mark.parametrize('version', ['6', '7'])
+def test_scipy_reads_our_files(tmp_path, version):
+    sio = pytest.importorskip('scipy.io')
+    variables = _variables()
+    path = str(tmp_path / 'model.mat')
+    matio.savemat(path, variables, version)
+    loaded = sio.loadmat(path, squeeze_me=False)
+    for name in ['single', 'double', 'int32', 'uint8', 'logical', 'complex']:
+        np.testing.assert_array_equal(loaded[name], variables[name])
+    assert loaded['single'].dtype == np.float32
+    assert loaded['text'][0] == 'pls'
+    assert loaded['scalar'][0, 0] == 2.5
+    np.testing.assert_array_equal(loaded['struct']['v'][0, 0], variables['struct']['v'])
+    np.testing.assert_array_equal(loaded['cells'][0, 0], variables['cells'][0])
+
+@pytest.mark.parametrize('do_compression', [False, True])
+def test_we_read_scipy_files(tmp_path, do_compression):
+    sio = pytest.importorskip('scipy.io')
+    rng = np.random.default_rng(1)
+    single = rng.standard_normal((3, 5)).astype(np.float32)
+    path = str(tmp_path / 'model.mat')
+    sio.savemat(path, {
+        'single': single,
+        'int16': np.arange(4, dtype=np.int16).reshape(2, 2),
+        'text': 'behavioural',
+        'struct': {'s': np.arange(3.0)[:, None], 'method': 3.0},
+        'cells': np.array([np.ones((2, 1)), 'b'], dtype=object),
+    }, do_compression=do_compression)
+    loaded = matio.loadmat(path)
+    _assert_same(loaded['single'], single)
+    _assert_same(loaded['int16'], np.arange(4, dtype=np.int16).reshape(2, 2))
+    assert loaded['text'] == 'behavioural'
+    _assert_same(loaded['struct'], {'s': np.arange(3.0)[:, None], 'method': 3.0})
+    _assert_same(loaded['cells'][0], np.ones((2, 1)))
+    assert loaded['cells'][1] == 'b'
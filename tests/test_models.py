@@ -0,0 +1,167 @@
+import copy
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from PLS_wrapper import matio, pls
+
+VERSIONS = ['6', '7', pytest.param('7.3', marks=pytest.mark.skipif(
+    matio.h5py is None, reason='needs h5py'))]
+
+@pytest.fixture(scope='module')
+def result():
+    rng = np.random.default_rng(0)
+    datamat = rng.standard_normal((20, 40))
+    behav = rng.standard_normal((20, 2))
+    return pls.pls_analysis([datamat], [5, 5], 2, behav, num_perm=10, num_boot=10, seed=1,
+                            backend='native')
+
+def _fields(res):
+    if isinstance(res, (pls.Dict2Object, pls.LazyResult)):
+        res = vars(res)
+    if isinstance(res, dict):
+        return {key: _fields(value) for key, value in res.items() if key != 'timings'}
+    if isinstance(res, list):
+        return [_fields(value) for value in res]
+    return res
+
+def _assert_same(a, b, check_dtype=True):
+    if isinstance(a, dict):
+        assert sorted(a) == sorted(b)
+        for key in a:
+            _assert_same(a[key], b[key], check_dtype)
+    elif isinstance(a, list):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            _assert_same(x, y, check_dtype)
+    elif isinstance(a, np.ndarray):
+        if check_dtype:
+            assert a.dtype == b.dtype
+        np.testing.assert_array_equal(a, b)
+    else:
+        assert a == b
+
+@pytest.mark.parametrize('version', VERSIONS)
+def test_mat_round_trip(tmp_path, result, version):
+    path = str(tmp_path / 'model.mat')
+    pls.save_pls_model(path, result, version=version)
+    _assert_same(_fields(pls.load_pls_model(path)), _fields(result))
+
+@pytest.mark.parametrize('version', VERSIONS)
+def test_lazy_load_matches_eager(tmp_path, result, version):
+    path = str(tmp_path / 'model.mat')
+    pls.save_pls_model(path, result, version=version)
+    res = pls.load_pls_model(path, lazy=True)
+    assert isinstance(res, pls.LazyResult)
+    assert not res._values
+    _assert_same(res.s, result.s)
+    assert list(res._values) == ['s']
+    _assert_same(_fields(res), _fields(result))
+
+@pytest.mark.parametrize('version', VERSIONS)
+def test_lazy_result_copies(tmp_path, result, version):
+    path = str(tmp_path / 'model.mat')
+    pls.save_pls_model(path, result, version=version)
+    res = pls.load_pls_model(path, lazy=True)
+    res.u
+    shallow = copy.copy(res)
+    assert isinstance(shallow, pls.LazyResult)
+    assert list(shallow._values) == ['u']
+    _assert_same(_fields(shallow), _fields(result))
+    for clone in [copy.deepcopy(res), pickle.loads(pickle.dumps(res))]:
+        # converted up front, no longer refers to the file
+        assert not clone._raw
+        _assert_same(_fields(clone), _fields(result))
+
+def test_lazy_result_attributes(tmp_path, result):
+    path = str(tmp_path / 'model.mat')
+    pls.save_pls_model(path, result, version='6')
+    res = pls.load_pls_model(path, lazy=True)
+    res.note = 'checked'
+    assert res.note == 'checked'
+    assert 'note' in dir(res) and 'boot_result' in dir(res)
+    del res.boot_result
+    with pytest.raises(AttributeError):
+        res.boot_result
+
+def test_compact_conversion(result):
+    compact = pls.PLS_result_conversion(result, convert_to='compact')
+    for field in ['bootsamp', 'bootsamp_4beh']:
+        indices = getattr(compact.boot_result, field)
+        assert indices.dtype == np.uint8
+        np.testing.assert_array_equal(indices, getattr(result.boot_result, field))
+    assert compact.perm_result.permsamp.dtype == np.uint8
+    assert compact.u.dtype == np.float32
+    _assert_same(_fields(compact), _fields(result), check_dtype=False)
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_npz_round_trip(tmp_path, result, compact):
+    path = str(tmp_path / 'model.npz')
+    pls.save_pls_model(path, result)
+    expected = pls.PLS_result_conversion(result, convert_to='compact') if compact else result
+    _assert_same(_fields(pls.load_pls_model(path, compact=compact)), _fields(expected))
+
+def test_npz_is_plain_numpy(tmp_path, result):
+    path = str(tmp_path / 'model.npz')
+    pls.save_pls_model(path, result)
+    with np.load(path, allow_pickle=False) as npz:
+        assert int(npz['__format__']) == pls.NPZ_FORMAT
+        np.testing.assert_array_equal(npz['boot_result.compare_u'],
+                                      result.boot_result.compare_u)
+
+def test_npz_rejects_other_archives(tmp_path):
+    path = str(tmp_path / 'other.npz')
+    np.savez(path, u=np.ones(3))
+    with pytest.raises(ValueError):
+        pls.load_pls_model(path)
+
+@pytest.mark.parametrize('version', ['6', '7'])
+def test_compact_lazy_load_matches_eager(tmp_path, result, version):
+    path = str(tmp_path / 'model.mat')
+    pls.save_pls_model(path, result, version=version)
+    _assert_same(_fields(pls.load_pls_model(path, lazy=True, compact=True)),
+                 _fields(pls.load_pls_model(path, compact=True)))
+
+def _flatten_types(res, prefix=''):
+    """Dotted field path to (type name, value) of every leaf of a result,
+    with list items as `path.0`, `path.1`, ...
+    """
+    if isinstance(res, (pls.Dict2Object, pls.LazyResult)):
+        res = vars(res)
+    items = res.items() if isinstance(res, dict) else enumerate(res)
+    flat = {}
+    for key, value in items:
+        path = f'{prefix}{key}'
+        if isinstance(value, (pls.Dict2Object, pls.LazyResult, dict, list)):
+            if isinstance(value, list):
+                flat[path] = ('list', len(value))
+            flat.update(_flatten_types(value, path + '.'))
+        else:
+            flat[path] = (type(value).__name__, value)
+    return flat
+
+def test_conversion_matches_recorded_result(fake_matlab):
+    """`tests/data/conversion_python.npz` holds the python conversion (field
+    types and values) of the engine-like result in `conversion_raw.mat`, as
+    recorded with this test's `_flatten_types`. Its values equal those of the
+    first release's conversion, which returned every array as float64.
+    """
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    raw = matio.loadmat(os.path.join(data, 'conversion_raw.mat'))['res']
+    flat = _flatten_types(pls.PLS_result_conversion(fake_matlab.to_engine(raw), 'python'))
+    with np.load(os.path.join(data, 'conversion_python.npz'), allow_pickle=False) as recorded:
+        types = dict(entry.split('=', 1) for entry in recorded['__types__'])
+        assert sorted(flat) == sorted(types)
+        for path, (type_name, value) in flat.items():
+            assert type_name == types[path], path
+            expected = recorded[path]
+            if isinstance(value, np.ndarray):
+                assert value.dtype == expected.dtype, path
+            np.testing.assert_array_equal(value, expected, err_msg=path)
+    # and back to matlab types, as saved
+    back = fake_matlab.from_engine(pls.PLS_result_conversion(
+        pls.PLS_result_conversion(fake_matlab.to_engine(raw), 'python'), 'matlab'))
+    _assert_same(back['u'], raw['u'])
+    _assert_same(back['boot_result']['bootsamp'], raw['boot_result']['bootsamp'])
@@ -0,0 +1,295 @@
+import numpy as np
+import pytest
+
+from PLS_wrapper import native
+
+NUM_SUBJ_LST = [6, 5]
+NUM_COND = 2
+
+def _data(num_vox=30, num_behav=2, seed=0):
+    rng = np.random.default_rng(seed)
+    num_rows = sum(NUM_SUBJ_LST)*NUM_COND
+    return rng.standard_normal((num_rows, num_vox)), rng.standard_normal((num_rows, num_behav))
+
+def _reference_xcor(behav, datamat, cormode):
+    n = behav.shape[0]
+    if cormode == 0:
+        full = np.corrcoef(behav.T, datamat.T)
+        return full[:behav.shape[1], behav.shape[1]:]
+    if cormode == 2:
+        full = np.cov(behav.T, datamat.T)
+        return full[:behav.shape[1], behav.shape[1]:]
+    if cormode == 4:
+        return (behav.T @ datamat) / np.outer(np.linalg.norm(behav, axis=0),
+                                              np.linalg.norm(datamat, axis=0))
+    assert cormode == 6
+    return np.einsum('ib,iv->bv', behav, datamat)
+
+def _reference_crosscorr(behav, datamat, cormode):
+    spans = native.condition_spans(NUM_SUBJ_LST, NUM_COND)
+    return np.concatenate([_reference_xcor(behav[s], datamat[s], cormode) for s in spans])
+
+def _assert_same(a, b):
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for key in a:
+            _assert_same(a[key], b[key])
+    elif isinstance(a, list):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            _assert_same(x, y)
+    else:
+        np.testing.assert_array_equal(a, b)
+
+@pytest.mark.parametrize('cormode', [0, 2, 4, 6])
+def test_xcor_matches_reference(cormode):
+    datamat, behav = _data()
+    np.testing.assert_allclose(native.xcor(behav, datamat, cormode),
+                               _reference_xcor(behav, datamat, cormode), atol=1e-12)
+
+def test_xcor_rejects_unknown_cormode():
+    datamat, behav = _data()
+    with pytest.raises(ValueError):
+        native.xcor(behav, datamat, 1)
+
+@pytest.mark.parametrize('cormode', [0, 2, 4, 6])
+def test_decomposition_matches_reference_svd(cormode):
+    datamat, behav = _data()
+    res = native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, cormode=cormode)
+    crosscorr = _reference_crosscorr(behav, datamat, cormode)
+    u, s, vt = np.linalg.svd(crosscorr.T, full_matrices=False)
+    # saliences are only defined up to the sign of each LV
+    signs = np.sign(np.sum(res['v'] * vt.T, axis=0))
+    np.testing.assert_allclose(res['s'][:, 0], s, rtol=1e-5)
+    np.testing.assert_allclose(res['v'] * signs, vt.T, atol=1e-5)
+    np.testing.assert_allclose(res['u'] * signs, u, atol=1e-5)
+    np.testing.assert_allclose(np.concatenate(res['datamatcorrs_lst']), crosscorr, atol=1e-5)
+
+@pytest.mark.parametrize('svd_solver', ['randomized', 'arpack'])
+def test_truncated_solvers_match_full(svd_solver):
+    pytest.importorskip('scipy')
+    rng = np.random.default_rng(1)
+    # a few dominant LVs over noise, as in real cross correlations
+    crosscorr = (rng.standard_normal((240, 3)) * [50, 30, 20]) @ rng.standard_normal((3, 500))
+    crosscorr += 0.1*rng.standard_normal((240, 500))
+    u, s, v = native.svd(crosscorr, 2, 'full')
+    u_t, s_t, v_t = native.svd(crosscorr, 2, svd_solver)
+    signs = np.sign(np.sum(v * v_t, axis=0))
+    np.testing.assert_allclose(s_t, s, rtol=1e-6)
+    np.testing.assert_allclose(v_t * signs, v, atol=1e-6)
+    np.testing.assert_allclose(u_t * signs, u, atol=1e-6)
+
+def test_resampling_does_not_depend_on_batching():
+    datamat, behav = _data()
+    kwargs = dict(num_perm=20, num_boot=2*native.BOOT_SHARD_SIZE + 5, seed=3)
+    base = native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav,
+                               batch_size=1, n_jobs=1, **kwargs)
+    for batch_size, n_jobs in [(7, 1), (None, 1), (1, 2), (None, 2)]:
+        res = native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav,
+                                  batch_size=batch_size, n_jobs=n_jobs, **kwargs)
+        _assert_same(res['perm_result'], base['perm_result'])
+        _assert_same(res['boot_result'], base['boot_result'])
+
+def _naive_perm_counts(datamat, behav, s, v, num_perm, seed, cormode):
+    """Permutation counts from one full SVD per permutation.
+    """
+    permsamp = native.perm_order(behav.shape[0], num_perm, seed)
+    sp = np.zeros(len(s))
+    for p in range(num_perm):
+        crosscorr = _reference_crosscorr(behav[permsamp[:, p]], datamat, cormode)
+        _, sperm, vperm = np.linalg.svd(crosscorr.T, full_matrices=False)
+        vperm = vperm[:len(s)].T * sperm[:len(s)]
+        rotated = vperm @ native.procrustes(v, vperm)
+        sp += np.sqrt((rotated**2).sum(axis=0)) >= s
+    return sp
+
+@pytest.mark.parametrize('cormode', [0, 2, 4, 6])
+def test_perm_test_matches_naive_loop(cormode):
+    datamat, behav = _data()
+    num_perm, seed = 25, 11
+    res = native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, num_perm=num_perm,
+                              cormode=cormode, seed=seed, batch_size=4)
+    s, v = np.ravel(res['s']), res['v']
+    sp = _naive_perm_counts(datamat, behav, s, v, num_perm, seed, cormode)
+    # make sure the test has counts to compare
+    assert 0 < sp.sum() < num_perm*len(s)
+    np.testing.assert_array_equal(res['perm_result']['sp'][:, 0], sp)
+    np.testing.assert_array_equal(res['perm_result']['sprob'][:, 0], sp / (num_perm + 1))
+
+def test_boot_redraws_degenerate_samples():
+    num_rows = sum(NUM_SUBJ_LST)*NUM_COND
+    behav = np.zeros((num_rows, 1))
+    # a single nonzero subject in each group and condition, so many draws miss it
+    for span in native.condition_spans(NUM_SUBJ_LST, NUM_COND):
+        behav[span.start] = 1.0
+    orders = native.checked_boot_order(behav, NUM_SUBJ_LST, NUM_COND, 20, seed=0)
+    spans = native.condition_spans(NUM_SUBJ_LST, NUM_COND)
+    for b in range(20):
+        assert not native.degenerate_behav(behav[orders['bootsamp_4beh'][:, b]], spans).any()
+    assert orders['countnewtotal'] > 0
+    # every redraw follows a draw degenerate in at least one group
+    assert orders['badbeh'].sum() >= orders['countnewtotal']
+    redrawn = (orders['bootsamp'] != orders['bootsamp_4beh']).any(axis=0).sum()
+    assert orders['num_LowVariability_behav_boots'][0] == redrawn
+
+def test_constant_behaviour_is_rejected():
+    datamat, behav = _data()
+    behav[:NUM_SUBJ_LST[0]] = 1.0
+    with pytest.raises(ValueError):
+        native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav)
+
+def _extend_inputs():
+    rng = np.random.default_rng(4)
+    num_rows = sum(NUM_SUBJ_LST)*NUM_COND
+    return [rng.standard_normal((num_rows, 30))], rng.standard_normal((num_rows, 2))
+
+def _assert_extended_matches(extended, single):
+    for field in ['num_perm', 'sp', 'permsamp', 'sprob']:
+        np.testing.assert_array_equal(getattr(extended.perm_result, field),
+                                      getattr(single.perm_result, field))
+    boot, single_boot = vars(extended.boot_result), vars(single.boot_result)
+    assert boot.keys() == single_boot.keys()
+    for field, value in single_boot.items():
+        if field in ['num_boot', 'boot_type', 'bootsamp', 'bootsamp_4beh', 'badbeh',
+                     'countnewtotal', 'num_LowVariability_behav_boots']:
+            np.testing.assert_array_equal(boot[field], value)
+        else:
+            np.testing.assert_allclose(boot[field], value, rtol=1e-5, atol=1e-6)
+
+def test_extended_result_matches_single_run(tmp_path):
+    from PLS_wrapper import pls
+    datamat_lst, behav = _extend_inputs()
+    kwargs = dict(seed=5, backend='native', keep_resample_state=True)
+    res = pls.pls_analysis(datamat_lst, NUM_SUBJ_LST, NUM_COND, behav, num_perm=100,
+                           num_boot=100, **kwargs)
+    single = pls.pls_analysis(datamat_lst, NUM_SUBJ_LST, NUM_COND, behav, num_perm=200,
+                              num_boot=200, **kwargs)
+    extended = pls.extend_pls_result(res, datamat_lst, extra_perm=100, extra_boot=100)
+    _assert_extended_matches(extended, single)
+
+    path = str(tmp_path / 'model.mat')
+    pls.save_pls_model(path, res)
+    extended = pls.extend_pls_result(pls.load_pls_model(path), datamat_lst, extra_perm=100,
+                                     extra_boot=100)
+    _assert_extended_matches(extended, single)
+
+def test_extend_needs_resample_state():
+    from PLS_wrapper import pls
+    datamat_lst, behav = _extend_inputs()
+    res = pls.pls_analysis(datamat_lst, NUM_SUBJ_LST, NUM_COND, behav, num_perm=10, seed=5,
+                           backend='native')
+    with pytest.raises(ValueError, match='keep_resample_state'):
+        pls.extend_pls_result(res, datamat_lst, extra_perm=10)
+
+def _naive_splithalf(datamat, behav, num_perm, num_split, seed, cormode):
+    """Split-half correlations of every outer permutation, re-splitting the
+    data and projecting each half on the outer LVs one split at a time.
+    """
+    num_rows = datamat.shape[0]
+    permsamp = native.perm_order(num_rows, num_perm, seed)
+    spans = native.condition_spans(NUM_SUBJ_LST, NUM_COND)
+    half_sizes = [[n // 2 for n in NUM_SUBJ_LST], [n - n // 2 for n in NUM_SUBJ_LST]]
+    ucorr, vcorr = [], []
+    for outer in range(num_perm + 1):
+        behav_p = behav[permsamp[:, outer - 1]] if outer else behav
+        u, _, vt = np.linalg.svd(_reference_crosscorr(behav_p, datamat, cormode).T,
+                                 full_matrices=False)
+        v = vt.T
+        halves = native.split_order(NUM_SUBJ_LST, NUM_COND, num_split, seed, outer)
+        outer_u, outer_v = [], []
+        for split in range(num_split):
+            projected = []
+            for half, rows in enumerate(halves):
+                rows = rows[split]
+                half_spans = native.condition_spans(half_sizes[half], NUM_COND)
+                crosscorr = np.concatenate([
+                    _reference_xcor(behav_p[rows][s], datamat[rows][s], cormode)
+                    for s in half_spans])
+                projected.append((crosscorr.T @ v, crosscorr @ u))
+            outer_u.append([np.corrcoef(projected[0][0][:, lv], projected[1][0][:, lv])[0, 1]
+                            for lv in range(v.shape[1])])
+            outer_v.append([np.corrcoef(projected[0][1][:, lv], projected[1][1][:, lv])[0, 1]
+                            for lv in range(v.shape[1])])
+        ucorr.append(np.array(outer_u))
+        vcorr.append(np.array(outer_v))
+    return ucorr, vcorr
+
+@pytest.mark.parametrize('cormode', [0, 2, 4, 6])
+def test_splithalf_matches_naive_loop(cormode):
+    datamat, behav = _data()
+    num_perm, num_split, seed = 6, 5, 7
+    res = native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, num_perm=num_perm,
+                              num_split=num_split, cormode=cormode, seed=seed)
+    ucorr, vcorr = _naive_splithalf(datamat, behav, num_perm, num_split, seed, cormode)
+    split = res['perm_splithalf']
+    np.testing.assert_allclose(split['orig_ucorr'][:, 0], ucorr[0].mean(axis=0), atol=1e-8)
+    np.testing.assert_allclose(split['orig_vcorr'][:, 0], vcorr[0].mean(axis=0), atol=1e-8)
+    for key, corr in [('ucorr', ucorr), ('vcorr', vcorr)]:
+        means = np.array([c.mean(axis=0) for c in corr])
+        prob = (means[1:] >= means[0]).sum(axis=0) / (num_perm + 1)
+        np.testing.assert_array_equal(split[f'{key}_prob'][:, 0], prob)
+        np.testing.assert_allclose(split[f'{key}_ll'][:, 0], np.percentile(corr[0], 2.5, axis=0),
+                                   atol=1e-8)
+        np.testing.assert_allclose(split[f'{key}_ul'][:, 0], np.percentile(corr[0], 97.5, axis=0),
+                                   atol=1e-8)
+
+def test_split_order_halves_partition_subjects():
+    first, second = native.split_order(NUM_SUBJ_LST, NUM_COND, 4, seed=0, outer=2)
+    num_rows = sum(NUM_SUBJ_LST)*NUM_COND
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(np.sort(np.concatenate([a, b])), np.arange(num_rows))
+        assert len(a) == sum(n // 2 for n in NUM_SUBJ_LST)*NUM_COND
+
+def test_splithalf_does_not_depend_on_n_jobs():
+    datamat, behav = _data()
+    kwargs = dict(num_perm=6, num_split=5, seed=7)
+    base = native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, n_jobs=1, **kwargs)
+    res = native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, n_jobs=2,
+                              batch_size=2, **kwargs)
+    _assert_same(res['perm_splithalf'], base['perm_splithalf'])
+
+def _streamed_inputs(tmp_path, datamat):
+    path = str(tmp_path / 'datamat.npy')
+    np.save(path, datamat)
+
+    def chunks():
+        for start in range(0, datamat.shape[1], 4):
+            yield datamat[:, start:start + 4]
+    return {
+        'path': [path],
+        'memmap': [np.load(path, mmap_mode='r')],
+        'callable': [chunks],
+    }
+
+@pytest.mark.parametrize('kind', ['path', 'memmap', 'callable'])
+def test_streamed_input_matches_in_memory(tmp_path, kind):
+    from PLS_wrapper.profiling import Timings
+    datamat, behav = _data(num_vox=23)
+    kwargs = dict(num_perm=10, num_boot=native.BOOT_SHARD_SIZE + 3, seed=4)
+    expected = native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, **kwargs)
+    timings = Timings()
+    res = native.pls_analysis(_streamed_inputs(tmp_path, datamat)[kind], NUM_SUBJ_LST,
+                              NUM_COND, behav, block_size=7, timings=timings, **kwargs)
+    for key in ['u', 's', 'v', 'usc', 'vsc', 'lvcorrs']:
+        np.testing.assert_allclose(res[key], expected[key], rtol=1e-4, atol=1e-5)
+    np.testing.assert_array_equal(res['perm_result']['permsamp'],
+                                  expected['perm_result']['permsamp'])
+    np.testing.assert_array_equal(res['perm_result']['sp'], expected['perm_result']['sp'])
+    boot, expected_boot = res['boot_result'], expected['boot_result']
+    np.testing.assert_array_equal(boot['bootsamp'], expected_boot['bootsamp'])
+    for key in ['u_se', 'compare_u', 'distrib']:
+        np.testing.assert_allclose(boot[key], expected_boot[key], rtol=1e-4, atol=1e-5)
+    totals = {(e['stage'], e['total']) for e in timings.events if e['event'] == 'progress'}
+    # chunk generators only give their number of columns after the first pass
+    assert totals == {('stream_pass_1', None if kind == 'callable' else 23),
+                      ('stream_pass_2', 23)}
+
+@pytest.mark.parametrize('option', [{'num_split': 4}, {'executor': object()}])
+def test_streamed_input_rejects_in_memory_options(tmp_path, option):
+    datamat, behav = _data()
+    with pytest.raises(ValueError, match='streamed datamats'):
+        native.pls_analysis(_streamed_inputs(tmp_path, datamat)['path'], NUM_SUBJ_LST,
+                            NUM_COND, behav, num_perm=4, **option)
+    with pytest.raises(ValueError, match='streamed datamats'):
+        native.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, num_perm=4,
+                            block_size=8, **option)
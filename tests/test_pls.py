@@ -0,0 +1,178 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import CancelledError
+
+import numpy as np
+import pytest
+
+from PLS_wrapper import engine, pls
+
+NUM_SUBJ_LST = [5, 5]
+NUM_COND = 2
+
+def _data(num_vox=40):
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((20, num_vox)), rng.standard_normal((20, 2))
+
+def _assert_same(a, b):
+    if isinstance(a, (pls.Dict2Object, pls.LazyResult)):
+        a, b = vars(a), vars(b)
+    if isinstance(a, dict):
+        a = {key: value for key, value in a.items() if key != 'timings'}
+        b = {key: value for key, value in b.items() if key != 'timings'}
+        assert sorted(a) == sorted(b)
+        for key in a:
+            _assert_same(a[key], b[key])
+    elif isinstance(a, list):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            _assert_same(x, y)
+    else:
+        np.testing.assert_array_equal(a, b)
+
+def _wait_for_children(timeout=10):
+    deadline = time.monotonic() + timeout
+    while multiprocessing.active_children() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return not multiprocessing.active_children()
+
+def test_async_native_matches_sync():
+    datamat, behav = _data()
+    kwargs = dict(num_perm=10, num_boot=10, seed=3, backend='native')
+    expected = pls.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, **kwargs)
+    future = pls.pls_analysis_async([datamat], NUM_SUBJ_LST, NUM_COND, behav, timings=True,
+                                    **kwargs)
+    res = future.result(timeout=60)
+    _assert_same(res, expected)
+    # events recorded in the worker process are sent back
+    assert {'permutation', 'bootstrap', 'conversion'} <= set(res.timings.seconds())
+
+def test_async_can_be_awaited():
+    datamat, behav = _data()
+    kwargs = dict(num_perm=5, seed=3, backend='native')
+    expected = pls.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, **kwargs)
+
+    async def main():
+        return await pls.pls_analysis_async([datamat], NUM_SUBJ_LST, NUM_COND, behav, **kwargs)
+    _assert_same(asyncio.run(main()), expected)
+
+def test_async_timeout_stops_the_analysis():
+    datamat, behav = _data(num_vox=2000)
+    future = pls.pls_analysis_async([datamat], NUM_SUBJ_LST, NUM_COND, behav, num_boot=100000,
+                                    seed=3, backend='native', timeout=0.5)
+    with pytest.raises(TimeoutError):
+        future.result(timeout=30)
+    assert _wait_for_children()
+
+def test_async_cancel_stops_a_running_analysis():
+    datamat, behav = _data(num_vox=2000)
+    future = pls.pls_analysis_async([datamat], NUM_SUBJ_LST, NUM_COND, behav, num_boot=100000,
+                                    seed=3, backend='native')
+    deadline = time.monotonic() + 30
+    while not multiprocessing.active_children() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert future.cancel()
+    assert future.cancelled()
+    with pytest.raises(CancelledError):
+        future.result()
+    assert _wait_for_children()
+
+def test_async_rejects_executor():
+    datamat, behav = _data()
+    with pytest.raises(ValueError, match='executor'):
+        pls.pls_analysis_async([datamat], NUM_SUBJ_LST, NUM_COND, behav, backend='native',
+                               executor=object())
+
+@pytest.mark.parametrize('transfer', ['buffer', 'file'])
+def test_async_matlab_matches_sync(fake_matlab, transfer):
+    datamat, behav = _data()
+    kwargs = dict(num_perm=5, num_boot=5, seed=3, backend='matlab', transfer=transfer)
+    expected = pls.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, **kwargs)
+    res = pls.pls_analysis_async([datamat], NUM_SUBJ_LST, NUM_COND, behav, timings=True,
+                                 **kwargs).result(timeout=60)
+    _assert_same(res, expected)
+    assert {'engine', 'transfer', 'matlab', 'conversion'} <= set(res.timings.seconds())
+    # the staged variables are cleared
+    assert not engine.get_default_session().engine.workspace
+
+def _batch_jobs():
+    rng = np.random.default_rng(1)
+    behav = rng.standard_normal((20, 3))
+    return [dict(job_id=f'cormode{c}_behav{b}', datamat='X', num_subj_lst=NUM_SUBJ_LST,
+                 num_cond=NUM_COND, stacked_behavdata=behav[:, [b]], cormode=c, num_perm=5,
+                 num_boot=5, seed=2)
+            for c in [0, 2] for b in range(2)]
+
+def _single_run(job, datamat, backend):
+    kwargs = {key: value for key, value in job.items()
+              if key not in ['job_id', 'datamat', 'num_subj_lst', 'num_cond',
+                             'stacked_behavdata']}
+    return pls.pls_analysis([datamat], job['num_subj_lst'], job['num_cond'],
+                            job['stacked_behavdata'], backend=backend, **kwargs)
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_batch_native_matches_single_runs(tmp_path, n_workers):
+    datamat, _ = _data()
+    jobs = _batch_jobs()
+    seen = []
+    results = dict(pls.pls_analysis_batch(jobs, datamats={'X': datamat}, backend='native',
+        n_workers=n_workers, callback=lambda job_id, res: seen.append(job_id)))
+    assert sorted(seen) == sorted(results) == sorted(job['job_id'] for job in jobs)
+    for job in jobs:
+        _assert_same(results[job['job_id']], _single_run(job, datamat, 'native'))
+
+def test_batch_manifest_resumes_matching_jobs(tmp_path):
+    datamat, _ = _data()
+    jobs = _batch_jobs()
+    manifest = str(tmp_path / 'sweep.jsonl')
+    first = dict(pls.pls_analysis_batch(jobs[:3], datamats={'X': datamat}, backend='native',
+                                        manifest=manifest))
+    assert sorted(os.listdir(tmp_path / 'sweep')) == sorted(f'{j}.mat' for j in first)
+    # one changed job and one new one are run, the others loaded
+    jobs[0] = dict(jobs[0], num_perm=6)
+    resumed = list(pls.pls_analysis_batch(jobs, datamats={'X': datamat}, backend='native',
+                                          manifest=manifest))
+    loaded = [job_id for job_id, res in resumed if isinstance(res, pls.LazyResult)]
+    assert loaded == [jobs[1]['job_id'], jobs[2]['job_id']]
+    results = dict(resumed)
+    for job in jobs:
+        _assert_same(results[job['job_id']], _single_run(job, datamat, 'native'))
+    assert results[jobs[0]['job_id']].perm_result.num_perm == 6
+
+def test_batch_manifests_sharing_a_directory(tmp_path):
+    datamat, _ = _data()
+    jobs = _batch_jobs()[:1]
+    other = [dict(jobs[0], cormode=6)]
+    first = str(tmp_path / 'first.jsonl')
+    second = str(tmp_path / 'second.jsonl')
+    list(pls.pls_analysis_batch(jobs, datamats={'X': datamat}, backend='native',
+                                manifest=first))
+    list(pls.pls_analysis_batch(other, datamats={'X': datamat}, backend='native',
+                                manifest=second))
+    (job_id, res), = pls.pls_analysis_batch(jobs, datamats={'X': datamat}, backend='native',
+                                            manifest=first)
+    assert isinstance(res, pls.LazyResult)
+    _assert_same(res, _single_run(jobs[0], datamat, 'native'))
+
+@pytest.mark.parametrize('transfer', ['buffer', 'file'])
+def test_batch_matlab_matches_single_runs(tmp_path, fake_matlab, transfer):
+    datamat, _ = _data()
+    jobs = _batch_jobs()
+    # one job with its own datamat
+    jobs.append(dict(jobs[0], job_id='own', datamat=datamat))
+    manifest = str(tmp_path / 'sweep.jsonl')
+    results = dict(pls.pls_analysis_batch(jobs, datamats={'X': datamat}, backend='matlab',
+        n_workers=2, manifest=manifest, transfer=transfer))
+    for job in jobs:
+        _assert_same(results[job['job_id']], _single_run(job, datamat, 'matlab'))
+    resumed = dict(pls.pls_analysis_batch(jobs, datamats={'X': datamat}, backend='matlab',
+                                          manifest=manifest, transfer=transfer))
+    assert all(isinstance(res, pls.LazyResult) for res in resumed.values())
+
+def test_batch_matlab_rejects_native_options(fake_matlab):
+    datamat, _ = _data()
+    jobs = [dict(_batch_jobs()[0], block_size=10)]
+    with pytest.raises(ValueError, match='block_size'):
+        pls.pls_analysis_batch(jobs, datamats={'X': datamat}, backend='matlab')
@@ -0,0 +1,114 @@
+import io
+import json
+import pickle
+
+import numpy as np
+import pytest
+
+from PLS_wrapper import pls
+from PLS_wrapper.profiling import NULL_TIMINGS, Timings, make_timings, nbytes
+
+NUM_SUBJ_LST = [5, 5]
+NUM_COND = 2
+
+def test_stage_records_seconds_and_bytes():
+    timings = Timings(labels={'job': 'a'})
+    with timings.stage('transfer', 100) as info:
+        info['bytes'] += 20
+    with timings.stage('svd'):
+        pass
+    with pytest.raises(RuntimeError):
+        with timings.stage('svd'):
+            raise RuntimeError
+    assert [e['stage'] for e in timings.events] == ['transfer', 'svd', 'svd']
+    assert all(e['event'] == 'stage' and e['job'] == 'a' for e in timings.events)
+    assert timings.bytes() == {'transfer': 120}
+    seconds = timings.seconds()
+    assert seconds.keys() == {'transfer', 'svd'}
+    assert seconds['svd'] == pytest.approx(timings.events[1]['seconds'] +
+                                           timings.events[2]['seconds'])
+
+def test_progress_and_record():
+    timings = Timings()
+    timings.progress('permutation', 3, 10)
+    timings.progress('stream_pass_1', 5, None)
+    other = Timings(labels={'worker': 1})
+    with other.stage('bootstrap', 8):
+        pass
+    for event in other.events:
+        timings.record(event)
+    assert [(e['event'], e['stage']) for e in timings.events] == [
+        ('progress', 'permutation'), ('progress', 'stream_pass_1'), ('stage', 'bootstrap')]
+    assert (timings.events[0]['done'], timings.events[0]['total']) == (3, 10)
+    assert timings.events[1]['total'] is None
+    assert timings.events[2]['worker'] == 1
+    assert timings.bytes() == {'bootstrap': 8}
+    # recording copies the event
+    assert timings.events[2] is not other.events[0]
+
+def test_log_and_callback(tmp_path):
+    seen = []
+    path = str(tmp_path / 'events.jsonl')
+    stream = io.StringIO()
+    timings = Timings(callback=seen.append, log=path)
+    streamed = Timings(log=stream)
+    for t in [timings, streamed]:
+        with t.stage('svd'):
+            pass
+        t.progress('permutation', 1, 2)
+    assert seen == timings.events
+    with open(path) as f:
+        assert [json.loads(line) for line in f] == timings.events
+    assert [json.loads(line) for line in stream.getvalue().splitlines()] == streamed.events
+    # pickles without the callback or an open stream
+    copy = pickle.loads(pickle.dumps(timings))
+    assert copy.events == timings.events and copy.callback is None and copy.log == path
+    assert pickle.loads(pickle.dumps(streamed)).log is None
+    assert json.loads(timings.to_json())['events'] == timings.events
+
+def test_make_timings():
+    assert make_timings(None) is NULL_TIMINGS
+    assert make_timings(False) is NULL_TIMINGS
+    assert isinstance(make_timings(True), Timings)
+    timings = Timings()
+    assert make_timings(timings) is timings
+    seen = []
+    made = make_timings(seen.append)
+    made.progress('bootstrap', 1, 1)
+    assert len(seen) == 1
+    with pytest.raises(TypeError):
+        make_timings('yes')
+
+def test_null_timings_records_nothing():
+    with NULL_TIMINGS.stage('svd', 10) as info:
+        info['bytes'] = 5
+    NULL_TIMINGS.progress('permutation', 1, 2)
+    assert not hasattr(NULL_TIMINGS, 'events')
+
+def test_nbytes():
+    arr = np.zeros((4, 5))
+    assert nbytes({'a': arr, 'b': [arr, (arr, 'x')], 'c': 1}) == 3*arr.nbytes
+
+def test_native_analysis_timings():
+    rng = np.random.default_rng(0)
+    datamat, behav = rng.standard_normal((20, 40)), rng.standard_normal((20, 2))
+    seen = []
+    res = pls.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, num_perm=7, num_boot=5,
+                           seed=1, backend='native', timings=seen.append)
+    timings = res.timings
+    assert seen == timings.events
+    assert {'crosscorr', 'svd', 'scores', 'permutation', 'bootstrap', 'conversion'} <= \
+        set(timings.seconds())
+    assert timings.bytes()['crosscorr'] == datamat.nbytes
+    progress = [e for e in timings.events if e['event'] == 'progress']
+    assert {(e['stage'], e['total']) for e in progress} == {('permutation', 7), ('bootstrap', 5)}
+    for stage, total in [('permutation', 7), ('bootstrap', 5)]:
+        done = [e['done'] for e in progress if e['stage'] == stage]
+        assert done == sorted(done) and done[-1] == total
+
+def test_analysis_without_timings_has_no_attribute():
+    rng = np.random.default_rng(0)
+    datamat, behav = rng.standard_normal((20, 40)), rng.standard_normal((20, 2))
+    res = pls.pls_analysis([datamat], NUM_SUBJ_LST, NUM_COND, behav, num_perm=2,
+                           backend='native')
+    assert not hasattr(res, 'timings')
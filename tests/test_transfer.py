@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from PLS_wrapper import transfer
+
+def _arrays():
+    rng = np.random.default_rng(0)
+    arr = rng.standard_normal((7, 5))
+    return {
+        'c_order': arr,
+        'fortran_order': np.asfortranarray(arr),
+        'strided': rng.standard_normal((9, 12))[::2, 1::3],
+        'row': arr[:1],
+        'column': arr[:, :1],
+    }
+
+@pytest.fixture
+def eng(fake_matlab):
+    return fake_matlab.start_matlab()
+
+@pytest.mark.parametrize('put_method', ['buffer', 'file'])
+@pytest.mark.parametrize('get_method', ['buffer', 'file'])
+@pytest.mark.parametrize('matlab_class', ['double', 'single'])
+def test_round_trip(eng, put_method, get_method, matlab_class):
+    for label, arr in _arrays().items():
+        transfer.put(eng, 'x', arr, method=put_method, matlab_class=matlab_class)
+        assert eng.eval('class(x)') == matlab_class
+        out = transfer.get(eng, 'x', method=get_method)
+        dtype = np.float64 if matlab_class == 'double' else np.float32
+        assert out.dtype == dtype, label
+        np.testing.assert_array_equal(out, arr.astype(dtype), err_msg=label)
+        # a copy the caller owns
+        assert out.flags.writeable
+
+def test_file_put_reads_streamed_datamats(eng, tmp_path):
+    arr = _arrays()['c_order']
+    path = str(tmp_path / 'datamat.npy')
+    np.save(path, arr)
+    transfer.put(eng, 'x', path, method='file')
+    np.testing.assert_array_equal(transfer.get(eng, 'x'), arr)
+
+def test_file_staging_quotes_paths(eng, tmp_path):
+    tmp_dir = tmp_path / "subject's data"
+    tmp_dir.mkdir()
+    arr = _arrays()['fortran_order']
+    transfer.put(eng, 'x', arr, method='file', tmp_dir=str(tmp_dir))
+    np.testing.assert_array_equal(transfer.get(eng, 'x', method='file', tmp_dir=str(tmp_dir)),
+                                  arr)
+    # staging files are removed
+    assert not list(tmp_dir.iterdir())
+
+def test_from_matlab_does_not_copy_engine_storage(fake_matlab):
+    arr = _arrays()['c_order']
+    value = transfer.to_matlab(arr)
+    assert value.size == arr.shape
+    out = transfer.from_matlab(value)
+    np.testing.assert_array_equal(out, arr)
+    assert np.shares_memory(out, np.frombuffer(value._data))
+    assert transfer.from_matlab(value, dtype=np.float32).dtype == np.float32